@@ -1,3 +1,8 @@
 from .parser import *
 from .addrspace_axes import *
 from .vmmap import *
+from .checkpoint import *
+from .columns import *
+from .opcode_index import *
+from .shadow_memory import *
+from .cache import *
@@ -436,6 +436,7 @@ class AddressSpaceAxes(axes.Axes):
         assert len(existing_range) < 2, "Too many overlapping ranges %s, %s" % (
             existing_range, target_range)
         try:
+            target_list.remove(existing_range[0])
             target_range = existing_range[0] + target_range
         except IndexError:
             pass
@@ -467,7 +468,7 @@ class AddressSpaceAxes(axes.Axes):
             # type of complement regions
             c_rtype = Range.T_OMIT
 
-        regions.sort(key=attrgetter("start"))
+        # regions are sorted by start address
         logger.debug("Found %d regions for %s: %s", len(regions), map_range, regions)
         mapped = []
         complement = []
@@ -499,10 +500,7 @@ class AddressSpaceAxes(axes.Axes):
         logger.debug("Mapped: %s", mapped)
         logger.debug("Complement: %s", complement)
 
-        ranges = RangeSet(mapped + complement)
-        # XXX may keep the lists separated to avoid the need to sort
-        ranges.sort(key=attrgetter("start"))
-        return ranges
+        return RangeSet(mapped + complement)
 
     def set_omit_ranges(self, ranges):
         """
@@ -591,46 +589,273 @@ class Range:
         return hash(self.start) ^ hash(self.end) ^ hash(self.rtype)
 
 
-class RangeSet(list):
+class _RangeNode:
     """
-    Represent a list ranges that can be searched for overlaps
+    Node of the :class:`RangeSet` interval tree.
+
+    The start and end of the range are copied in the node when the range
+    is inserted, the range must be removed and inserted again if
+    its boundaries change.
     """
 
-    def __init__(self, *args):
-        super(RangeSet, self).__init__(*args)
+    __slots__ = ("start", "end", "seq", "range", "left", "right",
+                 "height", "max_end")
+
+    def __init__(self, target, seq):
+        self.start = target.start
+        self.end = target.end
+        self.seq = seq
+        """Insertion sequence number, orders ranges with the same start"""
+        self.range = target
+        self.left = None
+        self.right = None
+        self.height = 1
+        self.max_end = target.end
+        """Largest end address in the subtree rooted at this node"""
+
+    @property
+    def key(self):
+        return (self.start, self.seq)
+
+
+class RangeSet:
+    """
+    Represent a set of ranges that can be searched for overlaps
+
+    The ranges are held in an AVL tree ordered by start address and
+    augmented with the maximum end address of each subtree, so that
+    insertion, removal and overlap queries take O(log n) plus
+    the number of ranges reported.
+    Iterating over the set yields the ranges sorted by start address.
+    Ranges with the same start are kept in insertion order.
+    """
+
+    def __init__(self, ranges=()):
+        self._root = None
+        """Root node of the tree"""
+
+        self._nodes = {}
+        """Map the id of each range in the set to its tree node"""
+
+        self._seq = 0
+        """Sequence number of the next inserted range"""
+
+        nodes = []
+        for r in ranges:
+            nodes.append(self._new_node(r))
+        nodes.sort(key=attrgetter("start"))
+        self._root = self._build(nodes, 0, len(nodes))
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        stack = []
+        node = self._root
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                yield node.range
+                node = node.right
+
+    def __contains__(self, target):
+        return id(target) in self._nodes
+
+    def __repr__(self):
+        return "RangeSet(%s)" % list(self)
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def append(self, target):
+        """
+        Add a range to the set.
+        A range object can be in the set only once.
+        """
+        node = self._new_node(target)
+        self._root = self._insert(self._root, node)
+
+    add = append
+
+    def extend(self, ranges):
+        for r in ranges:
+            self.append(r)
+
+    def remove(self, target):
+        """
+        Remove a range from the set, raise ValueError if
+        the range is not in the set.
+        """
+        try:
+            node = self._nodes.pop(id(target))
+        except KeyError:
+            raise ValueError("%s not in RangeSet" % target)
+        self._root = self._delete(self._root, node.key)
 
     def match_overlap(self, addr):
         """
         Return the list of ranges containing addr
         """
-        range_ = Range(addr, addr)
-        return self.match_overlap_range(ranges, range_)
+        return self.match_overlap_range(Range(addr, addr + 1))
 
     def match_overlap_range(self, target):
         """
-        Return the list of ranges overlapping target
+        Return the list of ranges overlapping target, sorted by
+        start address
         XXX ranges are considered to be open, no overlapping
         occurs if the ranges are contiguous.
         """
-        overlaps = [r for r in self if (r.start < target.end and
-                                        r.end > target.start)]
-        return RangeSet(overlaps)
+        overlaps = []
+        self._collect(self._root, target.start, target.end, overlaps)
+        return overlaps
 
     def first_overlap_range(self, target):
         """
-        Return the first range in the set that overlaps target
+        Return the range with the lowest start address that
+        overlaps target
         """
-        for r in self:
-            if (r.start < target.end and r.end > target.start):
-                return r
-        return None
+        node = self._first(self._root, target.start, target.end)
+        if node is None:
+            return None
+        return node.range
 
     def pop_overlap_range(self, target):
         """
-        Return the index of the first range in the set 
+        Remove and return the range with the lowest start address
         that overlaps target
         """
-        for i,r in enumerate(self):
-            if (r.start < target.end and r.end > target.start):
-                return self.pop(i)
-        return None
+        node = self._first(self._root, target.start, target.end)
+        if node is None:
+            return None
+        del self._nodes[id(node.range)]
+        self._root = self._delete(self._root, node.key)
+        return node.range
+
+    def _new_node(self, target):
+        if id(target) in self._nodes:
+            raise ValueError("%s is already in the RangeSet" % target)
+        node = _RangeNode(target, self._seq)
+        self._seq += 1
+        self._nodes[id(target)] = node
+        return node
+
+    def _build(self, nodes, lo, hi):
+        """Build a balanced subtree from the sorted nodes[lo:hi]"""
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        node = nodes[mid]
+        node.left = self._build(nodes, lo, mid)
+        node.right = self._build(nodes, mid + 1, hi)
+        self._update(node)
+        return node
+
+    def _collect(self, node, start, end, overlaps):
+        if node is None or node.max_end <= start:
+            return
+        self._collect(node.left, start, end, overlaps)
+        if node.start >= end:
+            # everything in the right subtree starts after end
+            return
+        if node.end > start:
+            overlaps.append(node.range)
+        self._collect(node.right, start, end, overlaps)
+
+    def _first(self, node, start, end):
+        if node is None or node.max_end <= start:
+            return None
+        found = self._first(node.left, start, end)
+        if found is not None:
+            return found
+        if node.start >= end:
+            return None
+        if node.end > start:
+            return node
+        return self._first(node.right, start, end)
+
+    def _insert(self, node, new_node):
+        if node is None:
+            return new_node
+        if new_node.key < node.key:
+            node.left = self._insert(node.left, new_node)
+        else:
+            node.right = self._insert(node.right, new_node)
+        return self._rebalance(node)
+
+    def _delete(self, node, key):
+        node_key = node.key
+        if key < node_key:
+            node.left = self._delete(node.left, key)
+        elif key > node_key:
+            node.right = self._delete(node.right, key)
+        else:
+            if node.left is None:
+                return node.right
+            if node.right is None:
+                return node.left
+            # replace the node with its successor
+            right, successor = self._pop_min(node.right)
+            successor.left = node.left
+            successor.right = right
+            node = successor
+        return self._rebalance(node)
+
+    def _pop_min(self, node):
+        """Detach the leftmost node of a subtree"""
+        if node.left is None:
+            return node.right, node
+        node.left, min_node = self._pop_min(node.left)
+        return self._rebalance(node), min_node
+
+    @staticmethod
+    def _height(node):
+        return node.height if node is not None else 0
+
+    @staticmethod
+    def _update(node):
+        left = node.left
+        right = node.right
+        height = 0
+        max_end = node.end
+        if left is not None:
+            height = left.height
+            if left.max_end > max_end:
+                max_end = left.max_end
+        if right is not None:
+            height = max(height, right.height)
+            if right.max_end > max_end:
+                max_end = right.max_end
+        node.height = height + 1
+        node.max_end = max_end
+
+    def _rotate_left(self, node):
+        pivot = node.right
+        node.right = pivot.left
+        pivot.left = node
+        self._update(node)
+        self._update(pivot)
+        return pivot
+
+    def _rotate_right(self, node):
+        pivot = node.left
+        node.left = pivot.right
+        pivot.right = node
+        self._update(node)
+        self._update(pivot)
+        return pivot
+
+    def _rebalance(self, node):
+        self._update(node)
+        balance = self._height(node.left) - self._height(node.right)
+        if balance > 1:
+            if self._height(node.left.left) < self._height(node.left.right):
+                node.left = self._rotate_left(node.left)
+            return self._rotate_right(node)
+        if balance < -1:
+            if self._height(node.right.right) < self._height(node.right.left):
+                node.right = self._rotate_right(node.right)
+            return self._rotate_left(node)
+        return node
@@ -0,0 +1,490 @@
+#-
+# Copyright (c) 2017 Alfredo Mazzinghi
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# @BERI_LICENSE_HEADER_START@
+#
+# Licensed to BERI Open Systems C.I.C. (BERI) under one or more contributor
+# license agreements.  See the NOTICE file distributed with this work for
+# additional information regarding copyright ownership.  BERI licenses this
+# file to you under the BERI Hardware-Software License, Version 1.0 (the
+# "License"); you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at:
+#
+#   http://www.beri-open-systems.org/legal/license-1-0.txt
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @BERI_LICENSE_HEADER_END@
+#
+
+
+"""
+Cache of the datasets derived from a trace.
+
+Cached files are stored in a cache directory shared by all the traces,
+each entry is identified by a digest of the trace, the class that
+produces the data, its version and its options.
+"""
+
+import os
+import shutil
+import pickle
+import hashlib
+import logging
+
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("TraceFingerprint", "CacheEntry", "CacheManager",
+           "get_cache_manager", "set_cache_manager")
+
+
+def _remove(path):
+    """Remove a cache file or directory."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _writer_alive(path):
+    """
+    Check whether the process that writes a temporary cache file
+    is still running, the pid is part of the file name.
+    """
+    try:
+        pid = int(os.path.basename(path).split(".")[1])
+    except (IndexError, ValueError):
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _size(path):
+    """Size in bytes of a cache file or directory."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, dirs, files in os.walk(path) for name in files)
+
+
+class TraceFingerprint:
+    """
+    Cheap identification of the content of a trace file.
+
+    The fingerprint is made of the size and modification time of the
+    file, of a hash of the trace header and of a hash of the end of
+    the trace, it does not read the whole trace.
+    """
+
+    header_size = 2**16
+    """Number of bytes at the start of the trace that are hashed."""
+
+    tail_size = 2**16
+    """Number of bytes at the end of the trace that are hashed."""
+
+    def __init__(self, path):
+        """
+        :param path: trace file path
+        :type path: str
+        """
+        stat = os.stat(path)
+
+        self.path = os.path.realpath(path)
+        """Canonical path of the trace."""
+
+        self.size = stat.st_size
+        """Size of the trace file."""
+
+        self.mtime = stat.st_mtime_ns
+        """Modification time of the trace file in nanoseconds."""
+
+        with open(path, "rb") as fd:
+            header = fd.read(self.header_size)
+            self.tail = self._hash_tail(fd, self.size)
+            """Hash of the last block of the trace."""
+
+        self.header = hashlib.sha1(header).hexdigest()
+        """Hash of the trace header."""
+
+    @classmethod
+    def _hash_tail(cls, fd, end):
+        """Hash the block of the file that ends at the given offset."""
+        start = max(0, end - cls.tail_size)
+        fd.seek(start)
+        return hashlib.sha1(fd.read(end - start)).hexdigest()
+
+    @property
+    def identity(self):
+        """
+        Identity of the trace, this does not change when entries
+        are appended to the trace.
+        """
+        return (self.path, self.header)
+
+    def __eq__(self, other):
+        return (self.identity == other.identity and
+                self.size == other.size and self.mtime == other.mtime)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def is_prefix_of(self, other):
+        """
+        Check whether the trace with this fingerprint is a prefix
+        of the trace with the other fingerprint, i.e. entries have
+        been appended to the trace.
+
+        :param other: fingerprint of the current trace
+        :type other: :class:`TraceFingerprint`
+        :return: True if the other trace extends this trace
+        :rtype: bool
+        """
+        if self.identity != other.identity or self.size >= other.size:
+            return False
+        # the end of this trace must still be there in the other trace
+        try:
+            with open(other.path, "rb") as fd:
+                return self._hash_tail(fd, self.size) == self.tail
+        except IOError:
+            return False
+
+    def __repr__(self):
+        return "<TraceFingerprint %s size=%d mtime=%d %s>" % (
+            self.path, self.size, self.mtime, self.header)
+
+
+class CacheEntry:
+    """
+    A cached file of the :class:`CacheManager`.
+
+    The data file is written by the producer at :attr:`path`, a
+    metadata file next to it records the fingerprint of the trace
+    when the data was produced. The entry is valid only if the
+    fingerprint matches the current trace.
+    """
+
+    def __init__(self, manager, digest, fingerprint, description,
+                 suffix=""):
+        self.manager = manager
+        """The cache manager that owns the entry."""
+
+        self.digest = digest
+        """Digest that identifies the entry."""
+
+        self.fingerprint = fingerprint
+        """Fingerprint of the current trace."""
+
+        self.description = description
+        """Human readable description of the entry key."""
+
+        self.path = os.path.join(manager.cache_dir, digest + suffix)
+        """Path of the data file."""
+
+        self.meta_path = os.path.join(manager.cache_dir, digest + ".meta")
+        """Path of the metadata file."""
+
+    def _load_meta(self):
+        try:
+            with open(self.meta_path, "rb") as fd:
+                return pickle.load(fd)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _check(self, appended):
+        if not self.manager.enabled:
+            return False
+        meta = self._load_meta()
+        if meta is None or not os.path.exists(self.path):
+            return False
+        cached = meta["fingerprint"]
+        if cached == self.fingerprint:
+            valid = not appended
+        elif cached.is_prefix_of(self.fingerprint):
+            valid = appended
+        else:
+            logger.info("Stale cache entry %s", self.description)
+            self.invalidate()
+            return False
+        if valid:
+            self.manager.touch(self)
+        return valid
+
+    def is_valid(self):
+        """
+        Check whether the cached data has been produced from the
+        current trace, a stale entry is removed.
+
+        :return: True if the cached data can be used
+        :rtype: bool
+        """
+        return self._check(appended=False)
+
+    def is_appended(self):
+        """
+        Check whether the cached data has been produced from a trace
+        that has since been extended with new entries.
+
+        :return: True if the cached data can be updated with the
+        appended entries
+        :rtype: bool
+        """
+        return self._check(appended=True)
+
+    @contextmanager
+    def write(self):
+        """
+        Context manager that gives a temporary path where the data
+        is written, the temporary file replaces the entry when the
+        context exits without errors.
+
+        The temporary file has the same suffix of the entry so that
+        libraries that choose the file format from the file name
+        can write to it.
+        """
+        base, suffix = os.path.splitext(self.path)
+        tmp_path = "%s.%d.tmp%s" % (base, os.getpid(), suffix)
+        tmp_meta = "%s.%d.tmp.meta" % (base, os.getpid())
+        os.makedirs(self.manager.cache_dir, exist_ok=True)
+        try:
+            yield tmp_path
+            meta = {"fingerprint": self.fingerprint,
+                    "description": self.description}
+            with open(tmp_meta, "wb") as fd:
+                pickle.dump(meta, fd, pickle.HIGHEST_PROTOCOL)
+            # the entry is not valid while the data is replaced
+            _remove(self.meta_path)
+            _remove(self.path)
+            os.replace(tmp_path, self.path)
+            os.replace(tmp_meta, self.meta_path)
+        finally:
+            for path in (tmp_path, tmp_meta):
+                _remove(path)
+        logger.debug("Saved cache entry %s", self.description)
+        self.manager.evict(keep=self)
+
+    def load_pickle(self):
+        """
+        Load the pickled data of the entry.
+
+        :return: the unpickled object
+        """
+        with open(self.path, "rb") as fd:
+            return pickle.load(fd)
+
+    def save_pickle(self, data):
+        """
+        Pickle the data to the entry.
+
+        :param data: object to pickle
+        """
+        with self.write() as path:
+            with open(path, "wb") as fd:
+                pickle.dump(data, fd, pickle.HIGHEST_PROTOCOL)
+
+    def invalidate(self):
+        """Remove the entry from the cache."""
+        for path in (self.meta_path, self.path):
+            _remove(path)
+
+    def size(self):
+        """
+        :return: size in bytes of the entry files
+        :rtype: int
+        """
+        return sum(_size(path)
+                   for path in (self.meta_path, self.path)
+                   if os.path.exists(path))
+
+
+class CacheManager:
+    """
+    Store the datasets derived from traces in a cache directory.
+
+    An entry is identified by the trace identity (path and header hash),
+    the producer class, the producer version, the name of the dataset
+    and the producer options. The producer version is the
+    ``cache_version`` attribute of the producer class, it must be
+    bumped when the produced data changes.
+    The total size of the cache is bounded, the least recently used
+    entries are removed first.
+    """
+
+    default_max_size = 8 * 2**30
+    """Default size limit of the cache directory in bytes."""
+
+    def __init__(self, cache_dir=None, max_size=None, enabled=True):
+        """
+        :param cache_dir: cache directory, by default this is taken
+        from the CHERIPLOT_CACHE_DIR environment variable or
+        ~/.cache/cheriplot
+        :type cache_dir: str
+        :param max_size: size limit of the cache in bytes, by default
+        this is taken from the CHERIPLOT_CACHE_SIZE environment variable
+        or :attr:`default_max_size`
+        :type max_size: int
+        :param enabled: if False no entry is ever valid
+        :type enabled: bool
+        """
+        if cache_dir is None:
+            cache_dir = os.environ.get(
+                "CHERIPLOT_CACHE_DIR",
+                os.path.join(os.path.expanduser("~"), ".cache", "cheriplot"))
+        if max_size is None:
+            max_size = int(os.environ.get("CHERIPLOT_CACHE_SIZE",
+                                          self.default_max_size))
+
+        self.cache_dir = cache_dir
+        """Directory holding the cache entries."""
+
+        self.max_size = max_size
+        """Size limit of the cache directory in bytes."""
+
+        self.enabled = enabled
+        """Is the cache in use?"""
+
+    def entry(self, tracefile, producer, name, options=None, suffix=""):
+        """
+        Return the cache entry of a dataset derived from a trace.
+
+        :param tracefile: trace file path
+        :type tracefile: str
+        :param producer: the object or class that produces the data
+        :param name: name of the dataset, a producer may cache
+        multiple datasets
+        :type name: str
+        :param options: producer options that change the data
+        :type options: dict
+        :param suffix: extension of the data file
+        :type suffix: str
+        :return: the cache entry
+        :rtype: :class:`CacheEntry`
+        """
+        fingerprint = TraceFingerprint(tracefile)
+        cls = producer if isinstance(producer, type) else type(producer)
+        key = (fingerprint.identity,
+               "%s.%s" % (cls.__module__, cls.__qualname__),
+               getattr(cls, "cache_version", 0), name,
+               sorted((options or {}).items()))
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        description = "%s %s %s of %s" % (cls.__qualname__, name,
+                                          options or "", tracefile)
+        return CacheEntry(self, digest, fingerprint, description, suffix)
+
+    def touch(self, entry):
+        """
+        Mark an entry as used.
+
+        :param entry: the cache entry
+        :type entry: :class:`CacheEntry`
+        """
+        os.utime(entry.meta_path)
+
+    def entries(self):
+        """
+        Return the entries in the cache directory from the least
+        recently used.
+
+        :return: list of (last use time, size, paths of the entry files)
+        :rtype: list
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        files = {}
+        for filename in os.listdir(self.cache_dir):
+            digest = filename.split(".", 1)[0]
+            files.setdefault(digest, []).append(
+                os.path.join(self.cache_dir, filename))
+        entries = []
+        for digest, paths in files.items():
+            if any(".tmp" in path for path in paths):
+                # entry being written
+                continue
+            entries.append((max(os.path.getmtime(p) for p in paths),
+                            sum(_size(p) for p in paths), paths))
+        entries.sort(key=lambda entry: entry[0])
+        return entries
+
+    def remove_orphans(self):
+        """
+        Remove the temporary files left by writers that did not
+        finish, they would hide their entry from :meth:`entries`.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+            if ".tmp" in filename and not _writer_alive(path):
+                logger.info("Remove orphaned cache file %s", path)
+                _remove(path)
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache
+        fits the size limit.
+
+        :param keep: entry that is never removed
+        :type keep: :class:`CacheEntry`
+        """
+        self.remove_orphans()
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, paths in entries:
+            if total <= self.max_size:
+                break
+            if keep is not None and keep.meta_path in paths:
+                continue
+            logger.info("Evict cache entry %s", paths[0])
+            for path in paths:
+                _remove(path)
+            total -= size
+
+    def clear(self):
+        """Remove all the entries from the cache."""
+        self.remove_orphans()
+        for _, _, paths in self.entries():
+            for path in paths:
+                _remove(path)
+
+
+_cache_manager = None
+
+
+def get_cache_manager():
+    """
+    Return the cache manager used by plots and parsers, a manager
+    with the default settings is created the first time.
+
+    :rtype: :class:`CacheManager`
+    """
+    global _cache_manager
+    if _cache_manager is None:
+        _cache_manager = CacheManager()
+    return _cache_manager
+
+
+def set_cache_manager(manager):
+    """
+    Set the cache manager used by plots and parsers.
+
+    :param manager: the cache manager
+    :type manager: :class:`CacheManager`
+    """
+    global _cache_manager
+    _cache_manager = manager
@@ -0,0 +1,172 @@
+#-
+# Copyright (c) 2017 Alfredo Mazzinghi
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# @BERI_LICENSE_HEADER_START@
+#
+# Licensed to BERI Open Systems C.I.C. (BERI) under one or more contributor
+# license agreements.  See the NOTICE file distributed with this work for
+# additional information regarding copyright ownership.  BERI licenses this
+# file to you under the BERI Hardware-Software License, Version 1.0 (the
+# "License"); you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at:
+#
+#   http://www.beri-open-systems.org/legal/license-1-0.txt
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @BERI_LICENSE_HEADER_END@
+#
+
+"""
+Register-state checkpoints used to start parsing in the middle of a trace.
+"""
+
+import pickle
+import logging
+
+from bisect import bisect_right
+
+logger = logging.getLogger(__name__)
+
+
+class CapRegisterSnapshot:
+    """
+    Copy of a :class:`pycheritrace.capability_register` that can
+    be pickled.
+    """
+
+    def __init__(self, cap):
+        """
+        :param cap: capability register value
+        :type cap: :class:`pycheritrace.capability_register`
+        """
+        self.base = cap.base
+        self.length = cap.length
+        self.offset = cap.offset
+        self.permissions = cap.permissions
+        self.type = cap.type
+        self.valid = cap.valid
+        self.unsealed = cap.unsealed
+
+
+class RegisterSetSnapshot:
+    """
+    Copy of a :class:`pycheritrace.register_set` that can be pickled.
+
+    The snapshot can be used by the parser callbacks in place of
+    the pycheritrace register set.
+    """
+
+    def __init__(self, regs):
+        """
+        :param regs: register set
+        :type regs: :class:`pycheritrace.register_set`
+        """
+        self.gpr = [regs.gpr[idx] for idx in range(31)]
+        """General purpose registers $1-$31."""
+
+        self.valid_gprs = [regs.valid_gprs[idx] for idx in range(31)]
+        """Valid bit of each general purpose register."""
+
+        self.cap_reg = [CapRegisterSnapshot(regs.cap_reg[idx])
+                        for idx in range(32)]
+        """Capability registers $c0-$c31."""
+
+        self.valid_caps = [regs.valid_caps[idx] for idx in range(32)]
+        """Valid bit of each capability register."""
+
+
+class Checkpoint:
+    """
+    Parser state before the execution of a trace entry.
+    """
+
+    def __init__(self, idx, cycles, regs, state):
+        self.idx = idx
+        """Index of the trace entry."""
+
+        self.cycles = cycles
+        """Cycle count of the trace entry."""
+
+        self.regs = regs
+        """
+        :class:`.RegisterSetSnapshot` of the register set before the
+        execution of the entry.
+        """
+
+        self.state = state
+        """Parser-specific state blob."""
+
+
+class CheckpointIndex:
+    """
+    Sorted collection of checkpoints taken every N entries during
+    a full scan of a trace, this is stored in a sidecar file of the trace.
+    """
+
+    def __init__(self, interval):
+        """
+        :param interval: number of trace entries between checkpoints
+        :type interval: int
+        """
+        self.interval = interval
+        """Number of trace entries between checkpoints."""
+
+        self.checkpoints = []
+        """List of :class:`.Checkpoint` sorted by entry index."""
+
+        self.keys = []
+        """Entry index of each checkpoint, used to bisect the list."""
+
+    def __len__(self):
+        return len(self.checkpoints)
+
+    def add(self, checkpoint):
+        """
+        Append a checkpoint, checkpoints must be added in trace order.
+
+        :param checkpoint: the checkpoint to add
+        :type checkpoint: :class:`.Checkpoint`
+        """
+        if self.checkpoints and self.checkpoints[-1].idx >= checkpoint.idx:
+            raise ValueError("Checkpoint at %d added out of order" %
+                             checkpoint.idx)
+        self.checkpoints.append(checkpoint)
+        self.keys.append(checkpoint.idx)
+
+    def nearest(self, idx):
+        """
+        Find the closest checkpoint before the given trace entry.
+
+        :param idx: trace entry index
+        :type idx: int
+        :return: the checkpoint or None if there is no checkpoint
+        before the entry
+        :rtype: :class:`.Checkpoint`
+        """
+        pos = bisect_right(self.keys, idx)
+        if pos == 0:
+            return None
+        return self.checkpoints[pos - 1]
+
+    def save(self, path):
+        """Save the checkpoints to the given sidecar file."""
+        with open(path, "wb") as fd:
+            pickle.dump(self, fd, pickle.HIGHEST_PROTOCOL)
+        logger.info("Saved %d checkpoints to %s", len(self), path)
+
+    @classmethod
+    def load(cls, path):
+        """Load the checkpoints from the given sidecar file."""
+        with open(path, "rb") as fd:
+            index = pickle.load(fd)
+        logger.info("Loaded %d checkpoints from %s", len(index), path)
+        return index
@@ -0,0 +1,268 @@
+#-
+# Copyright (c) 2017 Alfredo Mazzinghi
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# @BERI_LICENSE_HEADER_START@
+#
+# Licensed to BERI Open Systems C.I.C. (BERI) under one or more contributor
+# license agreements.  See the NOTICE file distributed with this work for
+# additional information regarding copyright ownership.  BERI licenses this
+# file to you under the BERI Hardware-Software License, Version 1.0 (the
+# "License"); you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at:
+#
+#   http://www.beri-open-systems.org/legal/license-1-0.txt
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @BERI_LICENSE_HEADER_END@
+#
+
+"""
+Columnar copy of the scalar fields of the trace entries.
+
+The fields are extracted once in numpy files in a sidecar directory of
+the trace, tools that only need scalar per-entry fields can then use
+vectorized operations on the memory-mapped columns instead of scanning
+the trace.
+"""
+
+import os
+import shutil
+import logging
+import numpy as np
+
+from collections import OrderedDict
+
+from cheriplot.utils import ProgressPrinter
+from cheriplot.core.parser import TraceParser
+
+logger = logging.getLogger(__name__)
+
+TRACE_COLUMNS = OrderedDict([
+    ("pc", np.uint64),
+    ("cycles", np.uint64),
+    ("inst", np.uint32),
+    ("asid", np.uint16),
+    ("exception", np.uint8),
+    ("memory_address", np.uint64),
+    ("is_load", np.bool_),
+    ("is_store", np.bool_),
+    ("is_kernel", np.bool_),
+    ("gpr_number", np.int8),
+    ("capreg_number", np.int8),
+])
+"""Name and dtype of the trace entry fields that are extracted."""
+
+
+def get_columns_path(trace_path):
+    """
+    Return the path of the columns sidecar directory of a trace.
+    """
+    return trace_path + "_columns"
+
+
+def match_windows(indices, before, after, start, end):
+    """
+    Expand each matching trace entry index to a window of entries around
+    it and merge the windows that overlap or are adjacent.
+
+    :param indices: sorted array of matching entry indices
+    :type indices: :class:`numpy.ndarray`
+    :param before: number of entries to include before each match
+    :type before: int
+    :param after: number of entries to include after each match
+    :type after: int
+    :param start: first valid entry index
+    :type start: int
+    :param end: last valid entry index
+    :type end: int
+    :return: list of (start, end) ranges, the end is inclusive
+    :rtype: list of tuples
+    """
+    if len(indices) == 0:
+        return []
+    low = np.maximum(indices.astype(np.int64) - before, start)
+    high = np.minimum(indices.astype(np.int64) + after, end)
+    # a new window starts where it does not touch the previous one
+    breaks = np.flatnonzero(low[1:] > high[:-1] + 1)
+    starts = low[np.concatenate(([0], breaks + 1))]
+    ends = high[np.concatenate((breaks, [len(high) - 1]))]
+    return [(int(s), int(e)) for s, e in zip(starts, ends)]
+
+
+class TraceColumnExtractor(TraceParser):
+    """
+    Extract the scalar fields of every trace entry in the columns
+    sidecar directory of the trace.
+
+    Each field in :data:`TRACE_COLUMNS` is stored in a separate
+    ".npy" file that can be memory-mapped by :class:`.TraceColumns`.
+    """
+
+    def __init__(self, trace_path, path=None, block_size=2**16, **kwargs):
+        """
+        :param trace_path: path of the trace file
+        :type trace_path: str
+        :param path: sidecar directory, by default this is next to the trace
+        :type path: str
+        :param block_size: number of entries buffered before
+        writing them to the column files
+        :type block_size: int
+        """
+        super(TraceColumnExtractor, self).__init__(trace_path, **kwargs)
+
+        self.columns_path = path or get_columns_path(trace_path)
+        """Path of the sidecar directory."""
+
+        self.block_size = block_size
+        """Number of entries buffered before writing to the column files."""
+
+        self.progress = ProgressPrinter(len(self), desc="Extract columns")
+        """Progress object."""
+
+    def extract(self):
+        """
+        Scan the whole trace and write the column files.
+
+        The columns are written to a temporary directory that replaces
+        the sidecar directory only when the extraction is complete.
+
+        :return: the extracted columns
+        :rtype: :class:`.TraceColumns`
+        """
+        n_entries = len(self)
+        tmp_path = self.columns_path + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        outputs = OrderedDict()
+        for name, dtype in TRACE_COLUMNS.items():
+            outputs[name] = np.lib.format.open_memmap(
+                os.path.join(tmp_path, name + ".npy"), mode="w+",
+                dtype=dtype, shape=(n_entries,))
+        block_dtype = np.dtype(list(TRACE_COLUMNS.items()))
+        block = []
+        offset = [0]
+
+        def _flush():
+            data = np.array(block, dtype=block_dtype)
+            begin = offset[0]
+            for name, column in outputs.items():
+                column[begin:begin + len(data)] = data[name]
+            offset[0] += len(data)
+            self.progress.advance(to=offset[0])
+            del block[:]
+
+        def _scan(entry, regs, idx):
+            block.append((entry.pc, entry.cycles, entry.inst, entry.asid,
+                          entry.exception, entry.memory_address,
+                          entry.is_load, entry.is_store, entry.is_kernel(),
+                          entry.gpr_number(), entry.capreg_number()))
+            if len(block) >= self.block_size:
+                _flush()
+            return False
+
+        if n_entries > 0:
+            self.trace.scan(_scan, 0, n_entries - 1, 0)
+        if block:
+            _flush()
+        self.progress.finish()
+        if offset[0] != n_entries:
+            logger.error("Extracted %d entries, trace size is %d",
+                         offset[0], n_entries)
+            raise RuntimeError("Incomplete column extraction")
+        for column in outputs.values():
+            column.flush()
+        del outputs
+
+        if os.path.exists(self.columns_path):
+            shutil.rmtree(self.columns_path)
+        os.rename(tmp_path, self.columns_path)
+        logger.info("Extracted %d entries to %s", n_entries, self.columns_path)
+        return TraceColumns(self.columns_path)
+
+
+class TraceColumns:
+    """
+    Memory-mapped columns of the trace entry fields generated by
+    :class:`.TraceColumnExtractor`.
+
+    Columns are accessed by name, e.g. columns["pc"] or columns.pc,
+    and are read-only numpy arrays indexed by trace entry index.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the sidecar directory
+        :type path: str
+        """
+        self.path = path
+        """Path of the sidecar directory."""
+
+        self._columns = {}
+        """Memory-mapped columns by name."""
+
+        for name in TRACE_COLUMNS:
+            column_file = os.path.join(path, name + ".npy")
+            self._columns[name] = np.load(column_file, mmap_mode="r")
+
+    @classmethod
+    def open(cls, trace_path):
+        """
+        Open the columns of the given trace if they have been extracted.
+
+        :param trace_path: path of the trace file
+        :type trace_path: str
+        :return: the columns or None if the sidecar does not exist
+        :rtype: :class:`.TraceColumns`
+        """
+        path = get_columns_path(trace_path)
+        if not os.path.isdir(path):
+            return None
+        return cls(path)
+
+    def __len__(self):
+        return len(self._columns["pc"])
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["_columns"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def in_range(self, name, low=None, high=None, start=0, end=None):
+        """
+        Return a mask of the entries where the given column is
+        within the [low, high] interval.
+
+        :param name: column name
+        :type name: str
+        :param low: lower bound, None means unbounded
+        :param high: upper bound, None means unbounded
+        :param start: index of the first entry of the mask
+        :type start: int
+        :param end: index of the last entry of the mask (inclusive)
+        :type end: int
+        :return: boolean mask for the entries in [start, end]
+        :rtype: :class:`numpy.ndarray`
+        """
+        if end is None:
+            end = len(self) - 1
+        column = self._columns[name][start:end + 1]
+        mask = np.ones(len(column), dtype=np.bool_)
+        if low is not None:
+            mask &= column >= low
+        if high is not None:
+            mask &= column <= high
+        return mask
@@ -0,0 +1,227 @@
+#-
+# Copyright (c) 2017 Alfredo Mazzinghi
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# @BERI_LICENSE_HEADER_START@
+#
+# Licensed to BERI Open Systems C.I.C. (BERI) under one or more contributor
+# license agreements.  See the NOTICE file distributed with this work for
+# additional information regarding copyright ownership.  BERI licenses this
+# file to you under the BERI Hardware-Software License, Version 1.0 (the
+# "License"); you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at:
+#
+#   http://www.beri-open-systems.org/legal/license-1-0.txt
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @BERI_LICENSE_HEADER_END@
+#
+
+"""
+Inverted index from instruction opcodes to the trace entries that
+execute them.
+"""
+
+import os
+import shutil
+import pickle
+import logging
+import numpy as np
+
+from cheriplot.core.parser import DecodeCache, Instruction
+from cheriplot.core.columns import match_windows
+
+logger = logging.getLogger(__name__)
+
+
+def get_opcode_index_path(trace_path):
+    """
+    Return the path of the opcode index sidecar directory of a trace.
+    """
+    return trace_path + "_opcodes"
+
+
+class OpcodeIndex:
+    """
+    Sorted arrays of trace entry indices for each opcode found in
+    a trace, stored in a sidecar directory of the trace.
+
+    The entry indices of all the opcodes are stored in a single
+    memory-mapped array grouped by opcode, each opcode maps to the
+    slice of the array that holds its entries. Entries with an
+    instruction that can not be disassembled are grouped under the
+    None opcode.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the sidecar directory
+        :type path: str
+        """
+        self.path = path
+        """Path of the sidecar directory."""
+
+        with open(os.path.join(path, "opcodes.pickle"), "rb") as fd:
+            meta = pickle.load(fd)
+
+        self.size = meta["size"]
+        """Number of entries in the indexed trace."""
+
+        self._slices = meta["slices"]
+        """Map each opcode to the (begin, end) slice of the indices."""
+
+        self._indices = np.load(os.path.join(path, "indices.npy"),
+                                mmap_mode="r")
+        """Entry indices grouped by opcode and sorted."""
+
+    @classmethod
+    def build(cls, columns, path, decoder=None):
+        """
+        Build the index from the instruction words of the trace.
+
+        Each distinct instruction word is disassembled only once.
+
+        :param columns: the columns extracted from the trace
+        :type columns: :class:`cheriplot.core.columns.TraceColumns`
+        :param path: path of the sidecar directory
+        :type path: str
+        :param decoder: decoder used for the instruction words
+        :type decoder: :class:`cheriplot.core.parser.DecodeCache`
+        :return: the opcode index
+        :rtype: :class:`.OpcodeIndex`
+        """
+        if decoder is None:
+            decoder = DecodeCache()
+        words, inverse = np.unique(columns.inst, return_inverse=True)
+        opcodes = []
+        opcode_ids = {}
+        word_opcode = np.empty(len(words), dtype=np.int64)
+        for word_id, word in enumerate(words):
+            opcode = decoder.decode(int(word)).opcode
+            if opcode not in opcode_ids:
+                opcode_ids[opcode] = len(opcodes)
+                opcodes.append(opcode)
+            word_opcode[word_id] = opcode_ids[opcode]
+        entry_opcode = word_opcode[inverse.reshape(-1)]
+        # stable sort keeps the entries of each opcode in trace order
+        order = np.argsort(entry_opcode, kind="stable")
+        bounds = np.concatenate(([0], np.cumsum(
+            np.bincount(entry_opcode, minlength=len(opcodes)))))
+        slices = {opcode: (int(bounds[op_id]), int(bounds[op_id + 1]))
+                  for op_id, opcode in enumerate(opcodes)}
+
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "indices.npy"), order)
+        with open(os.path.join(tmp_path, "opcodes.pickle"), "wb") as fd:
+            pickle.dump({"size": len(columns), "slices": slices}, fd,
+                        pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+        logger.info("Indexed %d opcodes for %d entries in %s",
+                    len(opcodes), len(columns), path)
+        return cls(path)
+
+    @classmethod
+    def open(cls, trace_path):
+        """
+        Open the opcode index of the given trace if it has been built.
+
+        :param trace_path: path of the trace file
+        :type trace_path: str
+        :return: the index or None if the sidecar does not exist
+        :rtype: :class:`.OpcodeIndex`
+        """
+        path = get_opcode_index_path(trace_path)
+        if not os.path.isdir(path):
+            return None
+        return cls(path)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def opcodes(self):
+        """List of the opcodes found in the trace."""
+        return list(self._slices.keys())
+
+    def count(self, opcode):
+        """Return the number of entries with the given opcode."""
+        begin, end = self._slices.get(opcode, (0, 0))
+        return end - begin
+
+    def find(self, opcode, start=None, end=None):
+        """
+        Return the sorted indices of the entries with the given opcode.
+
+        :param opcode: instruction opcode
+        :type opcode: str
+        :param start: index of the first entry to consider
+        :type start: int
+        :param end: index of the last entry to consider (inclusive)
+        :type end: int
+        :return: array of entry indices
+        :rtype: :class:`numpy.ndarray`
+        """
+        begin, stop = self._slices.get(opcode, (0, 0))
+        indices = self._indices[begin:stop]
+        if start is not None:
+            indices = indices[np.searchsorted(indices, start, "left"):]
+        if end is not None:
+            indices = indices[:np.searchsorted(indices, end, "right")]
+        return indices
+
+    def find_any(self, opcodes, start=None, end=None):
+        """
+        Return the sorted indices of the entries with any of the
+        given opcodes.
+
+        See :meth:`.OpcodeIndex.find`.
+        """
+        found = [self.find(opcode, start, end) for opcode in opcodes
+                 if opcode in self._slices]
+        if len(found) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(found), kind="mergesort")
+
+    def find_iclass(self, iclass, start=None, end=None):
+        """
+        Return the sorted indices of the entries with an opcode in
+        the given instruction class.
+
+        :param iclass: instruction class
+        :type iclass: :class:`cheriplot.core.parser.Instruction.IClass`
+        See :meth:`.OpcodeIndex.find`.
+        """
+        return self.find_any(Instruction.iclass_map[iclass], start, end)
+
+    def find_ranges(self, opcodes, start, end):
+        """
+        Return the ranges of entries to scan to visit all the entries
+        with any of the given opcodes.
+
+        Each range starts at the entry before a match, so that the
+        register set before the matching entry is scanned as well.
+
+        :param opcodes: list of instruction opcodes
+        :type opcodes: list of str
+        :param start: index of the first entry to consider
+        :type start: int
+        :param end: index of the last entry to consider (inclusive)
+        :type end: int
+        :return: list of (start, end) ranges, the end is inclusive
+        :rtype: list of tuples
+        """
+        indices = self.find_any(opcodes, start, end)
+        return match_windows(indices, 1, 0, start, end)
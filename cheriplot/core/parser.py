@@ -30,22 +30,23 @@ Parser for cheri trace files based on the cheritrace library.
 """
 
 import os
-import math
-import numpy as np
 import exrex
+import queue
 import logging
+import threading
+import multiprocessing
+import numpy as np
 
 import pycheritrace as pct
 
 from enum import Enum
+from collections import OrderedDict
 from cached_property import cached_property
 from itertools import chain
 
-# experimental
-from multiprocessing import RawValue, Process
-from ctypes import py_object
-
 from cheriplot.utils import ProgressPrinter
+from cheriplot.core.checkpoint import (
+    Checkpoint, CheckpointIndex, RegisterSetSnapshot)
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +57,13 @@ class TraceParser:
     This handles only the loading of the trace file
     """
 
+    cache_version = 0
+    """
+    Version of the data produced by the parser, subclasses bump it
+    when the output changes to invalidate the cached datasets,
+    see :class:`cheriplot.core.cache.CacheManager`.
+    """
+
     def __init__(self, trace_path=None, **kwargs):
 
         super(TraceParser, self).__init__(**kwargs)
@@ -74,6 +82,98 @@ class TraceParser:
             return self.trace.size()
         return 0
 
+    def iter_instructions(self, start=None, end=None, opcodes=None,
+                          predicate=None, batch_size=1024, read_ahead=8):
+        """
+        Iterate over the instructions in the trace.
+
+        The trace is scanned by a background thread that reads ahead
+        up to read_ahead batches of batch_size instructions, the scan
+        is stopped when the generator is closed or garbage collected,
+        so it is possible to stop after the first N matches with
+        :func:`itertools.islice`.
+        Only one iteration should be active on a parser at any time.
+
+        :param start: index of the first trace entry to scan
+        :type start: int
+        :param end: index of the last trace entry to scan
+        :type end: int
+        :param opcodes: if given, only the instructions with one of
+        these opcodes are returned
+        :type opcodes: iterable of str
+        :param predicate: if given, only the instructions for which
+        predicate(inst) is true are returned
+        :type predicate: callable
+        :param batch_size: number of instructions in a batch
+        :type batch_size: int
+        :param read_ahead: maximum number of batches read ahead
+        :type read_ahead: int
+        :return: generator of :class:`.Instruction`
+        """
+        if start is None:
+            start = 0
+        if end is None:
+            end = len(self)
+        if opcodes is not None:
+            opcodes = frozenset(opcodes)
+        decoder = DecodeCache()
+        batches = queue.Queue(read_ahead)
+        stop = threading.Event()
+
+        def _put(item):
+            # do not block forever if the consumer went away
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def _producer():
+            state = {"batch": [], "last_regs": None}
+
+            def _scan(entry, regs, idx):
+                if stop.is_set():
+                    return True
+                last_regs = state["last_regs"]
+                state["last_regs"] = regs
+                decoded = decoder.decode(entry.inst)
+                if opcodes is not None and decoded.opcode not in opcodes:
+                    return False
+                state["batch"].append(Instruction(
+                    decoded, entry, regs, last_regs or regs, idx))
+                if len(state["batch"]) >= batch_size:
+                    _put(state["batch"])
+                    state["batch"] = []
+                return False
+
+            try:
+                self.trace.scan(_scan, start, end, 0)
+                if state["batch"]:
+                    _put(state["batch"])
+            except Exception as e:
+                _put(e)
+            finally:
+                _put(None)
+
+        producer = threading.Thread(target=_producer, daemon=True)
+        producer.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    logger.error("Error scanning trace %s: %s",
+                                 self.path, batch)
+                    raise batch
+                for inst in batch:
+                    if predicate is None or predicate(inst):
+                        yield inst
+        finally:
+            stop.set()
+            producer.join()
+
 
 class Operand:
     """
@@ -259,18 +359,22 @@ class Instruction:
         }
     iclass_map[IClass.I_CAP] = list(chain(*iclass_map.values()))
 
-    def __init__(self, inst, entry, regset, prev_regset):
+    def __init__(self, decoded, entry, regset, prev_regset, idx=None):
         """
-        Construct instruction from pycheritrace instruction.
+        Construct instruction from a decoded pycheritrace instruction.
 
-        :param inst: pycheritrace disassembler instruction
-        :type inst: :class:`pycheritrace.instruction_info`
+        :param decoded: decoded instruction for the entry instruction word
+        :type decoded: :class:`.DecodedInstruction`
+        :param entry: trace entry of the instruction
+        :type entry: :class:`pycheritrace.debug_trace_entry`
         :param regset: register set after the execution
         of the instruction
         :type regset: :class:`pycheritrace.register_set`
         :param prev_regset: register set before the execution
         of the instruction
         :type prev_regset: :class:`pycheritrace.register_set`
+        :param idx: index of the trace entry
+        :type idx: int
         """
         self._regset = regset
         """Register set used for the destination register."""
@@ -278,16 +382,21 @@ class Instruction:
         self._prev_regset = prev_regset
         """Register set used for the source register(s)."""
 
-        self.inst = inst
+        self.inst = decoded.inst
         """Disassembled instruction."""
 
         self.entry = entry
         """Trace entry of the instruction"""
 
-        parts = inst.name.split("\t")
-        self.opcode = parts[1]
+        self.idx = idx
+        """Index of the trace entry"""
+
+        self.opcode = decoded.opcode
         """Instruction opcode"""
 
+        self.iclass = decoded.iclass
+        """Set of :class:`.Instruction.IClass` of the opcode"""
+
     @cached_property
     def operands(self):
         op_list = []
@@ -337,6 +446,140 @@ class Instruction:
         return instr_repr
 
 
+class DecodedInstruction:
+    """
+    Decoded form of a raw instruction word.
+
+    This holds everything that depends only on the instruction word
+    and can be shared by all the trace entries that execute it.
+    """
+
+    def __init__(self, disasm):
+        """
+        :param disasm: pycheritrace disassembler instruction
+        :type disasm: :class:`pycheritrace.instruction_info`
+        """
+        self.inst = disasm
+        """Disassembled instruction, this holds the operand descriptors."""
+
+        parts = disasm.name.split("\t")
+        self.opcode = parts[1] if len(parts) > 1 else None
+        """Instruction opcode, None if the instruction can not be parsed."""
+
+        self.iclass = frozenset(
+            iclass for iclass, opcodes in Instruction.iclass_map.items()
+            if self.opcode in opcodes)
+        """Set of :class:`.Instruction.IClass` of the opcode."""
+
+
+class DecodeCache:
+    """
+    Bounded LRU cache of :class:`.DecodedInstruction` keyed by the
+    raw instruction word.
+
+    Hot loops execute the same instruction words over and over, so
+    the disassembly of each word is done only when it is not found
+    in the cache.
+    """
+
+    def __init__(self, size=2**16):
+        """
+        :param size: maximum number of instruction words in the cache
+        :type size: int
+        """
+        self.size = size
+        """Maximum number of entries in the cache."""
+
+        self.hits = 0
+        """Number of lookups found in the cache."""
+
+        self.misses = 0
+        """Number of lookups that required a disassembly."""
+
+        self._dis = pct.disassembler()
+        """Disassembler"""
+
+        self._cache = OrderedDict()
+        """Instruction word to decoded instruction in LRU order."""
+
+    def __len__(self):
+        return len(self._cache)
+
+    def decode(self, word):
+        """
+        Return the decoded instruction for the given instruction word.
+
+        :param word: raw instruction word
+        :type word: int
+        :return: the decoded instruction
+        :rtype: :class:`.DecodedInstruction`
+        """
+        try:
+            decoded = self._cache[word]
+        except KeyError:
+            self.misses += 1
+            decoded = DecodedInstruction(self._dis.disassemble(word))
+            self._cache[word] = decoded
+            if len(self._cache) > self.size:
+                # evict the least recently used instruction
+                self._cache.popitem(last=False)
+            return decoded
+        self.hits += 1
+        self._cache.move_to_end(word)
+        return decoded
+
+    def clear(self):
+        """Drop all the cached instructions and reset the counters."""
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+BATCH_DTYPE = np.dtype([
+    ("idx", np.int64),
+    ("pc", np.uint64),
+    ("cycles", np.uint64),
+    ("opcode", np.int32),
+    ("exception", np.uint8),
+    ("is_kernel", np.bool_),
+    ("is_load", np.bool_),
+    ("is_store", np.bool_),
+    ("memory_address", np.uint64),
+    ("gpr_number", np.int8),
+    ("capreg_number", np.int8),
+    ("reg_valid", np.bool_),
+    ("gpr_value", np.uint64),
+    ("cap_base", np.uint64),
+    ("cap_length", np.uint64),
+    ("cap_offset", np.uint64),
+    ("cap_perms", np.uint32),
+    ("cap_otype", np.uint32),
+    ("cap_valid", np.bool_),
+    ("cap_sealed", np.bool_),
+])
+"""
+Structured array dtype of the entry batches given to the
+scan_batch_<name> callbacks.
+
+The opcode field is the opcode id given by
+:meth:`.CallbackTraceParser.get_opcode_id`. The reg_valid, gpr_value
+and cap_* fields hold the value of the register written by the entry,
+as given by gpr_number and capreg_number, and are zero if no register
+is written.
+"""
+
+
+def _cap_fields(cap):
+    """
+    Return the raw fields of a pycheritrace capability register
+    as a tuple that can be compared without building a
+    :class:`cheriplot.core.provenance.CheriCap`.
+    """
+    # XXX the unsealed property actually contains the sealed bit
+    return (cap.base, cap.length, cap.offset, cap.permissions, cap.type,
+            cap.valid, cap.unsealed)
+
+
 class CallbackTraceParser(TraceParser):
     """
     Trace parser that provides help to filter
@@ -364,9 +607,14 @@ class CallbackTraceParser(TraceParser):
     * cap_cpreg: all manipulations of ddc, kdc, epcc, kcc
     * cap_other: all capability instructions that do not fall in
     the previous "cap_" classes
+
+    Instructions are disassembled once for each distinct instruction
+    word and kept in a :class:`.DecodeCache`, the number of cached
+    instruction words is given by the decode_cache_size argument.
     """
 
-    def __init__(self, dataset, trace_path, **kwargs):
+    def __init__(self, dataset, trace_path, decode_cache_size=2**16,
+                 **kwargs):
         super(CallbackTraceParser, self).__init__(trace_path, **kwargs)
 
         self.dataset = dataset
@@ -379,13 +627,31 @@ class CallbackTraceParser(TraceParser):
         self._last_regs = None
         """Snapshot of the registers of the previous instruction"""
 
-        self._dis = pct.disassembler()
-        """Disassembler"""
+        self.checkpoints = None
+        """
+        :class:`cheriplot.core.checkpoint.CheckpointIndex` used to start
+        parsing in the middle of the trace.
+        """
+
+        self._recording = None
+        """Checkpoint index being built during a scan."""
+
+        self.opcode_index = None
+        """
+        :class:`cheriplot.core.opcode_index.OpcodeIndex` used to scan
+        only the entries that have callbacks.
+        """
+
+        self._decoder = DecodeCache(decode_cache_size)
+        """Decoded instructions cache"""
 
         # Enumerate the callbacks at creation time to save
         # time during scanning
         self._callbacks = {}
 
+        self._batch_callbacks = {}
+        """Map the name of each scan_batch_<name> callback to the method."""
+
         # for each opcode we may be interested in, check if there is
         # one or more callbacks to call, if so these will be stored
         # in _callbacks[<opcode>] so that the _get_callbacks function
@@ -394,6 +660,9 @@ class CallbackTraceParser(TraceParser):
             method = getattr(self, attr)
             if (not attr.startswith("scan_") or not callable(method)):
                 continue
+            if attr.startswith("scan_batch_"):
+                self._batch_callbacks[attr[11:]] = method
+                continue
             instr_name = attr[5:]
             for iclass in Instruction.IClass:
                 if instr_name == iclass.value:
@@ -415,21 +684,85 @@ class CallbackTraceParser(TraceParser):
         logger.debug("Loaded callbacks for CallbackTraceParser %s",
                      self._callbacks)
 
+        self._dispatch = {}
+        """
+        Dispatch table that maps each opcode to the tuple of callbacks
+        to invoke for it, this is filled lazily the first time an
+        opcode is found in the trace.
+        """
+
+        self._word_dispatch = {}
+        """
+        Pre-filter table that maps raw instruction words to the
+        decoded instruction and the tuple of callbacks for it.
+        """
+
+        self._opcode_ids = {}
+        """Map each opcode to the id used in the entry batches."""
+
+        self.opcode_table = []
+        """Opcode of each opcode id used in the entry batches."""
+
+    def _get_opcode_callbacks(self, opcode):
+        """
+        Return the tuple of callback methods that should be called to
+        parse an instruction with the given opcode.
+
+        The tuple is built the first time the opcode is seen and
+        stored in the dispatch table, an empty tuple means that
+        nothing has to be done for the opcode.
+
+        :param opcode: instruction opcode
+        :type opcode: str
+        :return: tuple of methods to be called
+        :rtype: tuple of callables
+        """
+        try:
+            return self._dispatch[opcode]
+        except KeyError:
+            # the <all> callback should be the last one executed
+            callbacks = tuple(self._callbacks.get(opcode, []) +
+                              self._callbacks.get("all", []))
+            self._dispatch[opcode] = callbacks
+            return callbacks
+
+    def _classify(self, word, prefilter=True):
+        """
+        Classify a raw instruction word against the opcodes that
+        have callbacks.
+
+        :param word: raw instruction word
+        :type word: int
+        :param prefilter: remember the result in the pre-filter table
+        :type prefilter: bool
+        :return: tuple (decoded instruction, callbacks), callbacks is None
+        if the instruction can not be parsed
+        :rtype: tuple
+        """
+        decoded = self._decoder.decode(word)
+        if decoded.opcode is None:
+            callbacks = None
+        else:
+            callbacks = self._get_opcode_callbacks(decoded.opcode)
+        verdict = (decoded, callbacks)
+        if prefilter:
+            if len(self._word_dispatch) >= self._decoder.size:
+                # keep the table bounded as the decode cache
+                self._word_dispatch.clear()
+            self._word_dispatch[word] = verdict
+        return verdict
+
     def _get_callbacks(self, inst):
         """
-        Return a list of callback methods that should be called to
+        Return the callback methods that should be called to
         parse this instruction
 
         :param inst: instruction object for the current instruction
         :type inst: :class:`.Instruction`
-        :return: list of methods to be called
-        :rtype: list of callables
+        :return: tuple of methods to be called
+        :rtype: tuple of callables
         """
-        # try to get the callback for all instructions, if any
-        callbacks = list(self._callbacks.get("all", []))
-        # the <all> callback should be the last one executed
-        callbacks = self._callbacks.get(inst.opcode, []) + callbacks
-        return callbacks
+        return self._get_opcode_callbacks(inst.opcode)
 
     def _parse_exception(self, entry, regs, disasm, idx):
         """
@@ -440,7 +773,141 @@ class CallbackTraceParser(TraceParser):
         logger.debug("Error parsing instruction #%d pc:0x%x: %s raw: 0x%x",
                      entry.cycles, entry.pc, disasm.name, entry.inst)
 
-    def parse(self, start=None, end=None, direction=0):
+    def _capreg_written(self, entry, regs, last_regs, cap_index):
+        """
+        Check whether a trace entry writes the given capability register.
+
+        The register number recorded in the entry is used when the
+        entry has one, otherwise the raw fields of the register before
+        and after the entry are compared. No capability object is
+        built in either case.
+
+        :param entry: trace entry
+        :type entry: :class:`pycheritrace.debug_trace_entry`
+        :param regs: register set after the entry
+        :type regs: :class:`pycheritrace.register_set`
+        :param last_regs: register set before the entry
+        :type last_regs: :class:`pycheritrace.register_set`
+        :param cap_index: capability register number
+        :type cap_index: int
+        :return: True if the register is written by the entry
+        :rtype: bool
+        """
+        capreg = entry.capreg_number()
+        if capreg >= 0:
+            return capreg == cap_index
+        return (_cap_fields(last_regs.cap_reg[cap_index]) !=
+                _cap_fields(regs.cap_reg[cap_index]))
+
+    def _get_checkpoint_file(self):
+        classname = self.__class__.__name__.lower()
+        return "%s_%s_checkpoints.cache" % (self.path, classname)
+
+    def get_checkpoint_state(self):
+        """
+        Return the parser-specific state to store in a checkpoint.
+
+        This method is meant to be overridden in subclasses that carry
+        state from one trace entry to the next, the state must be
+        picklable and it is given back to
+        :meth:`.CallbackTraceParser.restore_checkpoint_state`
+        when parsing starts from the checkpoint.
+
+        :return: the parser state or None if the parser is stateless
+        """
+        return None
+
+    def restore_checkpoint_state(self, state):
+        """
+        Restore the parser-specific state from a checkpoint.
+
+        This method is meant to be overridden in subclasses along with
+        :meth:`.CallbackTraceParser.get_checkpoint_state`.
+
+        :param state: the parser state stored in the checkpoint
+        """
+        return
+
+    def before_parse(self, start, end):
+        """
+        Hook called by :meth:`.CallbackTraceParser.parse` before
+        the trace is scanned, :class:`.ParallelTraceParser` calls it
+        once for the whole range in the parent process.
+
+        This method is meant to be overridden in subclasses that need
+        to set up their state for a parse, subclasses should use this
+        instead of overriding parse so that they can be members of a
+        :class:`.CompositeTraceParser`.
+
+        :param start: index of the first trace entry to scan
+        :type start: int
+        :param end: index of the last trace entry to scan
+        :type end: int
+        """
+        return
+
+    def after_parse(self, start, end):
+        """
+        Hook called by :meth:`.CallbackTraceParser.parse` after
+        the trace is scanned.
+        See :meth:`.CallbackTraceParser.before_parse`.
+
+        :param start: index of the first trace entry to scan
+        :type start: int
+        :param end: index of the last trace entry to scan
+        :type end: int
+        """
+        return
+
+    def _add_checkpoint(self, entry, idx):
+        """
+        Record a checkpoint with the state before the given entry.
+        """
+        if self._last_regs is None:
+            # nothing has been scanned yet
+            return
+        checkpoint = Checkpoint(idx, entry.cycles,
+                                RegisterSetSnapshot(self._last_regs),
+                                self.get_checkpoint_state())
+        self._recording.add(checkpoint)
+
+    def build_checkpoints(self, interval, path=None):
+        """
+        Scan the whole trace and record a checkpoint every
+        interval entries, the checkpoints are saved to a sidecar
+        file of the trace.
+
+        :param interval: number of trace entries between checkpoints
+        :type interval: int
+        :param path: checkpoint file path, by default this is
+        next to the trace file
+        :type path: str
+        :return: the checkpoint index
+        :rtype: :class:`cheriplot.core.checkpoint.CheckpointIndex`
+        """
+        self._recording = CheckpointIndex(interval)
+        try:
+            self.parse()
+            index = self._recording
+        finally:
+            self._recording = None
+        index.save(path or self._get_checkpoint_file())
+        self.checkpoints = index
+        return index
+
+    def load_checkpoints(self, path=None):
+        """
+        Load the checkpoints built by
+        :meth:`.CallbackTraceParser.build_checkpoints`.
+
+        :param path: checkpoint file path, by default this is
+        next to the trace file
+        :type path: str
+        """
+        self.checkpoints = CheckpointIndex.load(
+            path or self._get_checkpoint_file())
+
+    def parse(self, start=None, end=None, direction=0, prefilter=True):
         """
         Parse the trace
 
@@ -452,40 +919,153 @@ class CallbackTraceParser(TraceParser):
         Each instruction opcode can have a callback in the form
         scan_<opcode>.
 
+        If checkpoints are loaded, parsing starts from the closest
+        checkpoint before start and the entries between the checkpoint
+        and start are replayed.
+
+        If an opcode index is set and the parser has no scan_all
+        callback, only the entries with an opcode that has callbacks
+        are scanned, along with the entry before each of them.
+
+        In pre-filter mode each raw instruction word is classified
+        once against the opcodes that have callbacks, entries that
+        match no callback only update the previous register set and
+        no :class:`.Instruction` is built for them. Otherwise every
+        entry is decoded and dispatched, an :class:`.Instruction` is
+        built even if the entry has no callbacks.
+
         :param start: index of the first trace entry to scan
         :type start: int
         :param end: index of the last trace entry to scan
         :type end: int
         :param direction: scan direction (forward = 0, backward=1)
         :type direction: int
+        :param prefilter: enable the pre-filter mode
+        :type prefilter: bool
         """
 
         if start is None:
             start = 0
         if end is None:
             end = len(self)
+        self.before_parse(start, end)
+        parse_start = start
+        if start > 0 and direction == 0 and self.checkpoints is not None:
+            checkpoint = self.checkpoints.nearest(start)
+            if checkpoint is not None:
+                logger.info("Restore checkpoint {%d} at %d, replay %d entries",
+                            checkpoint.cycles, checkpoint.idx,
+                            start - checkpoint.idx)
+                self._last_regs = checkpoint.regs
+                self.restore_checkpoint_state(checkpoint.state)
+                start = checkpoint.idx
+        if self._use_opcode_index(direction):
+            opcodes = [op for op in self.opcode_index.opcodes
+                       if op is None or self._get_opcode_callbacks(op)]
+            ranges = self.opcode_index.find_ranges(opcodes, start, end)
+            logger.debug("Opcode index: scan %d ranges", len(ranges))
+            if len(ranges) > 0:
+                self._scan_ranges(ranges, direction, prefilter)
+        else:
+            self._scan_ranges([(start, end)], direction, prefilter)
+        self.after_parse(parse_start, end)
+
+    def _use_opcode_index(self, direction):
+        """
+        Check whether the opcode index can be used to skip entries.
+        """
+        if self.opcode_index is None:
+            return False
+        if direction != 0 or self._recording is not None:
+            return False
+        if "all" in self._callbacks:
+            # the parser needs every entry
+            return False
+        if len(self.opcode_index) != len(self):
+            logger.warning("Opcode index does not match the trace size, "
+                           "ignoring it")
+            return False
+        return True
+
+    def parse_ranges(self, ranges, prefilter=True):
+        """
+        Parse only the given ranges of the trace.
+
+        The previous register set of the first entry of each range is
+        fetched from the trace so the callbacks see the same values
+        as in a parse of the whole trace.
+
+        :param ranges: sorted list of non-overlapping (start, end) ranges
+        :type ranges: list of tuples
+        :param prefilter: enable the pre-filter mode,
+        see :meth:`.CallbackTraceParser.parse`
+        :type prefilter: bool
+        """
+        if len(ranges) == 0:
+            return
+        self._scan_ranges(ranges, 0, prefilter, seed=True)
+
+    def _seed_last_regs(self, idx):
+        """
+        Set the previous register set to the register set of the
+        given trace entry.
+        """
+        def _seed(entry, regs, seed_idx):
+            self._last_regs = regs
+            return True
+        self.trace.scan(_seed, idx, idx, 0)
+
+    def _scan_ranges(self, ranges, direction, prefilter, seed=False):
+        """
+        Scan a list of trace ranges and invoke the callbacks.
+        See :meth:`.CallbackTraceParser.parse`.
+        """
+        start = ranges[0][0]
+        end = ranges[-1][1]
         # fast progress processing, calling progress.advance() in each
         # _scan call is too expensive
         progress_points = list(range(start, end, int((end - start) / 100) + 1))
         progress_points.append(end)
+        # checkpoints are recorded in the same way
+        if self._recording is not None:
+            interval = self._recording.interval
+            checkpoint_points = list(range(start + interval, end, interval))
+        else:
+            checkpoint_points = []
+        checkpoint_points.append(end + 1)
+
+        word_dispatch = self._word_dispatch
+        stop = [False]
 
         def _scan(entry, regs, idx):
             if idx >= progress_points[0]:
                 progress_points.pop(0)
                 self.progress.advance(to=idx)
-            disasm = self._dis.disassemble(entry.inst)
-            try:
+            if idx >= checkpoint_points[0]:
+                checkpoint_points.pop(0)
+                self._add_checkpoint(entry, idx)
+            verdict = word_dispatch.get(entry.inst)
+            if verdict is None:
+                verdict = self._classify(entry.inst, prefilter)
+            decoded, callbacks = verdict
+            if callbacks is None:
                 if self._last_regs is None:
                     self._last_regs = regs
-                inst = Instruction(disasm, entry, regs, self._last_regs)
-            except Exception as e:
-                self._parse_exception(entry, regs, disasm, idx)
+                self._parse_exception(entry, regs, decoded.inst, idx)
+                return False
+            if not callbacks and prefilter:
+                # nothing to do for this opcode
+                self._last_regs = regs
                 return False
 
+            if self._last_regs is None:
+                self._last_regs = regs
+            inst = Instruction(decoded, entry, regs, self._last_regs, idx)
+
             ret = False
 
             try:
-                for cbk in self._get_callbacks(inst):
+                for cbk in callbacks:
                     ret |= cbk(inst, entry, regs, self._last_regs, idx)
                     if ret:
                         break
@@ -494,66 +1074,443 @@ class CallbackTraceParser(TraceParser):
                 raise
 
             self._last_regs = regs
+            stop[0] = ret
             return ret
 
-        self.trace.scan(_scan, start, end, direction)
+        prev_end = None
+        for r_start, r_end in ranges:
+            if seed and r_start > 0 and prev_end != r_start - 1:
+                self._seed_last_regs(r_start - 1)
+            self.trace.scan(_scan, r_start, r_end, direction)
+            prev_end = r_end
+            if stop[0]:
+                break
+        self.progress.finish()
+        logger.debug("Decode cache hits:%d misses:%d",
+                     self._decoder.hits, self._decoder.misses)
+
+    def get_opcode_id(self, opcode):
+        """
+        Return the id of the given opcode in the entry batches, ids
+        are assigned in the order the opcodes are found in the trace.
+
+        :param opcode: instruction opcode, None for instructions that
+        can not be disassembled
+        :type opcode: str
+        :return: the opcode id
+        :rtype: int
+        """
+        try:
+            return self._opcode_ids[opcode]
+        except KeyError:
+            opcode_id = len(self.opcode_table)
+            self._opcode_ids[opcode] = opcode_id
+            self.opcode_table.append(opcode)
+            return opcode_id
+
+    def _get_batch_names(self, opcode):
+        """
+        Return the names of the scan_batch_<name> callbacks that
+        receive the entries with the given opcode.
+        """
+        names = []
+        for name in self._batch_callbacks:
+            if name == "all" or name == opcode:
+                names.append(name)
+                continue
+            for iclass in Instruction.IClass:
+                if (name == iclass.value and
+                    opcode in Instruction.iclass_map.get(iclass, [])):
+                    names.append(name)
+                    break
+        return tuple(names)
+
+    def _make_batch_row(self, entry, regs, idx, opcode_id):
+        """
+        Build the record of an entry in the entry batches,
+        see :data:`.BATCH_DTYPE`.
+        """
+        gpr = entry.gpr_number()
+        capreg = entry.capreg_number()
+        reg_valid = False
+        gpr_value = 0
+        cap_fields = (0, 0, 0, 0, 0, False, False)
+        if gpr == 0:
+            # $zero is always zero
+            reg_valid = True
+        elif gpr > 0:
+            reg_valid = regs.valid_gprs[gpr - 1]
+            if reg_valid:
+                gpr_value = regs.gpr[gpr - 1]
+        elif capreg >= 0:
+            reg_valid = regs.valid_caps[capreg]
+            if reg_valid:
+                cap_fields = _cap_fields(regs.cap_reg[capreg])
+        return (idx, entry.pc, entry.cycles, opcode_id, entry.exception,
+                entry.is_kernel(), entry.is_load, entry.is_store,
+                entry.memory_address, gpr, capreg, reg_valid,
+                gpr_value) + cap_fields
+
+    def parse_batch(self, start=None, end=None, batch_size=2**16):
+        """
+        Parse the trace in batched mode.
+
+        The entries are accumulated in structured numpy arrays with
+        the :data:`.BATCH_DTYPE` dtype and each batch of up to batch_size
+        entries is given to the scan_batch_<name> callbacks, so that
+        aggregations can be vectorized. Callbacks can be in the form
+        scan_batch_<opcode>, scan_batch_<instr_class> or scan_batch_all,
+        like the per-entry callbacks they return True to stop parsing.
+
+        The per-entry scan_<name> callbacks are not invoked in
+        batched mode.
+
+        :param start: index of the first trace entry to scan
+        :type start: int
+        :param end: index of the last trace entry to scan
+        :type end: int
+        :param batch_size: maximum number of entries in a batch
+        :type batch_size: int
+        """
+        if start is None:
+            start = 0
+        if end is None:
+            end = len(self)
+        progress_points = list(range(start, end, int((end - start) / 100) + 1))
+        progress_points.append(end)
+
+        rows = {name: [] for name in self._batch_callbacks}
+        word_batch = {}
+        stop = [False]
+
+        def _flush(name):
+            batch = np.array(rows[name], dtype=BATCH_DTYPE)
+            del rows[name][:]
+            return self._batch_callbacks[name](batch)
+
+        def _scan(entry, regs, idx):
+            if idx >= progress_points[0]:
+                progress_points.pop(0)
+                self.progress.advance(to=idx)
+            target = word_batch.get(entry.inst)
+            if target is None:
+                opcode = self._decoder.decode(entry.inst).opcode
+                target = (self.get_opcode_id(opcode),
+                          self._get_batch_names(opcode))
+                word_batch[entry.inst] = target
+            opcode_id, names = target
+            if not names:
+                return False
+            row = self._make_batch_row(entry, regs, idx, opcode_id)
+            for name in names:
+                rows[name].append(row)
+                if len(rows[name]) >= batch_size and _flush(name):
+                    stop[0] = True
+            return stop[0]
+
+        self.trace.scan(_scan, start, end, 0)
+        if not stop[0]:
+            for name in rows:
+                if len(rows[name]) > 0 and _flush(name):
+                    break
         self.progress.finish()
 
+    def new_partial(self):
+        """
+        Create an empty partial result for the parse of a chunk of
+        the trace in a :class:`.ParallelTraceParser` worker.
+
+        This method is meant to be overridden in subclasses that
+        support parallel parsing, the partial result is used as the
+        dataset of the worker parser and must be picklable.
+
+        :return: the empty partial result
+        """
+        raise NotImplementedError("Parallel parsing not supported by %s" %
+                                  self.__class__.__name__)
+
+    def get_partial(self):
+        """
+        Return the partial result of the parse of a chunk of the trace
+        in a :class:`.ParallelTraceParser` worker.
+
+        By default this is the dataset, subclasses that carry state
+        across trace entries can override this to return the final
+        state of the chunk along with the dataset.
+
+        :return: the partial result
+        """
+        return self.dataset
+
+    def merge_partial(self, partial):
+        """
+        Merge a partial result in the dataset.
 
-class ThreadedTraceParser:
+        This method is meant to be overridden in subclasses that
+        support parallel parsing, partial results are merged in
+        trace order.
+
+        :param partial: the partial result of a chunk of the trace
+        """
+        raise NotImplementedError("Parallel parsing not supported by %s" %
+                                  self.__class__.__name__)
+
+
+class CompositeTraceParser(CallbackTraceParser):
+    """
+    Trace parser that runs several :class:`.CallbackTraceParser` in
+    a single scan of the trace.
+
+    Each trace entry is decoded once and dispatched to the callbacks
+    of every member parser, the data is stored in the dataset of each
+    member. When a member callback returns True the member stops
+    receiving entries, the scan stops when all the members are done.
+
+    The parse hooks of the members are called around the scan and the
+    previous register set of each member follows the composite one.
+    Members can not override :meth:`.CallbackTraceParser.parse`,
+    since it is never called.
     """
-    Trace parser that scans a trace using multiple processes
 
-    The scanning processes are forked from the current parser
-    and each one is allocated a range of the trace. The parsed
-    data items are piped through one or more queues. The current
-    process pulls data from the queue(s) and stores it in the
-    dataset
+    def __init__(self, parsers, **kwargs):
+        """
+        :param parsers: the parsers to run, they must share the same
+        trace file
+        :type parsers: list of :class:`.CallbackTraceParser`
+        """
+        if len(parsers) == 0:
+            logger.error("CompositeTraceParser requires at least a parser")
+            raise ValueError("No parsers given")
+        paths = set(parser.path for parser in parsers)
+        if len(paths) > 1:
+            logger.error("CompositeTraceParser members use different "
+                         "traces %s", paths)
+            raise ValueError("Parsers must use the same trace")
+        for parser in parsers:
+            if type(parser).parse is not CallbackTraceParser.parse:
+                logger.error("CompositeTraceParser member %s overrides "
+                             "parse()", parser.__class__.__name__)
+                raise ValueError("Member parsers can not override parse()")
+
+        self.parsers = list(parsers)
+        """Member parsers."""
+
+        self._done = set()
+        """Index of the member parsers that stopped parsing."""
+
+        super(CompositeTraceParser, self).__init__(
+            None, parsers[0].path, **kwargs)
+
+    def _member_dispatch(self, member_idx, callbacks):
+        """
+        Build the callback that dispatches an entry to the
+        callbacks of a member parser.
+        """
+        done = self._done
+        n_members = len(self.parsers)
+
+        def _dispatch(inst, entry, regs, last_regs, idx):
+            if member_idx not in done:
+                for cbk in callbacks:
+                    if cbk(inst, entry, regs, last_regs, idx):
+                        done.add(member_idx)
+                        break
+            return len(done) == n_members
+        return _dispatch
+
+    def _get_opcode_callbacks(self, opcode):
+        try:
+            return self._dispatch[opcode]
+        except KeyError:
+            callbacks = []
+            for member_idx, parser in enumerate(self.parsers):
+                member_callbacks = parser._get_opcode_callbacks(opcode)
+                if member_callbacks:
+                    callbacks.append(self._member_dispatch(
+                        member_idx, member_callbacks))
+            callbacks = tuple(callbacks)
+            self._dispatch[opcode] = callbacks
+            return callbacks
+
+    def _use_opcode_index(self, direction):
+        for parser in self.parsers:
+            if "all" in parser._callbacks:
+                return False
+        return super(CompositeTraceParser, self)._use_opcode_index(direction)
+
+    def _parse_exception(self, entry, regs, disasm, idx):
+        for member_idx, parser in enumerate(self.parsers):
+            if member_idx not in self._done:
+                parser._parse_exception(entry, regs, disasm, idx)
 
-    XXX: experimental/broken
+    @property
+    def _last_regs(self):
+        return self._composite_last_regs
+
+    @_last_regs.setter
+    def _last_regs(self, regs):
+        self._composite_last_regs = regs
+        for parser in self.parsers:
+            parser._last_regs = regs
+
+    def before_parse(self, start, end):
+        for parser in self.parsers:
+            parser.before_parse(start, end)
+
+    def after_parse(self, start, end):
+        for parser in self.parsers:
+            parser.after_parse(start, end)
+
+    def get_checkpoint_state(self):
+        return [parser.get_checkpoint_state() for parser in self.parsers]
+
+    def restore_checkpoint_state(self, state):
+        for parser, member_state in zip(self.parsers, state):
+            parser.restore_checkpoint_state(member_state)
+
+    def _scan_ranges(self, *args, **kwargs):
+        # every scan starts with all the members active
+        self._done.clear()
+        super(CompositeTraceParser, self)._scan_ranges(*args, **kwargs)
+
+
+class ParallelTraceParser:
+    """
+    Trace parser that scans a trace range using a pool of processes.
+
+    The range is split in chunks and each chunk is parsed by a copy of
+    a :class:`.CallbackTraceParser` in a worker process, each worker
+    reopens the trace file. The parser must support the partial result
+    protocol: the worker stores the data in an empty partial result
+    given by :meth:`.CallbackTraceParser.new_partial` and sends it
+    back to the parent process, where the partial results are merged
+    in trace order by :meth:`.CallbackTraceParser.merge_partial`.
+
+    Each chunk is parsed independently, parsers that carry state from
+    one trace entry to the next must resolve the state at the start of
+    each chunk when the partial result is merged, the partial result
+    is returned by :meth:`.CallbackTraceParser.get_partial`.
     """
 
-    def __init__(self, path, parser, threads=2):
-        self.trace = RawValue(py_object, None)
-        """Trace in shared memory"""
-        self.parser = parser
+    def __init__(self, parser, workers=None, chunks=None):
         """
-        Callback that handles each trace block, this is run
-        in separate processes
+        :param parser: the parser to run on each chunk
+        :type parser: :class:`.CallbackTraceParser`
+        :param workers: number of worker processes, defaults
+        to the number of cpus
+        :type workers: int
+        :param chunks: number of chunks the trace range is split
+        into, defaults to 4 chunks per worker
+        :type chunks: int
         """
-        self.n_threads = threads
-        """Number of subprocesses that are spawned"""
-        self.path = path
-        """Trace path"""
+        self.parser = parser
+        """Parser used in the worker processes."""
+
+        self.workers = workers or multiprocessing.cpu_count()
+        """Number of worker processes."""
 
-        if not os.path.exists(path):
-            raise IOError("File not found %s" % path)
-        self.trace = pct.trace.open(path)
-        if self.trace is None:
-            raise IOError("Can not open trace %s" % path)
+        self.chunks = chunks or 4 * self.workers
+        """Number of chunks the trace range is split into."""
+
+        self.progress = ProgressPrinter(
+            self.chunks, desc="Scanning trace %s" % parser.path)
+        """Progress object to display feedback to the user"""
 
     def __len__(self):
-        if self.trace:
-            return self.trace.size()
-        return 0
+        return len(self.parser)
+
+    def split(self, start, end):
+        """
+        Split the trace range in chunks.
+
+        :param start: index of the first trace entry to scan
+        :type start: int
+        :param end: index of the last trace entry to scan
+        :type end: int
+        :return: list of non-overlapping (start, end) ranges in trace order
+        :rtype: list of tuples
+        """
+        size = end - start
+        n_chunks = max(1, min(self.chunks, size))
+        bounds = [start + (size * i) // n_chunks
+                  for i in range(n_chunks + 1)]
+        ranges = [(bounds[i], bounds[i + 1] - 1) for i in range(n_chunks)]
+        # the last chunk consumes the end of the range
+        ranges[-1] = (bounds[-2], end)
+        return ranges
+
+    def parse(self, start=None, end=None, **kwargs):
+        """
+        Parse the trace range in the worker processes and merge the
+        partial results in the parser dataset. The parse hooks of the
+        parser are called in the parent process around the whole range.
+
+        :param start: index of the first trace entry to scan
+        :type start: int
+        :param end: index of the last trace entry to scan
+        :type end: int
+        :param kwargs: additional arguments for
+        :meth:`.CallbackTraceParser.parse`
+        """
+        global _worker_parser
 
-    def parse(self, *args, **kwargs):
-        start = kwargs.pop("start", 0)
-        end = kwargs.pop("end", len(self))
-        block_size = math.floor((end - start) / self.n_threads)
-        start_indexes = np.arange(start, end - block_size + 1, block_size)
-        end_indexes = np.arange(start + block_size, end + 1, block_size) - 1
-        # the last process consumes any remaining entries left by the
-        # rounding of block_size
-        end_indexes[-1] = end
-
-        procs = []
-        for idx_start, idx_end in zip(start_indexes, end_indexes):
-            print(idx_start, idx_end)
-            p = Process(target=self.parser, args=(self.path, idx_start, idx_end))
-            procs.append(p)
-
-        for p in procs:
-            p.start()
-        for p in procs:
-            p.join()
+        if start is None:
+            start = 0
+        if end is None:
+            end = len(self)
+        ranges = self.split(start, end)
+        self.progress.end = len(ranges)
+        self.parser.before_parse(start, end)
+
+        # the workers are forked so they inherit the parser
+        _worker_parser = self.parser
+        ctx = multiprocessing.get_context("fork")
+        try:
+            with ctx.Pool(self.workers, initializer=_init_worker) as pool:
+                args = [(r_start, r_end, kwargs) for r_start, r_end in ranges]
+                for partial in pool.imap(_parse_chunk, args):
+                    self.parser.merge_partial(partial)
+                    self.progress.advance()
+        finally:
+            _worker_parser = None
+        self.progress.finish()
+        self.parser.after_parse(start, end)
+
+
+_worker_parser = None
+"""Parser inherited by the :class:`.ParallelTraceParser` workers."""
+
+
+def _init_worker():
+    """
+    Initialise a :class:`.ParallelTraceParser` worker process.
+
+    The trace object can not be shared with the parent process
+    so the trace is opened again here.
+    """
+    parser = _worker_parser
+    parser.trace = pct.trace.open(parser.path)
+    if parser.trace is None:
+        raise IOError("Can not open trace %s" % parser.path)
+    # the parent process reports progress for all the workers
+    parser.progress = ProgressPrinter(1, level=logging.NOTSET)
+
+
+def _parse_chunk(args):
+    """
+    Parse a chunk of the trace in a :class:`.ParallelTraceParser`
+    worker process and return the partial result.
+    """
+    start, end, kwargs = args
+    parser = _worker_parser
+    parser.dataset = parser.new_partial()
+    parser._last_regs = None
+    # the chunk is parsed from the placeholder state of new_partial,
+    # restoring a checkpoint would replay entries of the previous chunk
+    parser.checkpoints = None
+    if start > 0:
+        # fetch the register set before the start of the chunk
+        # so that the first entry sees the correct previous registers
+        parser._seed_last_regs(start - 1)
+    parser.parse(start, end, **kwargs)
+    return parser.get_partial()
@@ -29,11 +29,17 @@
 Provenance graph implementation and helper classes.
 """
 
+import logging
+import numpy as np
+
 from enum import IntEnum
 from cached_property import cached_property
 from functools import partialmethod
+from collections.abc import MutableMapping
 from graph_tool.all import *
 
+logger = logging.getLogger(__name__)
+
 class CheriCapPerm(IntEnum):
     """
     Enumeration of bitmask for the capability permission bits.
@@ -69,6 +75,11 @@ class CheriNodeOrigin(IntEnum):
     # the start and end are flags
     SYS_MMAP = 5
     SYS_MUNMAP = 6
+    SYS_MPROTECT = 7
+    SYS_MADVISE = 8
+    SYS_MINHERIT = 9
+    SYS_SHMAT = 10
+    SYS_SHMDT = 11
 
 
 class CheriCap:
@@ -251,3 +262,674 @@ class NodeData:
     def __str__(self):
         return "%s origin:%s pc:0x%x (kernel %d)" % (
             self.cap, self.origin.name, self.pc or 0, self.is_kernel)
+
+
+def _to_int64(value):
+    """Store an unsigned 64-bit value in an int64 property."""
+    if value is None:
+        return 0
+    value &= CheriCap.MAX_ADDR
+    return value - (1 << 64) if value >> 63 else value
+
+
+def _from_int64(value):
+    """Read an unsigned 64-bit value from an int64 property."""
+    return int(value) & CheriCap.MAX_ADDR
+
+
+class CheriCapView(CheriCap):
+    """
+    :class:`.CheriCap` interface to the capability data of a vertex
+    in a :class:`.NodeDataMap`.
+    """
+
+    def __init__(self, node_map, vertex):
+        self._map = node_map
+        self._vertex = vertex
+
+    def _get_prop(name, unsigned=False):
+        def _get(self):
+            value = self._map.props[name][self._vertex]
+            return _from_int64(value) if unsigned else value
+
+        def _set(self, value):
+            if unsigned:
+                value = _to_int64(value)
+            elif value is None:
+                value = 0
+            self._map.props[name][self._vertex] = value
+        return property(_get, _set)
+
+    base = _get_prop("base", unsigned=True)
+    length = _get_prop("length", unsigned=True)
+    offset = _get_prop("offset", unsigned=True)
+    permissions = _get_prop("perms")
+    objtype = _get_prop("otype")
+    t_alloc = _get_prop("t_alloc")
+    t_free = _get_prop("t_free")
+
+    @property
+    def valid(self):
+        return bool(self._map.props["valid"][self._vertex])
+
+    @valid.setter
+    def valid(self, value):
+        self._map.props["valid"][self._vertex] = bool(value)
+
+    @property
+    def sealed(self):
+        return bool(self._map.props["sealed"][self._vertex])
+
+    @sealed.setter
+    def sealed(self, value):
+        self._map.props["sealed"][self._vertex] = bool(value)
+
+    del _get_prop
+
+    def __copy__(self):
+        """Copying a view returns a detached :class:`.CheriCap`."""
+        cap = CheriCap()
+        for name in CheriCapView.FIELDS:
+            setattr(cap, name, getattr(self, name))
+        return cap
+
+    FIELDS = ("base", "length", "offset", "permissions", "objtype",
+              "valid", "sealed", "t_alloc", "t_free")
+    """Capability fields stored in the node properties."""
+
+
+class ProvenanceEventLog:
+    """
+    Global append-only log of the stores and dereferences of the
+    capabilities in a provenance graph.
+
+    Each event is a row of :attr:`EVENT_DTYPE` holding the vertex
+    index of the capability, the time and address of the event,
+    whether the event moved a capability and the event type.
+    The type is :attr:`ADDRESS` for the locations where a
+    capability is stored, otherwise it is a :class:`NodeData.DerefType`.
+
+    Events are buffered and packed in fixed-size numpy chunks,
+    full chunks can be spilled to a file that is memory-mapped
+    when the log is read. The events of a vertex are found
+    by grouping the log by vertex lazily on the first query after
+    an append.
+    """
+
+    ADDRESS = 0
+    """Event type of a capability store to memory."""
+
+    EVENT_DTYPE = np.dtype([
+        ("node", np.int64),
+        ("time", np.int64),
+        ("addr", np.uint64),
+        ("is_cap", np.bool_),
+        ("type", np.int8),
+    ])
+    """Numpy dtype of an event."""
+
+    def __init__(self, chunk_size=2**16):
+        """
+        :param chunk_size: number of events in a chunk
+        :type chunk_size: int
+        """
+        self.chunk_size = chunk_size
+        """Number of events in a chunk."""
+
+        self.spill_path = None
+        """File where the full chunks are spilled."""
+
+        self._pending = []
+        """Events not yet packed in a chunk."""
+
+        self._chunks = []
+        """Full chunks held in memory."""
+
+        self._spilled = 0
+        """Number of events in the spill file."""
+
+        self._mmap = None
+        """Memory-mapped content of the spill file."""
+
+        self._grouped = None
+        """(node column, events) of the log sorted by node."""
+
+    def append(self, node, time, addr, is_cap, type_):
+        """
+        Append an event to the log.
+
+        :param node: vertex index of the capability
+        :type node: int
+        :param time: cycle of the event
+        :type time: int
+        :param addr: memory address of the event
+        :type addr: int
+        :param is_cap: the event loads or stores a capability
+        :type is_cap: bool
+        :param type_: event type
+        :type type_: int
+        """
+        self._pending.append((node, time, addr, is_cap, type_))
+        self._grouped = None
+        if len(self._pending) >= self.chunk_size:
+            self._pack()
+
+    def _pack(self):
+        """Pack the pending events in a chunk."""
+        if len(self._pending) == 0:
+            return
+        chunk = np.array(self._pending, dtype=self.EVENT_DTYPE)
+        self._pending = []
+        if self.spill_path is None:
+            self._chunks.append(chunk)
+        else:
+            with open(self.spill_path, "ab") as fd:
+                chunk.tofile(fd)
+            self._spilled += len(chunk)
+            self._mmap = None
+
+    def spill(self, path):
+        """
+        Move the full chunks to a file and spill the following ones.
+
+        The file is overwritten if it exists.
+
+        :param path: spill file path
+        :type path: str
+        """
+        logger.debug("Spill provenance events to %s", path)
+        self.spill_path = path
+        with open(path, "wb") as fd:
+            for chunk in self._chunks:
+                chunk.tofile(fd)
+                self._spilled += len(chunk)
+        self._chunks = []
+        self._mmap = None
+
+    def _spilled_events(self):
+        if self._spilled == 0:
+            return np.empty(0, dtype=self.EVENT_DTYPE)
+        if self._mmap is None:
+            self._mmap = np.memmap(self.spill_path, dtype=self.EVENT_DTYPE,
+                                   mode="r", shape=(self._spilled,))
+        return self._mmap
+
+    def __len__(self):
+        return (self._spilled + sum(len(c) for c in self._chunks) +
+                len(self._pending))
+
+    def events(self):
+        """
+        Return all the events in append order.
+
+        :return: the events
+        :rtype: :class:`numpy.ndarray` of :attr:`EVENT_DTYPE`
+        """
+        self._pack()
+        parts = [self._spilled_events()] + self._chunks
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def _group(self):
+        if self._grouped is None:
+            events = self.events()
+            # stable sort keeps the events of a node in append order
+            order = np.argsort(events["node"], kind="mergesort")
+            events = events[order]
+            self._grouped = (events["node"], events)
+        return self._grouped
+
+    def node_events(self, node, address=None):
+        """
+        Return the events of a vertex in append order.
+
+        :param node: vertex index
+        :type node: int
+        :param address: if True return only the :attr:`ADDRESS` events,
+        if False return only the dereferences, None returns both
+        :type address: bool
+        :return: the events
+        :rtype: :class:`numpy.ndarray` of :attr:`EVENT_DTYPE`
+        """
+        nodes, events = self._group()
+        low = np.searchsorted(nodes, node, side="left")
+        high = np.searchsorted(nodes, node, side="right")
+        events = events[low:high]
+        if address is None:
+            return events
+        if address:
+            return events[events["type"] == self.ADDRESS]
+        return events[events["type"] != self.ADDRESS]
+
+    def extend(self, events):
+        """
+        Append an array of events to the log.
+
+        :param events: the events
+        :type events: :class:`numpy.ndarray` of :attr:`EVENT_DTYPE`
+        """
+        self._pack()
+        events = np.array(events, dtype=self.EVENT_DTYPE)
+        if len(events) == 0:
+            return
+        self._grouped = None
+        if self.spill_path is None:
+            self._chunks.append(events)
+        else:
+            with open(self.spill_path, "ab") as fd:
+                events.tofile(fd)
+            self._spilled += len(events)
+            self._mmap = None
+
+    def split(self, remap):
+        """
+        Remove the events of some nodes from the log and renumber
+        the nodes of the remaining events.
+
+        :param remap: array indexed by node with the new node index,
+        the events of the nodes mapped to -1 are removed
+        :type remap: :class:`numpy.ndarray`
+        :return: the removed events, with the original node index
+        :rtype: :class:`numpy.ndarray` of :attr:`EVENT_DTYPE`
+        """
+        events = self.events()
+        nodes = remap[events["node"]]
+        keep = nodes >= 0
+        removed = events[~keep]
+        kept = events[keep]
+        kept["node"] = nodes[keep]
+        self._chunks = []
+        self._spilled = 0
+        self._mmap = None
+        self._grouped = None
+        if self.spill_path is not None:
+            # start over with a truncated spill file
+            open(self.spill_path, "wb").close()
+        self.extend(kept)
+        return removed
+
+    def __getstate__(self):
+        # the spill file is not part of the saved state
+        return {"chunk_size": self.chunk_size, "events": self.events()}
+
+    def __setstate__(self, state):
+        self.__init__(state["chunk_size"])
+        self.extend(state["events"])
+
+
+class _AddressView(MutableMapping):
+    """
+    Dict-like interface to the store events of a vertex in a
+    :class:`.NodeDataMap`.
+
+    The log is append-only, assigning an address to a time
+    appends a store event and reading a time returns the
+    address of the last store event at that time.
+    """
+
+    def __init__(self, node_map, vertex):
+        self._events = node_map.events
+        self._vertex = int(vertex)
+
+    def _as_dict(self):
+        events = self._events.node_events(self._vertex, address=True)
+        return dict(zip(events["time"].tolist(), events["addr"].tolist()))
+
+    def __getitem__(self, time):
+        return self._as_dict()[time]
+
+    def __setitem__(self, time, addr):
+        self._events.append(self._vertex, time, addr, True,
+                            ProvenanceEventLog.ADDRESS)
+
+    def __delitem__(self, time):
+        raise TypeError("The store event log is append-only")
+
+    def __iter__(self):
+        return iter(self._as_dict())
+
+    def __len__(self):
+        return len(self._as_dict())
+
+    def items(self):
+        return list(self._as_dict().items())
+
+    def values(self):
+        return list(self._as_dict().values())
+
+
+class NodeDataView(NodeData):
+    """
+    :class:`.NodeData` interface to the data of a vertex in a
+    :class:`.NodeDataMap`, changes to the view are written to
+    the vertex properties.
+    """
+
+    def __init__(self, node_map, vertex):
+        self._map = node_map
+        self._vertex = vertex
+
+    @property
+    def cap(self):
+        return CheriCapView(self._map, self._vertex)
+
+    @cap.setter
+    def cap(self, cap):
+        view = CheriCapView(self._map, self._vertex)
+        for name in CheriCapView.FIELDS:
+            setattr(view, name, getattr(cap, name))
+
+    @property
+    def origin(self):
+        return CheriNodeOrigin(self._map.props["origin"][self._vertex])
+
+    @origin.setter
+    def origin(self, origin):
+        if origin is None:
+            origin = CheriNodeOrigin.UNKNOWN
+        self._map.props["origin"][self._vertex] = origin
+
+    @property
+    def pc(self):
+        return _from_int64(self._map.props["pc"][self._vertex])
+
+    @pc.setter
+    def pc(self, pc):
+        self._map.props["pc"][self._vertex] = _to_int64(pc)
+
+    @property
+    def is_kernel(self):
+        return bool(self._map.props["is_kernel"][self._vertex])
+
+    @is_kernel.setter
+    def is_kernel(self, is_kernel):
+        self._map.props["is_kernel"][self._vertex] = bool(is_kernel)
+
+    @property
+    def address(self):
+        return _AddressView(self._map, self._vertex)
+
+    @property
+    def deref(self):
+        events = self._map.events.node_events(int(self._vertex),
+                                              address=False)
+        return {
+            "time": events["time"].tolist(),
+            "addr": events["addr"].tolist(),
+            "is_cap": events["is_cap"].tolist(),
+            "type": [NodeData.DerefType(t) for t in events["type"]],
+        }
+
+    def add_deref(self, time, addr, cap, type_):
+        """
+        Append a dereference to the event log, or update the
+        dereference statistics of the vertex if the map keeps them.
+        """
+        if self._map.deref_stats:
+            self._map.add_deref_stats(self._vertex, time, addr, type_)
+        else:
+            self._map.events.append(int(self._vertex), time, addr, cap,
+                                    type_)
+
+    add_load = partialmethod(add_deref, type_=NodeData.DerefType.DEREF_LOAD)
+    add_store = partialmethod(add_deref, type_=NodeData.DerefType.DEREF_STORE)
+    add_call = partialmethod(add_deref, type_=NodeData.DerefType.DEREF_CALL)
+
+
+class NodeDataMap:
+    """
+    Columnar store of the :class:`.NodeData` of the vertices in a
+    provenance graph.
+
+    The node data is stored in typed vertex properties of the graph
+    instead of a python object for each vertex, unsigned 64-bit values
+    are stored in int64 properties in two's complement.
+    The stores and dereferences of the capabilities are kept in a
+    :class:`.ProvenanceEventLog` in the "events" graph property.
+    Indexing the map with a vertex returns a :class:`.NodeDataView`
+    and assigning a :class:`.NodeData` to a vertex stores its content.
+
+    When the dereference statistics are enabled the dereferences are
+    not recorded in the event log, each vertex keeps the number of
+    dereferences of each type, the first and last dereference time,
+    the lowest and highest dereferenced address and a histogram of the
+    dereferenced offsets in :attr:`DEREF_BUCKETS` equal slices of the
+    capability bounds.
+    """
+
+    PROPERTIES = (
+        ("base", "int64_t"),
+        ("length", "int64_t"),
+        ("offset", "int64_t"),
+        ("perms", "int64_t"),
+        ("otype", "int32_t"),
+        ("valid", "bool"),
+        ("sealed", "bool"),
+        ("t_alloc", "int64_t"),
+        ("t_free", "int64_t"),
+        ("pc", "int64_t"),
+        ("origin", "int16_t"),
+        ("is_kernel", "bool"),
+        ("gid", "int64_t"),
+        ("parent", "int64_t"),
+    )
+    """Name and value type of the vertex properties."""
+
+    DEREF_BUCKETS = 8
+    """Number of buckets of the dereferenced offset histogram."""
+
+    DEREF_COUNTS = {
+        NodeData.DerefType.DEREF_LOAD: "n_load",
+        NodeData.DerefType.DEREF_STORE: "n_store",
+        NodeData.DerefType.DEREF_CALL: "n_call",
+    }
+    """Name of the dereference count property of each dereference type."""
+
+    DEREF_STATS = (
+        ("n_load", "int64_t"),
+        ("n_store", "int64_t"),
+        ("n_call", "int64_t"),
+        ("t_first_deref", "int64_t"),
+        ("t_last_deref", "int64_t"),
+        ("deref_min", "int64_t"),
+        ("deref_max", "int64_t"),
+    ) + tuple(("deref_hist_%d" % idx, "int64_t")
+              for idx in range(DEREF_BUCKETS))
+    """Name and value type of the dereference statistics properties."""
+
+    def __init__(self, graph, deref_stats=False):
+        """
+        The vertex properties are created if they are not found
+        in the graph.
+
+        :param graph: the provenance graph
+        :type graph: :class:`graph_tool.Graph`
+        :param deref_stats: keep dereference statistics instead of
+        recording the dereferences, the statistics are always kept if
+        the graph has them
+        :type deref_stats: bool
+        """
+        self.graph = graph
+        """The provenance graph."""
+
+        self.props = {}
+        """Vertex property maps by name."""
+
+        self.columns = self.PROPERTIES
+        """Name and value type of the vertex properties in use."""
+
+        if "data" in graph.vp and "base" not in graph.vp:
+            logger.error("The graph stores the node data in python objects, "
+                         "the graph should be rebuilt")
+            raise ValueError("Graph with object node data")
+        num_vertices = graph.num_vertices(ignore_filter=True)
+        if "gid" not in graph.vp and num_vertices:
+            # existing vertices get their index as global id
+            # and no recorded parent
+            graph.vp["gid"] = graph.new_vertex_property("int64_t")
+            graph.vp["gid"].a = np.arange(num_vertices)
+            graph.vp["parent"] = graph.new_vertex_property("int64_t")
+            graph.vp["parent"].a = -1
+        for name, value_type in self.PROPERTIES:
+            if name not in graph.vp:
+                graph.vp[name] = graph.new_vertex_property(value_type)
+            self.props[name] = graph.vp[name]
+        if "next_gid" not in graph.gp:
+            graph.gp["next_gid"] = graph.new_graph_property("int64_t")
+            graph.gp["next_gid"] = num_vertices
+        if "events" not in graph.gp:
+            graph.gp["events"] = graph.new_graph_property("object")
+            graph.gp["events"] = ProvenanceEventLog()
+        if deref_stats or "n_load" in graph.vp:
+            self.enable_deref_stats()
+
+    @property
+    def deref_stats(self):
+        """Whether the map keeps dereference statistics."""
+        return "n_load" in self.props
+
+    def enable_deref_stats(self):
+        """
+        Keep dereference statistics for the following dereferences
+        instead of recording them in the event log.
+        """
+        for name, value_type in self.DEREF_STATS:
+            if name not in self.graph.vp:
+                self.graph.vp[name] = self.graph.new_vertex_property(
+                    value_type)
+            self.props[name] = self.graph.vp[name]
+        self.columns = self.PROPERTIES + self.DEREF_STATS
+
+    def _deref_bucket(self, vertex, addr):
+        """Offset histogram bucket of a dereferenced address."""
+        base = _from_int64(self.props["base"][vertex])
+        length = _from_int64(self.props["length"][vertex])
+        if length == 0 or addr < base:
+            return 0
+        return min((addr - base) * self.DEREF_BUCKETS // length,
+                   self.DEREF_BUCKETS - 1)
+
+    def add_deref_stats(self, vertex, time, addr, type_):
+        """
+        Update the dereference statistics of a vertex.
+
+        :param vertex: the dereferenced vertex
+        :type vertex: :class:`graph_tool.Vertex`
+        :param time: dereference time
+        :type time: int
+        :param addr: dereferenced address
+        :type addr: int
+        :param type_: dereference type
+        :type type_: :class:`.NodeData.DerefType`
+        """
+        props = self.props
+        first = all(props[name][vertex] == 0
+                    for name in self.DEREF_COUNTS.values())
+        count = props[self.DEREF_COUNTS[type_]]
+        count[vertex] = count[vertex] + 1
+        if first:
+            props["t_first_deref"][vertex] = time
+            props["t_last_deref"][vertex] = time
+            props["deref_min"][vertex] = _to_int64(addr)
+            props["deref_max"][vertex] = _to_int64(addr)
+        else:
+            props["t_first_deref"][vertex] = min(
+                props["t_first_deref"][vertex], time)
+            props["t_last_deref"][vertex] = max(
+                props["t_last_deref"][vertex], time)
+            props["deref_min"][vertex] = _to_int64(min(
+                _from_int64(props["deref_min"][vertex]), addr))
+            props["deref_max"][vertex] = _to_int64(max(
+                _from_int64(props["deref_max"][vertex]), addr))
+        bucket = props["deref_hist_%d" % self._deref_bucket(vertex, addr)]
+        bucket[vertex] = bucket[vertex] + 1
+
+    def deref_count(self):
+        """
+        Return the number of dereferences of each vertex, the
+        dereference statistics must be enabled.
+
+        :return: number of dereferences, indexed by vertex
+        :rtype: :class:`numpy.ndarray`
+        """
+        return sum(self.array(name) for name in self.DEREF_COUNTS.values())
+
+    @property
+    def events(self):
+        """The :class:`.ProvenanceEventLog` of the graph."""
+        return self.graph.gp["events"]
+
+    def __getitem__(self, vertex):
+        return NodeDataView(self, vertex)
+
+    def __setitem__(self, vertex, data):
+        view = NodeDataView(self, vertex)
+        view.cap = data.cap if data.cap is not None else CheriCap()
+        view.origin = data.origin
+        view.pc = data.pc
+        view.is_kernel = data.is_kernel
+        for time, addr in data.address.items():
+            view.address[time] = addr
+        for time, addr, is_cap, type_ in zip(
+                data.deref["time"], data.deref["addr"],
+                data.deref["is_cap"], data.deref["type"]):
+            view.add_deref(time, addr, is_cap, type_)
+
+    def add_vertex(self, data, parent=None):
+        """
+        Add a vertex to the graph and store its data.
+
+        Each vertex gets a global id that is not changed when other
+        vertices are removed from the graph, the global id of the
+        parent is recorded as well so that the edges can be rebuilt
+        if the parent is removed.
+
+        :param data: the node data
+        :type data: :class:`.NodeData`
+        :param parent: optional parent vertex, an edge from the parent
+        to the new vertex is created
+        :type parent: :class:`graph_tool.Vertex`
+        :return: the new vertex
+        :rtype: :class:`graph_tool.Vertex`
+        """
+        vertex = self.graph.add_vertex()
+        gid = self.graph.gp["next_gid"]
+        self.graph.gp["next_gid"] = gid + 1
+        self.props["gid"][vertex] = gid
+        if parent is None:
+            self.props["parent"][vertex] = -1
+        else:
+            self.props["parent"][vertex] = self.props["gid"][parent]
+            self.graph.add_edge(parent, vertex)
+        self[vertex] = data
+        return vertex
+
+    def array(self, name):
+        """
+        Return the numpy array of a scalar property, indexed by vertex.
+
+        The array is a view of the property values, with the unsigned
+        64-bit values in two's complement.
+
+        :param name: property name
+        :type name: str
+        :return: property values
+        :rtype: :class:`numpy.ndarray`
+        """
+        return self.props[name].a
+
+    def vertex_mask(self):
+        """
+        Return a boolean numpy array, indexed by vertex, that is True
+        for the vertices not hidden by the vertex filter of the graph.
+
+        :return: mask of the visible vertices
+        :rtype: :class:`numpy.ndarray`
+        """
+        vfilt, inverted = self.graph.get_vertex_filter()
+        if vfilt is None:
+            size = self.graph.num_vertices(ignore_filter=True)
+            return np.ones(size, dtype=bool)
+        mask = vfilt.a.astype(bool)
+        return ~mask if inverted else mask
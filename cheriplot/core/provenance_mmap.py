@@ -0,0 +1,398 @@
+#-
+# Copyright (c) 2017 Alfredo Mazzinghi
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# @BERI_LICENSE_HEADER_START@
+#
+# Licensed to BERI Open Systems C.I.C. (BERI) under one or more contributor
+# license agreements.  See the NOTICE file distributed with this work for
+# additional information regarding copyright ownership.  BERI licenses this
+# file to you under the BERI Hardware-Software License, Version 1.0 (the
+# "License"); you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at:
+#
+#   http://www.beri-open-systems.org/legal/license-1-0.txt
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @BERI_LICENSE_HEADER_END@
+#
+
+
+"""
+Memory-mapped binary format of the provenance graph.
+
+The graph is stored in a directory with a numpy file for each vertex
+property, the edges in compressed sparse row (CSR) form and the
+dereference and store events as offset and value arrays grouped
+by vertex. The files are memory-mapped when the graph is opened, so
+only the properties that are accessed are read from disk.
+"""
+
+import os
+import shutil
+import pickle
+import logging
+import numpy as np
+
+from graph_tool.all import Graph
+
+from cheriplot.core.provenance import NodeDataMap, ProvenanceEventLog
+from cheriplot.core.provenance_store import VALUE_DTYPES
+
+logger = logging.getLogger(__name__)
+
+
+def _save_csr(path, name, nodes, values, num_vertices):
+    """
+    Save values grouped by node as an offset array and a value array,
+    the values of node n are values[offsets[n]:offsets[n + 1]].
+    """
+    order = np.argsort(nodes, kind="mergesort")
+    offsets = np.zeros(num_vertices + 1, dtype=np.int64)
+    np.cumsum(np.bincount(nodes, minlength=num_vertices), out=offsets[1:])
+    np.save(os.path.join(path, name + "_offsets.npy"), offsets)
+    np.save(os.path.join(path, name + ".npy"), values[order])
+
+
+def save_mapped_graph(graph, path):
+    """
+    Save a provenance graph in the memory-mapped format.
+
+    The directory is written in a temporary directory and moved
+    in place when complete, the vertex filter of the graph is saved
+    as well.
+
+    :param graph: the provenance graph
+    :type graph: :class:`graph_tool.Graph` or
+    :class:`MappedProvenanceGraph`
+    :param path: path of the graph directory
+    :type path: str
+    """
+    node_map = NodeDataMap(graph)
+    num_vertices = graph.num_vertices(ignore_filter=True)
+    vertex_filter, inverted = graph.get_vertex_filter()
+    visible = node_map.vertex_mask()
+
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for name, value_type in node_map.columns:
+        np.save(os.path.join(tmp_path, name + ".npy"),
+                node_map.array(name).astype(VALUE_DTYPES[value_type]))
+
+    # the edges of the hidden vertices are saved as well
+    graph.set_vertex_filter(None)
+    try:
+        edges = np.asarray(graph.get_edges(), dtype=np.int64).reshape(-1, 2)
+    finally:
+        graph.set_vertex_filter(vertex_filter, inverted=inverted)
+    _save_csr(tmp_path, "edges", edges[:, 0], edges[:, 1], num_vertices)
+
+    events = node_map.events.events()
+    is_address = events["type"] == ProvenanceEventLog.ADDRESS
+    for name, mask in (("deref", ~is_address), ("address", is_address)):
+        _save_csr(tmp_path, name, events["node"][mask], events[mask],
+                  num_vertices)
+    if vertex_filter is not None:
+        np.save(os.path.join(tmp_path, "visible.npy"), visible)
+
+    meta = {"vertices": num_vertices, "edges": len(edges),
+            "columns": list(node_map.columns),
+            "next_gid": int(graph.gp["next_gid"])}
+    with open(os.path.join(tmp_path, "graph.pickle"), "wb") as fd:
+        pickle.dump(meta, fd, pickle.HIGHEST_PROTOCOL)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    logger.debug("Saved mapped provenance graph with %d nodes and %d edges "
+                 "to %s", num_vertices, len(edges), path)
+
+
+class _ArrayProperty:
+    """
+    Vertex property backed by a numpy array, with the subset of the
+    :class:`graph_tool.VertexPropertyMap` interface used by
+    :class:`cheriplot.core.provenance.NodeDataMap`.
+    """
+
+    def __init__(self, array):
+        self._array = array
+
+    @property
+    def a(self):
+        return self._array
+
+    @a.setter
+    def a(self, values):
+        self._array[:] = values
+
+    def __getitem__(self, vertex):
+        return self._array[int(vertex)].item()
+
+    def __setitem__(self, vertex, value):
+        self._array[int(vertex)] = value
+
+
+class _MappedProperties(dict):
+    """
+    Vertex properties of a :class:`MappedProvenanceGraph`, the
+    property files are mapped the first time they are accessed.
+    """
+
+    def __init__(self, graph, columns):
+        super().__init__()
+        self._graph = graph
+        self._columns = dict(columns)
+
+    def __contains__(self, name):
+        return super().__contains__(name) or name in self._columns
+
+    def __missing__(self, name):
+        if name not in self._columns:
+            raise KeyError(name)
+        prop = _ArrayProperty(self._graph._load(name))
+        self[name] = prop
+        return prop
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def keys(self):
+        return set(super().keys()) | set(self._columns)
+
+
+class MappedEventLog:
+    """
+    Read-only event log of a :class:`MappedProvenanceGraph`, with the
+    read interface of :class:`cheriplot.core.provenance.ProvenanceEventLog`.
+
+    The events of each vertex are stored contiguously, the events of a
+    vertex are sorted by time.
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def _csr(self, name):
+        return (self._graph._load(name + "_offsets"), self._graph._load(name))
+
+    def __len__(self):
+        return sum(len(self._graph._load(name))
+                   for name in ("deref", "address"))
+
+    def events(self):
+        """
+        Return all the events, grouped by vertex and sorted by time.
+
+        :return: the events
+        :rtype: :class:`numpy.ndarray` of
+        :attr:`cheriplot.core.provenance.ProvenanceEventLog.EVENT_DTYPE`
+        """
+        events = np.concatenate((self._graph._load("deref"),
+                                 self._graph._load("address")))
+        return events[np.lexsort((events["time"], events["node"]))]
+
+    def node_events(self, node, address=None):
+        """
+        Return the events of a vertex.
+
+        :param node: vertex index
+        :type node: int
+        :param address: if True return only the store events,
+        if False return only the dereferences, None returns both
+        :type address: bool
+        :return: the events
+        :rtype: :class:`numpy.ndarray` of
+        :attr:`cheriplot.core.provenance.ProvenanceEventLog.EVENT_DTYPE`
+        """
+        node = int(node)
+        parts = []
+        for name, is_address in (("deref", False), ("address", True)):
+            if address is None or address == is_address:
+                offsets, values = self._csr(name)
+                parts.append(values[offsets[node]:offsets[node + 1]])
+        if len(parts) == 1:
+            return parts[0]
+        events = np.concatenate(parts)
+        return events[np.argsort(events["time"], kind="mergesort")]
+
+    def append(self, *args, **kwargs):
+        logger.error("Can not add events to a mapped provenance graph")
+        raise TypeError("The mapped event log is read-only")
+
+    extend = append
+
+
+class MappedProvenanceGraph:
+    """
+    Provenance graph opened from the memory-mapped format written
+    by :func:`save_mapped_graph`.
+
+    The graph implements the subset of the :class:`graph_tool.Graph`
+    interface used by :class:`cheriplot.core.provenance.NodeDataMap`
+    and by the provenance plots: vertices are integers, vertex
+    properties expose their values as numpy arrays and the vertex
+    filter hides vertices. The property files are mapped copy-on-write,
+    changes to the properties and new edges are kept in memory.
+    :meth:`to_graph` builds a :class:`graph_tool.Graph` for the graph
+    algorithms.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the graph directory
+        :type path: str
+        """
+        self.path = path
+        """Path of the graph directory."""
+
+        with open(os.path.join(path, "graph.pickle"), "rb") as fd:
+            meta = pickle.load(fd)
+
+        self._num_vertices = meta["vertices"]
+        """Number of vertices, including the hidden ones."""
+
+        self._arrays = {}
+        """Mapped arrays by file name."""
+
+        self._new_edges = []
+        """Edges added to the graph, kept in memory."""
+
+        self.vp = _MappedProperties(self, meta["columns"])
+        """Vertex properties by name."""
+
+        self.gp = {"next_gid": meta["next_gid"],
+                   "events": MappedEventLog(self)}
+        """Graph properties by name."""
+
+        self._vertex_filter = (None, False)
+        if os.path.exists(os.path.join(path, "visible.npy")):
+            self._vertex_filter = (_ArrayProperty(self._load("visible")),
+                                   False)
+
+    def _load(self, name):
+        """Map a numpy file of the graph directory."""
+        if name not in self._arrays:
+            self._arrays[name] = np.load(
+                os.path.join(self.path, name + ".npy"), mmap_mode="c")
+        return self._arrays[name]
+
+    def new_vertex_property(self, value_type):
+        """
+        Create a vertex property held in memory.
+
+        :param value_type: graph-tool value type of the property
+        :type value_type: str
+        """
+        return _ArrayProperty(np.zeros(self._num_vertices,
+                                       dtype=VALUE_DTYPES[value_type]))
+
+    def new_graph_property(self, value_type):
+        return None
+
+    def _visible(self):
+        vfilt, inverted = self._vertex_filter
+        if vfilt is None:
+            return None
+        mask = vfilt.a.astype(bool)
+        return ~mask if inverted else mask
+
+    def num_vertices(self, ignore_filter=False):
+        """
+        :param ignore_filter: count the hidden vertices as well
+        :type ignore_filter: bool
+        :return: number of vertices
+        :rtype: int
+        """
+        visible = self._visible()
+        if ignore_filter or visible is None:
+            return self._num_vertices
+        return int(np.count_nonzero(visible))
+
+    def vertices(self):
+        """
+        :return: iterator over the visible vertices
+        """
+        visible = self._visible()
+        if visible is None:
+            return iter(range(self._num_vertices))
+        return iter(np.flatnonzero(visible).tolist())
+
+    def vertex(self, index):
+        return int(index)
+
+    def get_vertex_filter(self):
+        return self._vertex_filter
+
+    def set_vertex_filter(self, prop, inverted=False):
+        self._vertex_filter = (prop, inverted)
+
+    def get_edges(self):
+        """
+        Return the edges between visible vertices.
+
+        :return: array of (source, target) rows
+        :rtype: :class:`numpy.ndarray`
+        """
+        offsets = self._load("edges_offsets")
+        sources = np.repeat(np.arange(self._num_vertices), np.diff(offsets))
+        edges = np.column_stack((sources, self._load("edges")))
+        if self._new_edges:
+            edges = np.concatenate([edges] + self._new_edges)
+        visible = self._visible()
+        if visible is not None:
+            edges = edges[visible[edges[:, 0]] & visible[edges[:, 1]]]
+        return edges
+
+    def add_edge_list(self, edges):
+        """
+        Add edges to the graph, the edges are kept in memory.
+
+        :param edges: array of (source, target) rows
+        """
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        self._new_edges.append(edges)
+
+    def add_edge(self, source, target):
+        self.add_edge_list([(int(source), int(target))])
+
+    def to_graph(self):
+        """
+        Build a :class:`graph_tool.Graph` with the content of the
+        mapped graph and the same vertex filter.
+
+        :return: the provenance graph
+        :rtype: :class:`graph_tool.Graph`
+        """
+        graph = Graph(directed=True)
+        graph.add_vertex(self._num_vertices)
+        node_map = NodeDataMap(graph, deref_stats="n_load" in self.vp)
+        for name, value_type in node_map.columns:
+            if name in self.vp:
+                node_map.props[name].a = self.vp[name].a
+        graph.gp["next_gid"] = self.gp["next_gid"]
+        vertex_filter = self._vertex_filter
+        self._vertex_filter = (None, False)
+        try:
+            graph.add_edge_list(self.get_edges())
+        finally:
+            self._vertex_filter = vertex_filter
+        node_map.events.extend(self.gp["events"].events())
+        visible = self._visible()
+        if visible is not None:
+            prop = graph.new_vertex_property("bool")
+            prop.a = visible
+            graph.set_vertex_filter(prop)
+        return graph
@@ -0,0 +1,206 @@
+#-
+# Copyright (c) 2017 Alfredo Mazzinghi
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# @BERI_LICENSE_HEADER_START@
+#
+# Licensed to BERI Open Systems C.I.C. (BERI) under one or more contributor
+# license agreements.  See the NOTICE file distributed with this work for
+# additional information regarding copyright ownership.  BERI licenses this
+# file to you under the BERI Hardware-Software License, Version 1.0 (the
+# "License"); you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at:
+#
+#   http://www.beri-open-systems.org/legal/license-1-0.txt
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @BERI_LICENSE_HEADER_END@
+#
+
+
+"""
+Append-only on-disk store of the provenance graph nodes.
+
+When the provenance graph is built in streaming mode the nodes that
+can not be referenced anymore are flushed to the store and removed
+from the graph held in memory. The store uses a columnar layout with
+a raw file for each vertex property and one for the event log, the
+graph is rebuilt from the store when the parsing is done.
+"""
+
+import os
+import shutil
+import pickle
+import logging
+import numpy as np
+
+from graph_tool.all import Graph
+
+from cheriplot.core.provenance import NodeDataMap, ProvenanceEventLog
+
+logger = logging.getLogger(__name__)
+
+VALUE_DTYPES = {
+    "int64_t": np.int64,
+    "int32_t": np.int32,
+    "int16_t": np.int16,
+    "bool": np.bool_,
+}
+"""Numpy dtype of the graph-tool vertex property value types."""
+
+
+def get_provenance_store_path(trace_path):
+    """
+    Return the path of the provenance graph store of a trace.
+    """
+    return trace_path + "_provenance"
+
+
+class ProvenanceGraphWriter:
+    """
+    Write the provenance graph nodes to the store directory.
+
+    The nodes are appended to the store in the order in which they
+    are flushed, the edges are recorded by the "parent" column that
+    holds the global id of the parent of each node.
+    The store is written in a temporary directory and moved in
+    place when the writer is closed.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the store directory
+        :type path: str
+        """
+        self.path = path
+        """Path of the store directory."""
+
+        self.num_nodes = 0
+        """Number of nodes written."""
+
+        self.num_events = 0
+        """Number of events written."""
+
+        self._tmp_path = path + ".tmp"
+        if os.path.exists(self._tmp_path):
+            shutil.rmtree(self._tmp_path)
+        os.makedirs(self._tmp_path)
+
+        self._columns = {}
+        """Open file of each column."""
+
+        self._column_types = list(NodeDataMap.PROPERTIES)
+        """Name and value type of the columns."""
+
+        for name, value_type in self._column_types:
+            self._columns[name] = open(
+                os.path.join(self._tmp_path, name + ".bin"), "wb")
+        self._events = open(os.path.join(self._tmp_path, "events.bin"), "wb")
+
+    def write_nodes(self, node_map, vertices):
+        """
+        Append the data of the given vertices to the store.
+
+        :param node_map: node data of the graph
+        :type node_map: :class:`cheriplot.core.provenance.NodeDataMap`
+        :param vertices: indices of the vertices to write
+        :type vertices: :class:`numpy.ndarray`
+        """
+        for name, value_type in node_map.columns:
+            if name not in self._columns:
+                if self.num_nodes:
+                    logger.error("Column %s added to a non-empty store",
+                                 name)
+                    raise ValueError("Column added to a non-empty store")
+                self._columns[name] = open(
+                    os.path.join(self._tmp_path, name + ".bin"), "wb")
+                self._column_types.append((name, value_type))
+            column = node_map.array(name)[vertices]
+            column.astype(VALUE_DTYPES[value_type]).tofile(
+                self._columns[name])
+        self.num_nodes += len(vertices)
+
+    def write_events(self, events, gids):
+        """
+        Append events to the store, the node of each event is
+        replaced by its global id.
+
+        :param events: the events
+        :type events: :class:`numpy.ndarray` of
+        :attr:`cheriplot.core.provenance.ProvenanceEventLog.EVENT_DTYPE`
+        :param gids: global id of the vertices, indexed by vertex
+        :type gids: :class:`numpy.ndarray`
+        """
+        events = np.array(events, dtype=ProvenanceEventLog.EVENT_DTYPE)
+        events["node"] = gids[events["node"]]
+        events.tofile(self._events)
+        self.num_events += len(events)
+
+    def close(self):
+        """Close the column files and move the store in place."""
+        for fd in self._columns.values():
+            fd.close()
+        self._events.close()
+        meta = {"nodes": self.num_nodes, "events": self.num_events,
+                "columns": self._column_types}
+        with open(os.path.join(self._tmp_path, "store.pickle"), "wb") as fd:
+            pickle.dump(meta, fd, pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self._tmp_path, self.path)
+        logger.info("Wrote %d provenance nodes and %d events to %s",
+                    self.num_nodes, self.num_events, self.path)
+
+
+def load_provenance_graph(path):
+    """
+    Rebuild the provenance graph from a store directory.
+
+    The vertices of the graph are sorted by global id.
+
+    :param path: path of the store directory
+    :type path: str
+    :return: the provenance graph
+    :rtype: :class:`graph_tool.Graph`
+    """
+    with open(os.path.join(path, "store.pickle"), "rb") as fd:
+        meta = pickle.load(fd)
+
+    def column(name, dtype, count):
+        return np.fromfile(os.path.join(path, name + ".bin"),
+                           dtype=dtype, count=count)
+
+    num_nodes = meta["nodes"]
+    gids = column("gid", np.int64, num_nodes)
+    order = np.argsort(gids, kind="mergesort")
+    sorted_gids = gids[order]
+
+    graph = Graph(directed=True)
+    graph.add_vertex(num_nodes)
+    node_map = NodeDataMap(graph, deref_stats=any(
+        name == "n_load" for name, value_type in meta["columns"]))
+    for name, value_type in meta["columns"]:
+        values = column(name, VALUE_DTYPES[value_type], num_nodes)
+        node_map.props[name].a = values[order]
+    graph.gp["next_gid"] = int(sorted_gids[-1]) + 1 if num_nodes else 0
+
+    parents = node_map.array("parent")
+    children = np.flatnonzero(parents >= 0)
+    edges = np.column_stack((
+        np.searchsorted(sorted_gids, parents[children]), children))
+    graph.add_edge_list(edges)
+
+    events = column("events", ProvenanceEventLog.EVENT_DTYPE, meta["events"])
+    events["node"] = np.searchsorted(sorted_gids, events["node"])
+    node_map.events.extend(events)
+    logger.debug("Loaded %d provenance nodes and %d events from %s",
+                 num_nodes, len(events), path)
+    return graph
@@ -0,0 +1,178 @@
+#-
+# Copyright (c) 2017 Alfredo Mazzinghi
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# @BERI_LICENSE_HEADER_START@
+#
+# Licensed to BERI Open Systems C.I.C. (BERI) under one or more contributor
+# license agreements.  See the NOTICE file distributed with this work for
+# additional information regarding copyright ownership.  BERI licenses this
+# file to you under the BERI Hardware-Software License, Version 1.0 (the
+# "License"); you may not use this file except in compliance with the
+# License.  You may obtain a copy of the License at:
+#
+#   http://www.beri-open-systems.org/legal/license-1-0.txt
+#
+# Unless required by applicable law or agreed to in writing, Work distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# @BERI_LICENSE_HEADER_END@
+#
+
+
+"""
+Page-granular shadow memory that records which capability is stored
+in each capability-sized memory location.
+"""
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowMemory:
+    """
+    Map capability-aligned memory slots to integer node ids.
+
+    Each touched page holds a compact array with one slot for
+    each capability-sized location in the page, lookups and updates
+    are O(1). Slots that hold no capability are :attr:`EMPTY`, slots
+    whose content is not known are :attr:`UNKNOWN`, pages that are
+    not touched have all their slots set to the default value.
+    """
+
+    EMPTY = -1
+    """Slot value of a location that does not hold a capability."""
+
+    UNKNOWN = -2
+    """Slot value of a location whose content is not known."""
+
+    def __init__(self, page_size=2**12, slot_size=32, default=EMPTY):
+        """
+        :param page_size: size of a page in bytes, a power of 2
+        :type page_size: int
+        :param slot_size: size of a capability in bytes, a power of 2
+        :type slot_size: int
+        :param default: value of the slots that have not been set
+        :type default: int
+        """
+        self.page_size = page_size
+        """Size of a page in bytes."""
+
+        self.slot_size = slot_size
+        """Size of a slot in bytes."""
+
+        self.default = default
+        """Value of the slots that have not been set."""
+
+        self.pages = {}
+        """Slot array of each touched page, by page number."""
+
+        self._page_shift = page_size.bit_length() - 1
+        self._slot_shift = slot_size.bit_length() - 1
+        self._slot_mask = (page_size - 1) >> self._slot_shift
+
+    def _page(self, page_number):
+        page = self.pages.get(page_number)
+        if page is None:
+            page = np.full(self.page_size >> self._slot_shift,
+                           self.default, dtype=np.int64)
+            self.pages[page_number] = page
+        return page
+
+    def __getitem__(self, addr):
+        page = self.pages.get(addr >> self._page_shift)
+        if page is None:
+            return self.default
+        return int(page[(addr >> self._slot_shift) & self._slot_mask])
+
+    def __setitem__(self, addr, node):
+        page = self._page(addr >> self._page_shift)
+        page[(addr >> self._slot_shift) & self._slot_mask] = int(node)
+
+    def clear(self, addr):
+        """
+        Mark the slot that contains the given address as :attr:`EMPTY`.
+        No page is allocated if the slot is already empty.
+
+        :param addr: memory address
+        :type addr: int
+        """
+        page = self.pages.get(addr >> self._page_shift)
+        if page is None:
+            if self.default == self.EMPTY:
+                return
+            page = self._page(addr >> self._page_shift)
+        page[(addr >> self._slot_shift) & self._slot_mask] = self.EMPTY
+
+    def __len__(self):
+        return sum(int(np.count_nonzero(page >= 0))
+                   for page in self.pages.values())
+
+    def items(self):
+        """
+        Return the (slot address, node id) of the slots that
+        hold a node.
+
+        :return: list of tuples
+        :rtype: list
+        """
+        items = []
+        for page_number in sorted(self.pages):
+            page = self.pages[page_number]
+            base = page_number << self._page_shift
+            for slot in np.flatnonzero(page >= 0):
+                items.append((base + (int(slot) << self._slot_shift),
+                              int(page[slot])))
+        return items
+
+    def nodes(self):
+        """
+        Return the distinct node ids stored in the shadow memory.
+
+        :return: sorted array of node ids
+        :rtype: :class:`numpy.ndarray`
+        """
+        if not self.pages:
+            return np.empty(0, dtype=np.int64)
+        slots = np.concatenate(list(self.pages.values()))
+        return np.unique(slots[slots >= 0])
+
+    def remap(self, remap):
+        """
+        Renumber the nodes, the slots of nodes mapped to a negative
+        id become :attr:`EMPTY`.
+
+        :param remap: array indexed by node id with the new node id
+        :type remap: :class:`numpy.ndarray`
+        """
+        for page in self.pages.values():
+            used = page >= 0
+            page[used] = np.maximum(remap[page[used]], self.EMPTY)
+
+    def update(self, other, remap):
+        """
+        Copy the known slots of another shadow memory, the node ids
+        are translated with the given mapping.
+
+        :param other: shadow memory to copy
+        :type other: :class:`.ShadowMemory`
+        :param remap: array indexed by node id of the other shadow
+        memory with the new node id
+        :type remap: :class:`numpy.ndarray`
+        """
+        for page_number, other_page in other.pages.items():
+            known = other_page != self.UNKNOWN
+            if not np.any(known):
+                continue
+            values = other_page[known]
+            used = values >= 0
+            values[used] = np.maximum(remap[values[used]], self.EMPTY)
+            self._page(page_number)[known] = values
@@ -32,6 +32,8 @@ import argparse as ap
 import cProfile
 import pstats
 
+from cheriplot.core.cache import CacheManager, set_cache_manager
+
 class Tool:
     """
     Base class for tools that parse traces
@@ -80,6 +82,7 @@ class Tool:
             logging_args["filename"] = args.log
 
         logging.basicConfig(**logging_args)
+        self.setup(args)
 
         try:
             if args.profile:
@@ -101,6 +104,17 @@ class Tool:
         tool_name, _ = os.path.splitext(sys.argv[0])
         return "%s.cprof" % tool_name
 
+    def setup(self, args):
+        """
+        Configure the tool from the arguments before running it.
+
+        This method is meant to be overridden in subclasses.
+
+        :param args: the arguments namespace
+        :type args: :class:`argparse.Namespace`
+        """
+        return
+
     def _run(self, args):
         """
         Run the tool body.
@@ -119,7 +133,24 @@ class PlotTool(Tool):
         self.parser.add_argument("-c", "--cache",
                                  help="Enable caching of the parsed trace",
                                  action="store_true")
+        self.parser.add_argument("--cache-dir",
+                                 help="Directory of the cached datasets, "
+                                 "implies --cache (default "
+                                 "$CHERIPLOT_CACHE_DIR or "
+                                 "~/.cache/cheriplot)")
+        self.parser.add_argument("--no-cache",
+                                 help="Do not use or update the cached "
+                                 "datasets",
+                                 action="store_true")
         self.parser.add_argument("-o", "--outfile",
                                  help="Save plot to file, see matplotlib for "\
                                  "supported formats (svg, png, pgf...)")
-        
+
+    def setup(self, args):
+        super().setup(args)
+        if args.no_cache:
+            args.cache = False
+        elif args.cache_dir is not None:
+            args.cache = True
+        set_cache_manager(CacheManager(args.cache_dir,
+                                       enabled=not args.no_cache))
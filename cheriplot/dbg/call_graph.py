@@ -30,6 +30,7 @@ import logging
 from collections import deque
 from graph_tool.all import *
 
+from cheriplot.core.cache import get_cache_manager
 from cheriplot.core.parser import CallbackTraceParser
 from cheriplot.core.provenance import CheriCap
 from cheriplot.graph.call_graph import CallGraphManager
@@ -82,27 +83,30 @@ class CallGraphTraceParser(CallbackTraceParser):
         as the trace is parsed backwards.
         """
 
-    def _get_cache_file(self):
-        return "%s_call_graph.gt" % self.path
+    def _get_cache_entry(self, start, end):
+        options = {"start": start, "end": end, "depth": self.backtrace_depth}
+        return get_cache_manager().entry(self.path, self, "call_graph",
+                                         options, ".gt")
 
     def parse(self, start=None, end=None):
         # parse from the given start backwards
-        if self.cache:
-            try:
-                self.cgm.load(self._get_cache_file())
-                logger.info("Load cached call graph %s", self._get_cache_file())
-                return
-            except FileNotFoundError:
-                logger.info("Cache file %s not found", self._get_cache_file())
         if start == None:
             start = 0
         if end == None:
             end = len(self)
+        if self.cache:
+            entry = self._get_cache_entry(start, end)
+            if entry.is_valid():
+                self.cgm.load(entry.path)
+                logger.info("Load cached call graph %s", entry.path)
+                return
+            logger.info("Cache entry %s not found", entry.path)
         logger.info("Scan trace %s", self.path)
         super().parse(start, end, 1)
         if self.cache:
-            logger.info("Save call graph to %s", self._get_cache_file())
-            self.cgm.save(self._get_cache_file())
+            logger.info("Save call graph to %s", entry.path)
+            with entry.write() as path:
+                self.cgm.save(path)
 
     def do_scan(self, inst, entry):
         """Decide whether we should scan this instruction or not"""
@@ -29,7 +29,7 @@ import logging
 
 from graph_tool.all import load_graph
 
-from cheriplot.core.provenance import CheriNodeOrigin
+from cheriplot.core.provenance import CheriNodeOrigin, NodeDataMap
 
 logger = logging.getLogger(__name__)
 
@@ -50,6 +50,9 @@ class ProvenanceGraphInspector:
         self.graph = load_graph(graph_file)
         """The graph to dump."""
 
+        self.node_data = NodeDataMap(self.graph)
+        """Data of the graph vertices."""
+
         self.match_origin = None
         """Search for nodes with this origin"""
         self._check_origin_arg(match_origin)
@@ -185,7 +188,7 @@ class ProvenanceGraphInspector:
     def dump(self):
 
         for v in self.graph.vertices():
-            vdata = self.graph.vp.data[v]
+            vdata = self.node_data[v]
 
             match = self._update_match_result()
             match = self._match_origin(vdata, match)
@@ -208,7 +211,7 @@ class ProvenanceGraphInspector:
                             # predecessors
                             pred = next(current.in_neighbours())
                             current = pred
-                            vdata = self.graph.vp.data[pred]
+                            vdata = self.node_data[pred]
                             print("^")
                             print("|")
                             print("+- %s" % self._dump_vertex(vdata))
@@ -4,10 +4,12 @@ instruction traces.
 """
 
 import logging
+import numpy as np
 
 from collections import deque
 
 from cheriplot.core.parser import CallbackTraceParser
+from cheriplot.core.columns import match_windows
 from cheriplot.core.provenance import CheriCap
 
 logger = logging.getLogger(__name__)
@@ -92,11 +94,19 @@ class TraceDumpParser(CallbackTraceParser, TraceDumpMixin):
                  match_opcode=None, match_pc_start=None, match_pc_end=None,
                  match_reg=None, match_addr_start=None, match_addr_end=None,
                  match_exc=None, match_nop=None, match_syscall=None,
-                 match_perm=None, match_mode="and", before=0, after=0, **kwargs):
+                 match_perm=None, match_mode="and", before=0, after=0,
+                 columns=None, opcode_index=None, **kwargs):
         """
         This parser filters the trace according to a set of match
         conditions. Multiple match conditions can be used at the same time
         to refine or widen the filter.
+
+        :param columns: (kwarg) columns extracted from the trace, when
+        given only the entries that may match are parsed
+        :type columns: :class:`cheriplot.core.columns.TraceColumns`
+        :param opcode_index: (kwarg) opcode index of the trace, when
+        given only the entries that may match are parsed
+        :type opcode_index: :class:`cheriplot.core.opcode_index.OpcodeIndex`
         """
         super(TraceDumpParser, self).__init__(dataset, trace_path, **kwargs)
 
@@ -153,6 +163,12 @@ class TraceDumpParser(CallbackTraceParser, TraceDumpMixin):
         self._kernel_mode = False
         """Keep track of kernel-userspace transitions"""
 
+        self.columns = columns
+        """Trace columns used to skip entries that can not match"""
+
+        self.opcode_index = opcode_index
+        """Opcode index used to skip entries that can not match"""
+
         if (match_pc_start is None and match_pc_end and match_reg is None and
             match_addr is None and match_opcode is None and
             match_exc is None):
@@ -295,6 +311,121 @@ class TraceDumpParser(CallbackTraceParser, TraceDumpMixin):
                            inst.op1.value == self.match_nop)
         return self._update_match_result(match, test_result)
 
+    def _index_mask(self, opcode, start, end):
+        """
+        Compute the mask of the entries in [start, end] with the given
+        opcode using the opcode index.
+        """
+        mask = np.zeros(end - start + 1, dtype=np.bool_)
+        mask[self.opcode_index.find(opcode, start, end) - start] = True
+        return mask
+
+    def _candidate_mask(self, start, end):
+        """
+        Compute the mask of the entries in [start, end] that may match
+        using the trace columns and the opcode index.
+
+        The mask is a superset of the matching entries, the match
+        conditions are checked again on each entry by scan_all.
+
+        :return: boolean mask or None if the match conditions can not
+        be checked on the columns or the index
+        """
+        masks = []
+        # number of match conditions that can not be checked
+        unknown = sum(1 for cond in (self.follow_reg, self.match_nop,
+                                     self.match_perm)
+                      if cond is not None)
+        has_columns = self.columns is not None
+        has_index = self.opcode_index is not None
+        if self.find_instr is not None:
+            if has_index:
+                masks.append(self._index_mask(self.find_instr, start, end))
+            else:
+                unknown += 1
+        if self.pc_start is not None or self.pc_end is not None:
+            if has_columns:
+                masks.append(self.columns.in_range(
+                    "pc", self.pc_start, self.pc_end, start, end))
+            else:
+                unknown += 1
+        if (self.match_addr_start is not None or
+            self.match_addr_end is not None):
+            if has_columns:
+                mask = self.columns.in_range(
+                    "memory_address", self.match_addr_start,
+                    self.match_addr_end, start, end)
+                mask &= (self.columns.is_load[start:end + 1] |
+                         self.columns.is_store[start:end + 1])
+                masks.append(mask)
+            else:
+                unknown += 1
+        if self.match_exc is not None:
+            if has_columns:
+                exception = self.columns.exception[start:end + 1]
+                if self.match_exc == "any":
+                    masks.append(exception != 31)
+                else:
+                    masks.append(exception == int(self.match_exc))
+            else:
+                unknown += 1
+        if self.match_syscall is not None:
+            if has_index:
+                masks.append(self._index_mask("syscall", start, end))
+            elif has_columns:
+                masks.append(self.columns.exception[start:end + 1] == 8)
+            else:
+                unknown += 1
+
+        if len(masks) == 0:
+            return None
+        if self.match_mode == "and":
+            return np.logical_and.reduce(masks)
+        if unknown > 0:
+            # any unchecked condition may match
+            return None
+        return np.logical_or.reduce(masks)
+
+    def _check_sidecar(self, sidecar, name):
+        """Check that a trace sidecar matches the trace."""
+        if sidecar is None:
+            return None
+        if len(sidecar) != len(self):
+            logger.warning("Ignoring %s built for a trace of different "
+                           "size", name)
+            return None
+        return sidecar
+
+    def parse(self, start=None, end=None, direction=0, prefilter=True):
+        """
+        Parse the trace, if the trace columns or the opcode index are
+        available only the entries around the ones that may match
+        are parsed.
+        See :meth:`cheriplot.core.parser.CallbackTraceParser.parse`.
+        """
+        if start is None:
+            start = 0
+        if end is None:
+            end = len(self)
+        self.columns = self._check_sidecar(self.columns, "trace columns")
+        self.opcode_index = self._check_sidecar(self.opcode_index,
+                                                "opcode index")
+        if direction != 0 or (self.columns is None and
+                              self.opcode_index is None):
+            return super(TraceDumpParser, self).parse(start, end, direction,
+                                                      prefilter)
+        end = min(end, len(self) - 1)
+        mask = self._candidate_mask(start, end)
+        if mask is None:
+            return super(TraceDumpParser, self).parse(start, end, direction,
+                                                      prefilter)
+        indices = np.flatnonzero(mask) + start
+        ranges = match_windows(indices, self.show_before, self.show_after,
+                               start, end)
+        logger.debug("Sidecar filter: %d candidates in %d ranges",
+                     len(indices), len(ranges))
+        self.parse_ranges(ranges, prefilter)
+
     def scan_all(self, inst, entry, regs, last_regs, idx):
         if self._dump_next > 0:
             self.dump_kernel_user_switch(entry)
@@ -53,9 +53,6 @@ class CallGraphPlot(Plot):
         self.sym_files = []
         self.sym_vmmap = None
 
-    def _get_cache_file(self):
-        return self.tracefile + ".cache"
-
     def _get_plot_file(self):
         if self.plot_file:
             return self.plot_file
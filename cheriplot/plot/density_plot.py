@@ -29,7 +29,7 @@ import numpy as np
 import logging
 from matplotlib import pyplot as plt
 
-from cheriplot.utils import ProgressPrinter
+from cheriplot.core.provenance import ProvenanceEventLog
 
 from cheriplot.plot.provenance.provenance_plot import PointerProvenancePlot
 
@@ -50,30 +50,17 @@ class PointerDensityPlot(PointerProvenancePlot):
         return self.tracefile + ".pgf"
 
     def plot(self):
-        graph_size = self.dataset.num_vertices()
-        # (addr, num_allocations)
-        addresses = {}
-        page_use = {}
         page_size = 2**12
-        
+
         # address reuse metric
         # num_allocations vs address
         # linearly and in 4k chunks
-        tree_progress = ProgressPrinter(graph_size, desc="Fetching addresses")
-        for node in self.dataset.vertices():
-            data = self.dataset.vp.data[node]
-            for time, addr in data.address.items():                
-                try:                
-                    addresses[addr] += 1
-                except KeyError:
-                    addresses[addr] = 1
-                page_addr = addr & (~0xfff)
-                try:
-                    page_use[page_addr] += 1
-                except KeyError:
-                    page_use[page_addr] = 1
-            tree_progress.advance()
-        tree_progress.finish()
+        node_data = self.node_data
+        events = node_data.events.events()
+        events = events[(events["type"] == ProvenanceEventLog.ADDRESS) &
+                        node_data.vertex_mask()[events["node"]]]
+        page_addrs = events["addr"] & np.uint64(0xfffffffffffff000)
+        pages, page_count = np.unique(page_addrs, return_counts=True)
 
         # time vs address
         # address working set over time
@@ -84,7 +71,7 @@ class PointerDensityPlot(PointerProvenancePlot):
         ax.set_xlabel("Virtual address")
         ax.set_yscale("log")
         # ax.set_ylim(0, )
-        data = np.array(sorted(page_use.items(), key=lambda i: i[0]))
+        data = np.column_stack((pages, page_count.astype(np.uint64)))
         # ignore empty address-space chunks
         prev_addr = data[0]
         omit_ranges = []
@@ -27,7 +27,6 @@
 
 import numpy as np
 import logging
-import pickle
 
 from matplotlib import pyplot as plt
 from matplotlib.collections import LineCollection, PathCollection
@@ -36,7 +35,8 @@ from matplotlib.transforms import Bbox, IdentityTransform
 from matplotlib.colors import colorConverter
 
 from ..utils import ProgressPrinter
-from ..core import RangeSet, Range, CallbackTraceParser
+from ..core import (RangeSet, Range, CallbackTraceParser, ParallelTraceParser,
+                    OpcodeIndex)
 from ..plot import Plot, PatchBuilder, OmitRangeSetBuilder
 
 logger = logging.getLogger(__name__)
@@ -64,6 +64,12 @@ class OutOfBoundParser(CallbackTraceParser):
             self.dataset.append(data_entry)
         return False
 
+    def new_partial(self):
+        return []
+
+    def merge_partial(self, partial):
+        self.dataset.extend(partial)
+
 
 class OutOfBoundRangeBuilder(OmitRangeSetBuilder):
     """
@@ -179,7 +185,10 @@ class CapOutOfBoundPlot(Plot):
     manipulations
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, workers=None, **kwargs):
+        self.workers = workers
+        """Number of processes used to parse the trace."""
+
         super(CapOutOfBoundPlot, self).__init__(*args, **kwargs)
 
         self.patch_builder = OutOfBoundPlotPatchBuilder()
@@ -188,21 +197,16 @@ class CapOutOfBoundPlot(Plot):
         self.range_builder = OutOfBoundRangeBuilder()
         """Strategy object that builds omit-ranges of AddressSpaceAxes"""
 
-    def _get_cache_file(self):
-        return self.tracefile + "_oob.cache"
-
     def build_dataset(self):
         if self.caching:
-            fname = self._get_cache_file()
-            try:
-                with open(fname, "rb") as fd:
-                    self.dataset = pickle.load(fd)
-                    logger.info("Using cached dataset %s", fname)
-            except IOError:
+            entry = self._get_cache_entry("dataset", suffix=".pickle")
+            if entry.is_valid():
+                self.dataset = entry.load_pickle()
+                logger.info("Using cached dataset %s", entry.path)
+            else:
                 self.parser.parse()
-                with open(fname, "wb") as fd:
-                    pickle.dump(self.dataset, fd, pickle.HIGHEST_PROTOCOL)
-                logger.info("Saving cached dataset %s", fname)
+                entry.save_pickle(self.dataset)
+                logger.info("Saving cached dataset %s", entry.path)
         else:
             self.parser.parse()
 
@@ -214,7 +218,12 @@ class CapOutOfBoundPlot(Plot):
         self.dataset = np.array(self.dataset)
 
     def init_parser(self, dataset, tracefile):
-        return OutOfBoundParser(dataset, tracefile)
+        parser = OutOfBoundParser(dataset, tracefile)
+        # only the capability arithmetic entries are needed
+        parser.opcode_index = OpcodeIndex.open(tracefile)
+        if self.workers is not None and self.workers > 1:
+            return ParallelTraceParser(parser, workers=self.workers)
+        return parser
 
     def init_dataset(self):
         return []
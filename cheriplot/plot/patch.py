@@ -70,9 +70,11 @@ class OmitRangeSetBuilder:
             # i) NR completely contained in R
             # ii) R completely contained in NR
             # iii) NR crosses the start or iv) the end of R
+            # R is removed first, the RangeSet indexes ranges by their
+            # boundaries so R can not be resized in place.
+            self.ranges.remove(r)
             if (node_range.start >= r.start and node_range.end <= r.end):
                 # (i) split R
-                del self.ranges[self.ranges.index(r)]
                 r_left = Range(r.start, node_range.start, Range.T_OMIT)
                 r_right = Range(node_range.end, r.end, Range.T_OMIT)
                 if r_left.size >= self.size_limit:
@@ -81,17 +83,17 @@ class OmitRangeSetBuilder:
                     self.ranges.append(r_right)
             elif (node_range.start <= r.start and node_range.end >= r.end):
                 # (ii) remove R
-                del self.ranges[self.ranges.index(r)]
+                pass
             elif node_range.start < r.start:
                 # (iii) resize range
                 r.start = node_range.end
-                if r.size < self.size_limit:
-                    del self.ranges[self.ranges.index(r)]
+                if r.size >= self.size_limit:
+                    self.ranges.append(r)
             elif node_range.end > r.end:
                 # (iv) resize range
                 r.end = node_range.start
-                if r.size < self.size_limit:
-                    del self.ranges[self.ranges.index(r)]
+                if r.size >= self.size_limit:
+                    self.ranges.append(r)
 
     def inspect(self, data):
         """
@@ -29,6 +29,8 @@ import logging
 
 from matplotlib import pyplot as plt
 
+from cheriplot.core.cache import get_cache_manager
+
 logger = logging.getLogger(__name__)
 
 class Plot:
@@ -43,6 +45,9 @@ class Plot:
         self.caching = cache
         """dataset caching enable """
 
+        self.cache_manager = get_cache_manager()
+        """Cache manager that stores the cached datasets"""
+
         self.fig, self.ax = self.init_axes()
         """Axes and figure to use"""
         
@@ -55,8 +60,30 @@ class Plot:
         self.plot_file = None
         """Path to the file where the plot should be saved"""
 
-    def _get_cache_file(self):
-        return self.tracefile + ".cache"
+    def _get_cache_entry(self, name, options=None, suffix="", tracefile=None,
+                         producer=None):
+        """
+        Return the cache entry of a dataset of the plot
+
+        :param name: name of the dataset
+        :type name: str
+        :param options: plot options that change the dataset
+        :type options: dict
+        :param suffix: extension of the cache file
+        :type suffix: str
+        :param tracefile: trace that the dataset is derived from,
+        by default this is the plot trace
+        :type tracefile: str
+        :param producer: class that produces the dataset, by default
+        this is the plot class, plots that share a dataset give
+        the base class that builds it
+        :type producer: type
+        :return: the cache entry
+        :rtype: :class:`cheriplot.core.cache.CacheEntry`
+        """
+        return self.cache_manager.entry(tracefile or self.tracefile,
+                                        producer or self, name, options,
+                                        suffix)
 
     def _get_plot_file(self):
         if self.plot_file:
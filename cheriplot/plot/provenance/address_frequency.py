@@ -27,9 +27,7 @@
 
 import logging
 import numpy as np
-import pickle
 
-from operator import attrgetter
 
 from matplotlib import pyplot as plt
 from matplotlib import lines, collections, transforms, patches, text
@@ -40,6 +38,7 @@ from cheriplot.core.addrspace_axes import RangeSet, Range
 from cheriplot.core.vmmap import VMMap
 from cheriplot.plot.patch import OmitRangeSetBuilder
 
+from cheriplot.plot.provenance.parser import PointerProvenanceParser
 from cheriplot.plot.provenance.provenance_plot import PointerProvenancePlot
 from cheriplot.plot.provenance.vmmap import VMMapPatchBuilder
 
@@ -82,6 +81,9 @@ class PointedAddressFrequencyPlot(PointerProvenancePlot):
     The idea is to make a point that stack allocations are much more frequent.
     """
 
+    cache_version = 1
+    """Version of the range set in the cache."""
+
     class DataRange(Range):
         """
         Range with additional metadata
@@ -124,27 +126,23 @@ class PointedAddressFrequencyPlot(PointerProvenancePlot):
         """
         self.vmmap = VMMap(mapfile)
 
-    def _get_regset_cache_file(self):
-        return self.tracefile + "_addr_frequency.cache"
-
     def _extract_ranges(self):
         """
         Extract ranges from the provenance graph
 
-        XXX for now do the prototype data manipulation here
-        with a naive RangeSet object later we may want to
-        move it somewhere else with more dedicated solution
-        using interval trees
+        XXX for now do the prototype data manipulation here,
+        later we may want to move it somewhere else
         """
         dataset_progress = ProgressPrinter(self.dataset.num_vertices(),
                                            desc="Extract frequency of reference")
         range_set = RangeSet()
+        vertex_data = self.node_data
         for vertex in self.dataset.vertices():
-            node = self.dataset.vp.data[vertex]
+            node = vertex_data[vertex]
             logger.debug("Inspect node %s", node)
             r_node = self.DataRange(node.cap.base,
                                     node.cap.base + node.cap.length)
-            node_set = RangeSet([r_node])
+            node_set = [r_node]
             # erode r_node until it is fully merged in the range_set
             # the node_set holds intermediate ranges remaining to merge
             while len(node_set):
@@ -242,15 +240,18 @@ class PointedAddressFrequencyPlot(PointerProvenancePlot):
     def build_dataset(self):
         try:
             if self.caching:
-                fname = self._get_regset_cache_file()
-                try:
-                    with open(fname, "rb") as cache_fd:
-                        self.range_set = pickle.load(cache_fd)
-                except IOError:
+                options = self._get_cache_options()
+                options["filter_version"] = self.filter_version
+                # the range set is derived from the provenance graph
+                options["parser_version"] = (
+                    PointerProvenanceParser.cache_version)
+                entry = self._get_cache_entry("range_set", options, ".pickle")
+                if entry.is_valid():
+                    self.range_set = entry.load_pickle()
+                else:
                     super(PointedAddressFrequencyPlot, self).build_dataset()
                     self._extract_ranges()
-                    with open(fname, "wb") as cache_fd:
-                        pickle.dump(self.range_set, cache_fd)
+                    entry.save_pickle(self.range_set)
             else:
                 super(PointerProvenancePlot).build_dataset()
                 self._extract_ranges()
@@ -269,7 +270,6 @@ class PointedAddressFrequencyPlot(PointerProvenancePlot):
         for addr_range in self.range_set:
             omit_builder.inspect(addr_range)
 
-        self.range_set.sort(key=attrgetter("start"))
         x_coords = [r.start for r in self.range_set]
         freq = [r.num_references for r in self.range_set]
 
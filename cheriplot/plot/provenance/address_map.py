@@ -38,7 +38,7 @@ from matplotlib.colors import colorConverter
 from cheriplot.utils import ProgressPrinter
 from cheriplot.core.addrspace_axes import Range
 from cheriplot.core.provenance import (
-    CheriCapPerm, CheriNodeOrigin, NodeData, CheriCap)
+    CheriCapPerm, CheriNodeOrigin, NodeData, CheriCap, NodeDataMap)
 from cheriplot.core.vmmap import VMMap
 from cheriplot.plot.patch import (
     PickablePatchBuilder, PatchBuilder, OmitRangeSetBuilder)
@@ -325,8 +325,9 @@ class AddressMapPlot(PointerProvenancePlot):
 
         dataset_progress = ProgressPrinter(self.dataset.num_vertices(),
                                            desc="Adding nodes")
+        vertex_data = self.node_data
         for item in self.dataset.vertices():
-            data = self.dataset.vp.data[item]
+            data = vertex_data[item]
             self.patch_builder.inspect(data)
             self.range_builder.inspect(data)
             dataset_progress.advance()
@@ -460,6 +461,9 @@ class SyscallAddressMapPlot(AddressMapPlot):
     Address map plot that only shows system calls
     """
 
+    mapped_dataset = False
+    """The munmap of each mmap is found with a graph-tool BFS."""
+
     def __init__(self, *args, **kwargs):
         self.syscall_graph = None
         """Graph of syscall nodes"""
@@ -472,8 +476,7 @@ class SyscallAddressMapPlot(AddressMapPlot):
     def init_dataset(self):
         dataset = super(SyscallAddressMapPlot, self).init_dataset()
         self.syscall_graph = gt.Graph(directed=True)
-        vdata = self.syscall_graph.new_vertex_property("object")
-        self.syscall_graph.vp["data"] = vdata
+        NodeDataMap(self.syscall_graph)
         return dataset
 
     def build_dataset(self):
@@ -491,8 +494,10 @@ class SyscallAddressMapPlot(AddressMapPlot):
         class _Visitor(gt.BFSVisitor):
             pass
 
+        vertex_data = self.node_data
+        syscall_data = NodeDataMap(self.syscall_graph)
         for node in self.dataset.vertices():
-            data = self.dataset.vp.data[node]
+            data = vertex_data[node]
             if data.origin == CheriNodeOrigin.SYS_MMAP:
                 # look for munmap in the subtree, if none
                 # is found the map survives until the process
@@ -511,11 +516,12 @@ class SyscallAddressMapPlot(AddressMapPlot):
                 sys_node_data.origin = data.origin
                 sys_node_data.pc = data.pc
                 sys_node_data.is_kernel = data.is_kernel
-                self.syscall_graph.vp.data[syscall_node] = sys_node_data
+                syscall_data[syscall_node] = sys_node_data
+                sys_node_data = syscall_data[syscall_node]
 
                 _visitor = _Visitor()
                 for descendant in gt.search.bfs_search(self.dataset, node, _visitor):
-                    descendant_data = self.dataset.vp.data[descendant]
+                    descendant_data = vertex_data[descendant]
                     if descendant_data.origin == CheriNodeOrigin.SYS_MUNMAP:
                         if sys_node_data.cap.t_free != -1:
                             logger.error("Multiple MUNMAP for a single mapped block")
@@ -529,8 +535,9 @@ class SyscallAddressMapPlot(AddressMapPlot):
         """
         dataset_progress = ProgressPrinter(self.dataset.num_vertices(),
                                            desc="Adding nodes")
+        syscall_data = NodeDataMap(self.syscall_graph)
         for item in self.syscall_graph.vertices():
-            data = self.syscall_graph.vp.data[item]
+            data = syscall_data[item]
             self.patch_builder.inspect(data)
             self.range_builder.inspect(data)
             dataset_progress.advance()
@@ -34,7 +34,7 @@ from matplotlib import pyplot as plt
 
 from cheriplot.utils import ProgressPrinter
 from cheriplot.core.vmmap import VMMap
-from cheriplot.core.provenance import CheriCapPerm
+from cheriplot.core.provenance import CheriCapPerm, ProvenanceEventLog
 from cheriplot.core.addrspace_axes import Range
 
 from cheriplot.plot.patch import OmitRangeSetBuilder
@@ -130,16 +130,21 @@ class ExecCapLoadStoreScatterPlot(PointerProvenancePlot):
         The common dictionary is then used for the plot.
         """
         super().build_dataset()
-        progress = ProgressPrinter(self.dataset.num_vertices(),
+        vertex_data = self.node_data
+        exec_nodes = ((vertex_data.array("perms") & CheriCapPerm.EXEC) != 0)
+        exec_nodes &= vertex_data.vertex_mask()
+        events = vertex_data.events.events()
+        events = events[(events["type"] == ProvenanceEventLog.ADDRESS) &
+                        exec_nodes[events["node"]]]
+        times = events["time"].tolist()
+        addrs = events["addr"].tolist()
+        progress = ProgressPrinter(len(addrs),
                                    desc="Extract executable cap memory locations")
-        for node in self.dataset.vertices():
-            node_data = self.dataset.vp.data[node]
-            if node_data.cap.has_perm(CheriCapPerm.EXEC):
-                for addr in node_data.address.values():
-                    self.range_builder.inspect(addr)
-                self.store_addr_map.update(node_data.address)
+        for addr in addrs:
+            self.range_builder.inspect(addr)
             progress.advance()
         progress.finish()
+        self.store_addr_map.update(zip(times, addrs))
 
     def plot(self):
         """
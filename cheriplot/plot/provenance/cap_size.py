@@ -38,6 +38,7 @@ from cheriplot.utils import ProgressPrinter
 from cheriplot.core.addrspace_axes import Range
 from cheriplot.core.label_manager import LabelManager
 from cheriplot.core.vmmap import VMMap
+from cheriplot.core.provenance import ProvenanceEventLog
 from cheriplot.plot.provenance.provenance_plot import PointerProvenancePlot
 
 logger = logging.getLogger(__name__)
@@ -191,8 +192,9 @@ class CapSizeCreationPlot(CapSizeHistogramPlot):
         progress = ProgressPrinter(self.dataset.num_vertices(),
                                    desc="Sorting capability references")
         logger.debug("Vm ranges %s", vm_ranges)
+        vertex_data = self.node_data
         for node in self.dataset.vertices():
-            data = self.dataset.vp.data[node]
+            data = vertex_data[node]
             for idx, r in enumerate(vm_ranges):
                 if Range(data.cap.base, data.cap.bound) in r:
                     hist_data[idx].append(data.cap.length)
@@ -235,28 +237,41 @@ class CapSizeDerefPlot(CapSizeHistogramPlot):
         # the same.
         vm_entries = list(self.vmmap)
         vm_ranges = [Range(v.start, v.end) for v in self.vmmap]
-        hist_data = [[] for _ in range(len(vm_ranges))]
 
-        progress = ProgressPrinter(self.dataset.num_vertices(),
-                                   desc="Sorting capability references")
-        for node in self.dataset.vertices():
-            data = self.dataset.vp.data[node]
-            # iterate over every dereference of the node
-            for addr in data.deref["addr"]:
-                # check in which vm-entry the address is
-                for idx, r in enumerate(vm_ranges):
-                    if addr in r:
-                        hist_data[idx].append(data.cap.length)
-                        break
-            progress.advance()
-        progress.finish()
-
-        for vm_entry,data in zip(vm_entries, hist_data):
+        # dereferences of the visible nodes
+        vertex_data = self.node_data
+        lengths = vertex_data.array("length").view(np.uint64)
+        if vertex_data.deref_stats:
+            # all the dereferences of a node are counted at the
+            # lowest dereferenced address
+            nodes = np.flatnonzero(vertex_data.vertex_mask() &
+                                   (vertex_data.deref_count() > 0))
+            addrs = vertex_data.array("deref_min").view(np.uint64)[nodes]
+            weights = vertex_data.deref_count()[nodes]
+        else:
+            events = vertex_data.events.events()
+            events = events[events["type"] != ProvenanceEventLog.ADDRESS]
+            events = events[vertex_data.vertex_mask()[events["node"]]]
+            nodes = events["node"]
+            addrs = events["addr"]
+            weights = np.ones(len(events), dtype=np.int64)
+        lengths = lengths[nodes]
+        # check in which vm-entry the address is, the first
+        # matching entry takes the dereference
+        unassigned = np.ones(len(addrs), dtype=bool)
+        hist_data = []
+        for r in vm_ranges:
+            match = (unassigned & (addrs >= np.uint64(r.start)) &
+                     (addrs < np.uint64(r.end)))
+            unassigned &= ~match
+            hist_data.append((lengths[match], weights[match]))
+
+        for vm_entry, (data, data_weights) in zip(vm_entries, hist_data):
             if len(data) == 0:
                 continue
             # the bin size is logarithmic
             data = np.log2(data)
-            h, b = np.histogram(data, bins=self.n_bins)
+            h, b = np.histogram(data, bins=self.n_bins, weights=data_weights)
             # append histogram to the dataframes
             # self.hist_sources.append(vm_entry)
             # new_index = len(self.abs_histogram.index)
@@ -28,12 +28,19 @@
 import numpy as np
 import logging
 
+from graph_tool.all import Graph
+
 from enum import IntEnum
 from functools import reduce
+from copy import copy, deepcopy
 
 from cheriplot.core.parser import CallbackTraceParser, Instruction
+from cheriplot.core.checkpoint import RegisterSetSnapshot
 from cheriplot.core.provenance import (
-    CheriCapPerm, CheriNodeOrigin, NodeData, CheriCap)
+    CheriCapPerm, CheriNodeOrigin, NodeData, CheriCap, NodeDataMap,
+    ProvenanceEventLog)
+from cheriplot.core.provenance_store import ProvenanceGraphWriter
+from cheriplot.core.shadow_memory import ShadowMemory
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +53,12 @@ class PointerProvenanceParser(CallbackTraceParser):
     can be reused.
     """
 
+    cache_version = 2
+    """Version of the provenance graph in the cache."""
+
+    capability_stores = frozenset(["csc", "cscr", "csci"])
+    """Stores that keep the capability tag in memory."""
+
     class RegisterSet:
         """
         Extended register set that keeps track of memory
@@ -61,8 +74,11 @@ class PointerProvenanceParser(CallbackTraceParser):
             self.reg_nodes = np.empty(32, dtype=object)
             """Graph node associated with each register."""
 
-            self.memory_map = {}
-            """CheriCapNodes stored in memory."""
+            self.memory_map = ShadowMemory()
+            """
+            Shadow memory with the id of the node stored in each
+            capability-sized memory location.
+            """
 
             self.pcc = None
             """Current pcc node"""
@@ -107,6 +123,12 @@ class PointerProvenanceParser(CallbackTraceParser):
         This class contains all the methods that manipulate
         registers and values that depend on the ABI and constants
         in CheriBSD.
+
+        The system calls that are tracked are described in the
+        :attr:`syscalls` table. The tracked system calls that
+        have not returned yet are kept in a stack so that system
+        calls made while another one is interrupted, e.g. from a
+        signal handler, do not hide the outer one.
         """
         class SyscallCode(IntEnum):
             """
@@ -116,110 +138,218 @@ class PointerProvenanceParser(CallbackTraceParser):
             """
             SYS_MMAP = 477
             SYS_MUNMAP = 73
-            # also interesting mprotect and shm* stuff
+            SYS_MPROTECT = 74
+            SYS_MADVISE = 75
+            SYS_MINHERIT = 250
+            SYS_SHMAT = 228
+            SYS_SHMDT = 230
+
+        class Syscall:
+            """
+            Description of a tracked system call.
+            """
+
+            def __init__(self, origin, args=(), ret=None, pre=None,
+                         post=None):
+                self.origin = origin
+                """Origin of the nodes created for the system call."""
 
+                self.args = args
+                """Capability registers of the arguments."""
+
+                self.ret = ret
+                """Capability register of the return value."""
+
+                self.pre = pre
+                """
+                Handler called at the system call instruction,
+                with the signature pre(context, syscall, entry, regs,
+                node_data, regset).
+                """
+
+                self.post = post
+                """
+                Handler called when the system call returns, with the
+                same signature as :attr:`pre`.
+                """
 
         def __init__(self, *args, **kwargs):
-            self.in_syscall = False
-            """Flag indicates whether we are tracking a systemcall."""
+            self.stack = []
+            """
+            Tracked system calls that did not return, each item is
+            a tuple (code, syscall pc, syscall cycle number,
+            expected return pc).
+            """
 
-            self.pc_syscall = None
-            """Syscall instruction PC."""
+        @property
+        def in_syscall(self):
+            """Flag indicates whether we are tracking a systemcall."""
+            return len(self.stack) > 0
 
-            self.t_syscall = None
-            """Syscall instruction cycle number."""
+        def is_return(self, pc):
+            """Check whether a PC is the return point of a system call."""
+            for frame in self.stack:
+                if frame[3] == pc:
+                    return True
+            return False
 
-            self.pc_eret = None
-            """Expected eret instruction PC."""
+        def get_state(self):
+            """Return a picklable copy of the system call state."""
+            return {"stack": list(self.stack)}
 
-            self.code = None
-            """Current syscall code."""
+        def set_state(self, state):
+            """Restore the system call state."""
+            self.stack = list(state["stack"])
 
         def _get_syscall_code(self, regs):
             """Get the syscall code for direct and indirect syscalls."""
             # syscall code in $v0
             # syscall arguments in $a0-$a7/$c3-$c10
             code = regs.gpr[1] # $v0
-            indirect_code = regs.gpr[3] # $a0
-            is_indirect = (code == 0 or code == 198)
-            return indirect_code if is_indirect else code
+            if code == 0 or code == 198:
+                return regs.gpr[3] # $a0
+            return code
 
-        def scan_syscall_start(self, inst, entry, regs, dataset, regset):
+        def _derive(self, reg, origin, entry, regs, node_data, regset):
             """
-            Scan a syscall instruction and detect the syscall type
-            and arguments.
+            Create a node with the capability in a register, the node
+            is attached to the node currently in the register and
+            replaces it in the register set.
             """
-            code = self._get_syscall_code(regs)
-            try:
-                self.code = self.SyscallCode(code)
-            except ValueError:
-                # we are not interested in this syscall
-                return
-            self.in_syscall = True
-            self.pc_syscall = entry.pc
-            self.t_syscall = entry.cycles
-            self.pc_eret = entry.pc + 4
-
-            # create a node at syscall start for those system calls for
-            # which we care about the arguments
-            if self.code.value == self.SyscallCode.SYS_MUNMAP:
-                src_reg = 3 # argument in $c3
-                origin = CheriNodeOrigin.SYS_MUNMAP
-            else:
-                # we do not do anything for other syscalls
-                return None
-
             data = NodeData()
-            data.cap = CheriCap(regs.cap_reg[src_reg])
+            data.cap = CheriCap(regs.cap_reg[reg])
             data.cap.t_alloc = entry.cycles
             # XXX may want a way to store call pc and return pc
             data.pc = entry.pc
             data.origin = origin
             data.is_kernel = False
-            node = dataset.add_vertex()
-            dataset.vp.data[node] = data
-            # attach the new node to the capability node in src_reg
-            # and replace it in the register set
-            parent = regset[src_reg]
-            dataset.add_edge(parent, node)
-            regset[src_reg] = node
+            parent = regset[reg]
+            if parent is None:
+                logger.warning("System call {%d}: no node in $c%d, "
+                               "the %s node is a root",
+                               entry.cycles, reg, origin)
+            node = node_data.add_vertex(data, parent)
+            regset[reg] = node
             return node
 
-        def scan_syscall_end(self, inst, entry, regs, dataset, regset):
+        def derive_args(self, syscall, entry, regs, node_data, regset):
+            """Create a node for each capability argument."""
+            node = None
+            for reg in syscall.args:
+                node = self._derive(reg, syscall.origin, entry, regs,
+                                    node_data, regset)
+            return node
+
+        def derive_ret(self, syscall, entry, regs, node_data, regset):
+            """Create a node for the returned capability."""
+            return self._derive(syscall.ret, syscall.origin, entry, regs,
+                                node_data, regset)
+
+        syscalls = {
+            SyscallCode.SYS_MMAP: Syscall(
+                CheriNodeOrigin.SYS_MMAP, ret=3, post=derive_ret),
+            SyscallCode.SYS_MUNMAP: Syscall(
+                CheriNodeOrigin.SYS_MUNMAP, args=(3,), pre=derive_args),
+            SyscallCode.SYS_MPROTECT: Syscall(
+                CheriNodeOrigin.SYS_MPROTECT, args=(3,), pre=derive_args),
+            SyscallCode.SYS_MADVISE: Syscall(
+                CheriNodeOrigin.SYS_MADVISE, args=(3,), pre=derive_args),
+            SyscallCode.SYS_MINHERIT: Syscall(
+                CheriNodeOrigin.SYS_MINHERIT, args=(3,), pre=derive_args),
+            SyscallCode.SYS_SHMAT: Syscall(
+                CheriNodeOrigin.SYS_SHMAT, ret=3, post=derive_ret),
+            SyscallCode.SYS_SHMDT: Syscall(
+                CheriNodeOrigin.SYS_SHMDT, args=(3,), pre=derive_args),
+        }
+        """
+        Tracked system calls by code, arguments and return values
+        follow the pure-capability ABI: capability arguments in
+        $c3-$c10 and capability return value in $c3.
+        """
+
+        def scan_syscall_start(self, inst, entry, regs, node_data, regset):
             """
-            Scan registers to produce a syscall end node.
+            Scan a syscall instruction and detect the syscall type
+            and arguments.
             """
-            self.in_syscall = False
-
-            # create a node for the syscall start
-            if self.code.value == self.SyscallCode.SYS_MMAP:
-                ret_reg = 3 # return in $c3
-                origin = CheriNodeOrigin.SYS_MMAP
-            else:
-                # we do not do anything for other syscalls
+            code = self._get_syscall_code(regs)
+            syscall = self.syscalls.get(code)
+            if syscall is None:
+                # we are not interested in this syscall
                 return None
+            if self.stack and self.stack[-1][1] == entry.pc:
+                # the system call is restarted
+                self.stack.pop()
+            self.stack.append((int(code), entry.pc, entry.cycles,
+                               entry.pc + 4))
+            if syscall.pre is None:
+                return None
+            return syscall.pre(self, syscall, entry, regs, node_data, regset)
 
-            data = NodeData()
-            data.cap = CheriCap(regs.cap_reg[ret_reg])
-            data.cap.t_alloc = entry.cycles
-            # XXX may want a way to store call pc and return pc
-            data.pc = entry.pc
-            data.origin = origin
-            data.is_kernel = False
-            node = dataset.add_vertex()
-            dataset.vp.data[node] = data
-            # attach the new node to the capability node in ret_reg
-            # and replace it in the register set
-            parent = regset[ret_reg]
-            dataset.add_edge(parent, node)
-            regset[ret_reg] = node
-            return node
+        def scan_syscall_end(self, inst, entry, regs, node_data, regset):
+            """
+            Scan registers to produce a syscall end node.
+            """
+            code, pc_syscall, t_syscall, pc_eret = self.stack.pop()
+            while pc_eret != entry.pc:
+                # inner system calls that never returned
+                logger.debug("Drop system call %d at 0x%x {%d}",
+                             code, pc_syscall, t_syscall)
+                code, pc_syscall, t_syscall, pc_eret = self.stack.pop()
+            syscall = self.syscalls[code]
+            if syscall.post is None:
+                return None
+            return syscall.post(self, syscall, entry, regs, node_data,
+                                regset)
 
     class CallContext:
         pass
 
+    class ChunkContext:
+        """
+        State of a chunk of the trace parsed in a
+        :class:`cheriplot.core.parser.ParallelTraceParser` worker.
+
+        The worker does not know the register set and memory map at the
+        start of the chunk, each register, the pcc and each memory
+        location read before being written in the chunk are
+        represented by placeholder vertices that are resolved when the
+        chunk is merged. When the parser would create a root node
+        because the content of a register or memory location is
+        unknown, it creates a conditional root that is replaced by the
+        node of the placeholder, if the placeholder resolves to one.
+        """
+
+        def __init__(self):
+            self.placeholders = {}
+            """Map placeholder vertex indices to the state they stand for."""
+
+            self.conditional = {}
+            """Map conditional root vertex indices to their placeholder."""
+
+            self.required = set()
+            """Placeholders that must resolve to a node."""
+
+            self.exec_checks = []
+            """Vertices that must resolve to a node with EXEC permission."""
+
+            self.roots = []
+            """Roots created for unknown content, interned when merging."""
+
+            self.start = None
+            """First trace entry of the chunk."""
+
+            self.end = None
+            """Last trace entry of the chunk."""
+
+            self.error = None
+            """Error raised while parsing the chunk."""
 
-    def __init__(self, dataset, trace):
+        def is_placeholder(self, node):
+            return node is not None and int(node) in self.placeholders
+
+
+    def __init__(self, dataset, trace, intern_roots=False, deref_stats=False):
         super(PointerProvenanceParser, self).__init__(dataset, trace)
         self.regs_valid = False
         """
@@ -227,6 +357,13 @@ class PointerProvenanceParser(CallbackTraceParser):
         is completely initialised.
         """
 
+        self.node_data = NodeDataMap(dataset, deref_stats=deref_stats)
+        """
+        Data of the provenance graph vertices, if deref_stats is set
+        the vertices keep dereference statistics instead of recording
+        each dereference.
+        """
+
         self.regset = self.RegisterSet(dataset)
         """
         Register set that maps capability registers
@@ -239,6 +376,539 @@ class PointerProvenanceParser(CallbackTraceParser):
         self.call_context = self.CallContext()
         """Keep state related to function calls and call stack"""
 
+        self.writer = None
+        """Store writer used in streaming mode, see :meth:`stream_to`."""
+
+        self.flush_interval = None
+        """Number of new nodes that trigger a flush in streaming mode."""
+
+        self._flush_threshold = None
+        """Dataset size that triggers the next flush."""
+
+        self.chunk_context = None
+        """Placeholder state when parsing a chunk in a parallel worker."""
+
+        self.intern_roots = intern_roots
+        """
+        Reuse the root node of an identical capability instead of
+        creating a new root when an unknown capability is found.
+        Roots created by parallel workers are interned when the chunks
+        are merged.
+        """
+
+        self.root_index = {}
+        """
+        Node id of the interned roots, keyed by the capability
+        (base, length, offset, perms, otype, sealed).
+        """
+
+        self.next_entry = None
+        """Index of the trace entry after the last parsed one."""
+
+        self.resume_state = None
+        """
+        Resume state saved before the final flush in streaming mode,
+        see :meth:`get_resume_state`.
+        """
+
+    def _live_nodes(self):
+        """
+        Return the set of node ids referenced by the register set or
+        the memory map, other nodes can not be referenced anymore.
+        """
+        live = set(self.regset.memory_map.nodes().tolist())
+        live.update(int(n) for n in self.regset.reg_nodes if n is not None)
+        if self.regset.pcc is not None:
+            live.add(int(self.regset.pcc))
+        return live
+
+    def stream_to(self, path, flush_interval=2**16):
+        """
+        Enable the streaming mode, the nodes that can not be
+        referenced anymore are periodically flushed to a
+        :class:`cheriplot.core.provenance_store.ProvenanceGraphWriter`
+        and removed from the dataset. The dataset is flushed
+        completely at the end of the parsing, the graph can then be
+        loaded with
+        :func:`cheriplot.core.provenance_store.load_provenance_graph`.
+
+        :param path: path of the store directory
+        :type path: str
+        :param flush_interval: number of new nodes that trigger a flush
+        :type flush_interval: int
+        """
+        self.writer = ProvenanceGraphWriter(path)
+        self.flush_interval = flush_interval
+        self._flush_threshold = self.dataset.num_vertices() + flush_interval
+
+    def _check_flush(self):
+        """
+        In streaming mode, flush the nodes when enough nodes have been
+        added since the last flush.
+        """
+        if (self.writer is not None and
+            self.dataset.num_vertices() >= self._flush_threshold):
+            self.flush_nodes()
+            self._flush_threshold = (self.dataset.num_vertices() +
+                                     self.flush_interval)
+
+    def flush_nodes(self, keep_live=True):
+        """
+        Write the finalized nodes to the store and remove them
+        from the dataset.
+
+        :param keep_live: keep the nodes that are still referenced
+        by the register set or the memory map, if False all the
+        nodes are flushed
+        :type keep_live: bool
+        """
+        num_vertices = self.dataset.num_vertices()
+        live = np.zeros(num_vertices, dtype=bool)
+        if keep_live:
+            live[list(self._live_nodes())] = True
+        dead = np.flatnonzero(~live)
+        if len(dead) == 0:
+            return
+        logger.debug("Flush %d provenance nodes, %d resident",
+                     len(dead), num_vertices - len(dead))
+        gids = self.node_data.array("gid").copy()
+        self.writer.write_nodes(self.node_data, dead)
+        # removing vertices keeps the order of the remaining ones
+        remap = np.cumsum(live) - 1
+        remap[~live] = -1
+        self.writer.write_events(self.node_data.events.split(remap), gids)
+        self.dataset.remove_vertex(dead)
+
+        def vertex(node):
+            if node is None or remap[int(node)] < 0:
+                # the node has been flushed
+                return None
+            return self.dataset.vertex(int(remap[int(node)]))
+
+        for idx, node in enumerate(self.regset.reg_nodes):
+            self.regset.reg_nodes[idx] = vertex(node)
+        self.regset.pcc = vertex(self.regset.pcc)
+        self.regset.memory_map.remap(remap)
+        # flushed roots can not be reused anymore
+        self.root_index = {key: int(remap[node]) for key, node in
+                           self.root_index.items() if remap[node] >= 0}
+
+    def before_parse(self, start, end):
+        if self.chunk_context is not None:
+            self.chunk_context.start = start
+            self.chunk_context.end = end
+
+    def after_parse(self, start, end):
+        if self.chunk_context is not None:
+            return
+        self.next_entry = min(end + 1, len(self))
+        if self.writer is not None:
+            # the resume state refers to the nodes before they are flushed
+            self.resume_state = self.get_resume_state()
+            self.flush_nodes(keep_live=False)
+            self.writer.close()
+            self.writer = None
+
+    def _scan_ranges(self, *args, **kwargs):
+        if self.chunk_context is None:
+            super(PointerProvenanceParser, self)._scan_ranges(*args, **kwargs)
+            return
+        try:
+            super(PointerProvenanceParser, self)._scan_ranges(*args, **kwargs)
+        except Exception as e:
+            # the assumptions on the state at the start of the chunk
+            # may be wrong, the chunk is parsed again when merging
+            logger.debug("Error in chunk %d-%d: %s", self.chunk_context.start,
+                         self.chunk_context.end, e)
+            self.chunk_context.error = str(e)
+
+    def _make_placeholder(self, key):
+        vertex = self.node_data.add_vertex(NodeData())
+        self.chunk_context.placeholders[int(vertex)] = key
+        return vertex
+
+    def new_partial(self):
+        """
+        Reset the parser to parse a chunk of the trace in a
+        :class:`cheriplot.core.parser.ParallelTraceParser` worker.
+
+        The chunk is parsed assuming that the register set has been
+        initialised and that no system call is in progress, the
+        register set starts with placeholder nodes.
+        """
+        dataset = Graph(directed=True)
+        self.dataset = dataset
+        self.node_data = NodeDataMap(dataset,
+                                     deref_stats=self.node_data.deref_stats)
+        self.regset = self.RegisterSet(dataset)
+        # the memory content before the chunk is unknown
+        self.regset.memory_map = ShadowMemory(default=ShadowMemory.UNKNOWN)
+        self.syscall_context = self.SyscallContext()
+        self.regs_valid = True
+        self.chunk_context = self.ChunkContext()
+        # the chunk is streamed by the parent process when merged
+        self.writer = None
+        for idx in range(32):
+            self.regset[idx] = self._make_placeholder(("reg", idx))
+        self.regset.pcc = self._make_placeholder(("pcc",))
+        return dataset
+
+    def get_partial(self):
+        """
+        Return the graph of the chunk along with the placeholders and
+        the final register set, memory map and system call state.
+        """
+        def node_id(node):
+            return None if node is None else int(node)
+
+        return {
+            "graph": self.dataset,
+            "context": self.chunk_context,
+            "reg_nodes": [node_id(n) for n in self.regset.reg_nodes],
+            "pcc": node_id(self.regset.pcc),
+            "memory_map": self.regset.memory_map,
+            "syscall": self.syscall_context.get_state(),
+        }
+
+    def _placeholder_target(self, key):
+        """Return the node that a placeholder stands for."""
+        if key[0] == "reg":
+            return self.regset[key[1]]
+        if key[0] == "pcc":
+            return self.regset.pcc
+        node = self.regset.memory_map[key[1]]
+        return self.dataset.vertex(node) if node >= 0 else None
+
+    def merge_partial(self, partial):
+        """
+        Stitch the graph of a chunk to the dataset.
+
+        The placeholders of the chunk are resolved against the
+        current register set and memory map, the other vertices,
+        edges and events of the chunk are appended to the dataset in
+        the same order used by a sequential parse. If the chunk
+        assumptions do not hold the chunk is parsed again here.
+        In streaming mode the nodes are flushed after the chunk as
+        in a sequential parse.
+        """
+        context = partial["context"]
+        if not self._merge_chunk(partial):
+            logger.debug("Parse chunk %d-%d sequentially",
+                         context.start, context.end)
+            self.parse_ranges([(context.start, context.end)])
+        self.next_entry = min(context.end + 1, len(self))
+        self._check_flush()
+
+    def _merge_chunk(self, partial):
+        """
+        Append the graph of a chunk to the dataset, see
+        :meth:`merge_partial`.
+
+        :return: False if the chunk must be parsed again
+        :rtype: bool
+        """
+        context = partial["context"]
+        if (not self.regs_valid or self.syscall_context.in_syscall or
+            context.error is not None):
+            return False
+
+        graph = partial["graph"]
+        chunk_data = NodeDataMap(graph)
+        num_vertices = graph.num_vertices()
+        base = self.dataset.num_vertices()
+
+        # vertex index in the dataset of each chunk vertex,
+        # -1 for placeholders that stand for no node
+        resolve = np.full(num_vertices, -1, dtype=np.int64)
+        new = np.ones(num_vertices, dtype=bool)
+        for vertex, key in context.placeholders.items():
+            target = self._placeholder_target(key)
+            if target is not None:
+                resolve[vertex] = int(target)
+            new[vertex] = False
+        for vertex, placeholder in context.conditional.items():
+            if resolve[placeholder] >= 0:
+                resolve[vertex] = resolve[placeholder]
+                new[vertex] = False
+        # intern the new roots as a sequential parse would do, a root
+        # identical to an earlier root of the chunk becomes an alias
+        interned = {}
+        aliases = {}
+        if self.intern_roots:
+            for vertex in context.roots:
+                if not new[vertex]:
+                    continue
+                key = self._root_key(chunk_data[vertex].cap)
+                if key in self.root_index:
+                    resolve[vertex] = self.root_index[key]
+                    new[vertex] = False
+                elif key in interned:
+                    aliases[vertex] = interned[key]
+                    new[vertex] = False
+                else:
+                    interned[key] = vertex
+        num_new = int(np.count_nonzero(new))
+        resolve[new] = np.arange(base, base + num_new)
+        for vertex, first in aliases.items():
+            resolve[vertex] = resolve[first]
+
+        if any(resolve[v] < 0 for v in context.required):
+            logger.debug("Unknown node in chunk %d-%d",
+                         context.start, context.end)
+            return False
+        if context.exec_checks:
+            perms = np.concatenate((self.node_data.array("perms"),
+                                    chunk_data.array("perms")[new]))
+            targets = resolve[context.exec_checks]
+            if (np.any(targets < 0) or
+                not np.all(perms[targets] & CheriCapPerm.EXEC)):
+                logger.debug("PCC without EXEC in chunk %d-%d",
+                             context.start, context.end)
+                return False
+        for key, vertex in interned.items():
+            self.root_index[key] = int(resolve[vertex])
+
+        # append the new vertices
+        if num_new:
+            self.dataset.add_vertex(num_new)
+        for name, value_type in self.node_data.columns:
+            self.node_data.props[name].a[base:] = chunk_data.array(name)[new]
+        next_gid = self.dataset.gp["next_gid"]
+        gids = self.node_data.props["gid"].a
+        gids[base:] = np.arange(next_gid, next_gid + num_new)
+        self.dataset.gp["next_gid"] = next_gid + num_new
+
+        # the chunk parent column holds chunk vertex indices
+        parents = chunk_data.array("parent")[new]
+        children = np.arange(base, base + num_new)
+        has_parent = parents >= 0
+        parents = np.where(has_parent, resolve[parents], -1)
+        has_parent = parents >= 0
+        parent_gids = self.node_data.props["parent"].a
+        parent_gids[base:] = -1
+        parent_gids[children[has_parent]] = gids[parents[has_parent]]
+        self.dataset.add_edge_list(np.column_stack(
+            (parents[has_parent], children[has_parent])))
+
+        events = np.array(chunk_data.events.events())
+        events["node"] = resolve[events["node"]]
+        if self.node_data.deref_stats:
+            # dereferences of the nodes resolved when merging are
+            # kept in the chunk log
+            deref = events["type"] != ProvenanceEventLog.ADDRESS
+            for event in events[deref]:
+                self.node_data.add_deref_stats(
+                    int(event["node"]), int(event["time"]),
+                    int(event["addr"]), int(event["type"]))
+            events = events[~deref]
+        self.node_data.events.extend(events)
+
+        # final state of the chunk
+        def vertex(node_id):
+            if node_id is None or resolve[node_id] < 0:
+                return None
+            return self.dataset.vertex(int(resolve[node_id]))
+
+        for idx, node_id in enumerate(partial["reg_nodes"]):
+            self.regset[idx] = vertex(node_id)
+        self.regset.pcc = vertex(partial["pcc"])
+        self.regset.memory_map.update(partial["memory_map"], resolve)
+        self.syscall_context.set_state(partial["syscall"])
+        return True
+
+    def _is_unknown(self, node):
+        """
+        Check whether the content of a register or memory location
+        is unknown, a root node is created in this case.
+        """
+        if node is None:
+            return True
+        return (self.chunk_context is not None and
+                self.chunk_context.is_placeholder(node))
+
+    def _make_unknown_root(self, node, entry, cap, time):
+        """
+        Create a root node for a register or memory location whose
+        content is unknown, if the location holds a placeholder the
+        root is conditional on the placeholder.
+        If roots are interned, the root of an identical capability is
+        reused when there is one.
+        """
+        if self.chunk_context is not None:
+            root = self.make_root_node(entry, cap, time=time)
+            if node is not None:
+                self.chunk_context.conditional[int(root)] = int(node)
+            self.chunk_context.roots.append(int(root))
+            return root
+        if not self.intern_roots:
+            return self.make_root_node(entry, cap, time=time)
+        key = self._root_key(CheriCap(cap))
+        root = self.root_index.get(key)
+        if root is not None:
+            return self.dataset.vertex(root)
+        root = self.make_root_node(entry, cap, time=time)
+        self.root_index[key] = int(root)
+        return root
+
+    @staticmethod
+    def _root_key(cap):
+        """
+        Key of a root in :attr:`root_index`.
+
+        :param cap: capability of the root
+        :type cap: :class:`cheriplot.core.provenance.CheriCap`
+        """
+        return (cap.base, cap.length, cap.offset, cap.permissions,
+                cap.objtype, cap.sealed)
+
+    def _require(self, node):
+        """Record that a placeholder must resolve to a node."""
+        if (self.chunk_context is not None and
+            self.chunk_context.is_placeholder(node)):
+            self.chunk_context.required.add(int(node))
+
+    def _check_exec(self, node, inst):
+        """Check that the node in PCC has EXEC permission."""
+        if (self.chunk_context is not None and
+            (self.chunk_context.is_placeholder(node) or
+             int(node) in self.chunk_context.conditional)):
+            # the node is known only when the chunk is merged
+            self.chunk_context.exec_checks.append(int(node))
+            return
+        pcc_data = self.node_data[node]
+        if not pcc_data.cap.has_perm(CheriCapPerm.EXEC):
+            logger.error("Loading PCC without exec permissions? %s %s",
+                         inst, pcc_data)
+            raise RuntimeError("Loading PCC without exec permissions")
+
+    def _memory_get(self, addr):
+        """Return the node stored at the given memory address."""
+        node = self.regset.memory_map[addr]
+        if node >= 0:
+            return self.dataset.vertex(node)
+        if node == ShadowMemory.UNKNOWN:
+            return self._make_placeholder(("mem", addr))
+        return None
+
+    def get_checkpoint_state(self):
+        """
+        Save the register set and memory nodes mapping.
+
+        The nodes currently referenced by the register set or the
+        memory map are stored along with their data, without the
+        dereferences and store addresses, so that they can be
+        restored as roots in a fresh provenance graph.
+        """
+        def node_id(node):
+            return None if node is None else int(node)
+
+        nodes = {}
+        for node in self._live_nodes() | set(self.root_index.values()):
+            data = self.node_data[node]
+            nodes[int(node)] = (copy(data.cap), data.origin, data.pc,
+                                data.is_kernel)
+        return {
+            "regs_valid": self.regs_valid,
+            "nodes": nodes,
+            "reg_nodes": [node_id(n) for n in self.regset.reg_nodes],
+            "pcc": node_id(self.regset.pcc),
+            "memory_map": dict(self.regset.memory_map.items()),
+            "roots": dict(self.root_index),
+            "syscall": self.syscall_context.get_state(),
+        }
+
+    def restore_checkpoint_state(self, state):
+        """
+        Restore the register set and memory nodes mapping, the nodes
+        in the checkpoint become roots of the provenance graph.
+        """
+        vertices = {}
+        for node_id, (cap, origin, pc, is_kernel) in state["nodes"].items():
+            data = NodeData()
+            data.cap = cap
+            data.origin = origin
+            data.pc = pc
+            data.is_kernel = is_kernel
+            vertices[node_id] = self.node_data.add_vertex(data)
+
+        def vertex(node_id):
+            return None if node_id is None else vertices[node_id]
+
+        self.regs_valid = state["regs_valid"]
+        for idx, node_id in enumerate(state["reg_nodes"]):
+            self.regset[idx] = vertex(node_id)
+        self.regset.pcc = vertex(state["pcc"])
+        self.regset.memory_map = ShadowMemory()
+        for addr, node_id in state["memory_map"].items():
+            self.regset.memory_map[addr] = vertices[node_id]
+        self.root_index = {key: int(vertices[node_id]) for key, node_id in
+                           state.get("roots", {}).items()}
+        self.syscall_context.set_state(state["syscall"])
+
+    def get_resume_state(self):
+        """
+        Return the parser state at the end of the parsing, the
+        parsing can be resumed with :meth:`restore_resume_state` on
+        the same provenance graph to parse entries appended to the
+        trace or a continuation trace.
+
+        Unlike the checkpoint state, the nodes are referenced by
+        global id so that the state is valid for the graph loaded
+        from the cache or from the provenance store.
+        """
+        gids = self.node_data.array("gid")
+
+        def node_gid(node):
+            return None if node is None else int(gids[int(node)])
+
+        memory_map = deepcopy(self.regset.memory_map)
+        memory_map.remap(gids)
+        next_entry = self.next_entry
+        if next_entry is None:
+            next_entry = len(self)
+        last_regs = self._last_regs
+        if last_regs is not None:
+            last_regs = RegisterSetSnapshot(last_regs)
+        return {
+            "next_entry": next_entry,
+            "last_regs": last_regs,
+            "regs_valid": self.regs_valid,
+            "reg_nodes": [node_gid(n) for n in self.regset.reg_nodes],
+            "pcc": node_gid(self.regset.pcc),
+            "memory_map": memory_map,
+            "roots": {key: int(gids[node]) for key, node in
+                      self.root_index.items()},
+            "syscall": self.syscall_context.get_state(),
+        }
+
+    def restore_resume_state(self, state):
+        """
+        Restore the state returned by :meth:`get_resume_state`,
+        the dataset must be the graph built by the parser that
+        saved the state. The parsing continues from the register
+        set of the last parsed entry.
+        """
+        gids = self.node_data.array("gid")
+        vertices = np.full(self.dataset.gp["next_gid"], -1, dtype=np.int64)
+        vertices[gids] = np.arange(len(gids))
+
+        def vertex(gid):
+            if gid is None:
+                return None
+            return self.dataset.vertex(int(vertices[gid]))
+
+        self._last_regs = state["last_regs"]
+        self.regs_valid = state["regs_valid"]
+        for idx, gid in enumerate(state["reg_nodes"]):
+            self.regset[idx] = vertex(gid)
+        self.regset.pcc = vertex(state["pcc"])
+        self.regset.memory_map = deepcopy(state["memory_map"])
+        self.regset.memory_map.remap(vertices)
+        self.root_index = {key: int(vertices[gid]) for key, gid in
+                           state["roots"].items()}
+        self.syscall_context.set_state(state["syscall"])
+        self.next_entry = state["next_entry"]
+
     def _set_initial_regset(self, inst, entry, regs):
         """
         Setup the registers after the first eret
@@ -263,9 +933,9 @@ class PointerProvenanceParser(CallbackTraceParser):
                     cap.valid = True
                     # set the guessed capability value to the vertex data
                     # property
-                    self.dataset.vp.data[node].cap = cap
+                    self.node_data[node].cap = cap
                     self.regset[idx] = node
-                    logger.warning("Guessing KCC %s", self.dataset.vp.data[node])
+                    logger.warning("Guessing KCC %s", self.node_data[node])
                 if idx == 30:
                     # guess the value of KDC and use this in the initial register set
                     node = self.make_root_node(entry, None, pc=0)
@@ -282,9 +952,9 @@ class PointerProvenanceParser(CallbackTraceParser):
                     #     CheriCapPerm.SYSTEM_REGISTERS)
                     cap.permissions = 0xffff # all
                     cap.valid = True
-                    self.dataset.vp.data[node].cap = cap
+                    self.node_data[node].cap = cap
                     self.regset[idx] = node
-                    logger.warning("Guessing KDC %s", self.dataset.vp.data[node])
+                    logger.warning("Guessing KDC %s", self.node_data[node])
 
     def _has_exception(self, entry, code=None):
         """
@@ -335,16 +1005,23 @@ class PointerProvenanceParser(CallbackTraceParser):
             # EPCC and PCC do not change and we end up in an handler again
             logger.debug("except {%d}: update epcc %s, update pcc %s",
                          entry.cycles,
-                         self.dataset.vp.data[self.regset.pcc],
-                         self.dataset.vp.data[self.regset[29]])
+                         self.node_data[self.regset.pcc],
+                         self.node_data[self.regset[29]])
             self.regset[31] = self.regset.pcc # saved pcc
             self.regset.pcc = self.regset[29] # pcc <- kcc
 
+        if (entry.is_store and not self._has_exception(entry) and
+            inst.opcode not in self.capability_stores):
+            # data stores clear the tag of the capability in memory
+            self.regset.memory_map.clear(entry.memory_address)
+
         if (self.syscall_context.in_syscall and
-            entry.pc == self.syscall_context.pc_eret):
+            self.syscall_context.is_return(entry.pc)):
             node = self.syscall_context.scan_syscall_end(
-                    inst, entry, regs, self.dataset, self.regset)
+                    inst, entry, regs, self.node_data, self.regset)
             logger.debug("Built syscall node %s", node)
+
+        self._check_flush()
         return False
 
     def scan_eret(self, inst, entry, regs, last_regs, idx):
@@ -359,7 +1036,7 @@ class PointerProvenanceParser(CallbackTraceParser):
         # are handled again in scan_all (which is always executed
         # after per-opcode scan_* methods)
         logger.debug("eret {%d}: update pcc %s", entry.cycles,
-                     self.dataset.vp.data[self.regset[31]])
+                     self.node_data[self.regset[31]])
         self.regset.pcc = self.regset[31] # restore saved pcc
         return False
 
@@ -372,7 +1049,7 @@ class PointerProvenanceParser(CallbackTraceParser):
             return False
 
         self.syscall_context.scan_syscall_start(inst, entry, regs,
-                                                self.dataset, self.regset)
+                                                self.node_data, self.regset)
         return False
 
     def scan_cclearregs(self, inst, entry, regs, last_regs, idx):
@@ -401,15 +1078,16 @@ class PointerProvenanceParser(CallbackTraceParser):
         """
         if not self._do_scan(entry):
             return False
-        if self.regset[regnum] is None:
+        node = self.regset[regnum]
+        if self._is_unknown(node):
             # no node was ever created for the register, it contained something
             # invalid
-            node = self.make_root_node(entry, inst.op0.value,
-                                       time=entry.cycles)
+            node = self._make_unknown_root(node, entry, inst.op0.value,
+                                           entry.cycles)
             self.regset[regnum] = node
             logger.debug("cpreg_get: new node from $c%d %s",
-                         regnum, self.dataset.vp.data[node])
-        self.regset[inst.op0.cap_index] = self.regset[regnum]
+                         regnum, self.node_data[node])
+        self.regset[inst.op0.cap_index] = node
 
     def _handle_cpreg_set(self, regnum, inst, entry):
         """
@@ -427,13 +1105,14 @@ class PointerProvenanceParser(CallbackTraceParser):
         """
         if not self._do_scan(entry):
             return False
-        if self.regset[inst.op0.cap_index] is None:
-            node = self.make_root_node(entry, inst.op0.value,
-                                       time=entry.cycles)
+        node = self.regset[inst.op0.cap_index]
+        if self._is_unknown(node):
+            node = self._make_unknown_root(node, entry, inst.op0.value,
+                                           entry.cycles)
             self.regset[inst.op0.cap_index] = node
             logger.debug("cpreg_set: new node from c<%d> %s",
-                         regnum, self.dataset.vp.data[node])
-        self.regset[regnum] = self.regset[inst.op0.cap_index]
+                         regnum, self.node_data[node])
+        self.regset[regnum] = node
 
     def scan_cgetepcc(self, inst, entry, regs, last_regs, idx):
         self._handle_cpreg_get(31, inst, entry)
@@ -470,13 +1149,13 @@ class PointerProvenanceParser(CallbackTraceParser):
     def scan_cgetpcc(self, inst, entry, regs, last_regs, idx):
         if not self._do_scan(entry):
             return False
-        if self.regset.pcc is None:
+        if self._is_unknown(self.regset.pcc):
             # never seen anything in pcc so we create a new node
-            node = self.make_root_node(entry, inst.op0.value,
-                                       time=entry.cycles)
+            node = self._make_unknown_root(self.regset.pcc, entry,
+                                           inst.op0.value, entry.cycles)
             self.regset.pcc = node
             logger.debug("cgetpcc: new node from pcc %s",
-                         regnum, self.dataset.vp.data[node])
+                         self.node_data[node])
         self.regset[inst.op0.cap_index] = self.regset.pcc
         return False
 
@@ -546,11 +1225,8 @@ class PointerProvenanceParser(CallbackTraceParser):
             if self.regset[inst.op0.cap_index] is not None:
                 # we already have a node for the new PCC
                 self.regset.pcc = self.regset[inst.op0.cap_index]
-                pcc_data = self.dataset.vp.data[self.regset.pcc]
-                if not pcc_data.cap.has_perm(CheriCapPerm.EXEC):
-                    logger.error("Loading PCC without exec permissions? %s %s",
-                                 inst, pcc_data)
-                    raise RuntimeError("Loading PCC without exec permissions")
+                self._require(self.regset.pcc)
+                self._check_exec(self.regset.pcc, inst)
             else:
                 # we should create a node here but this should really
                 # not be happening, the node is None only when the
@@ -561,23 +1237,19 @@ class PointerProvenanceParser(CallbackTraceParser):
         elif inst.opcode == "cjalr":
             # save current pcc
             cd_idx = inst.op0.cap_index
-            if self.regset.pcc is None:
+            old_pcc_node = self.regset.pcc
+            if self._is_unknown(old_pcc_node):
                 # create a root node for PCC that is in cd
-                old_pcc_node = self.make_root_node(entry, inst.op0.value,
-                                                   time=entry.cycles)
-            else:
-                old_pcc_node = self.regset.pcc
+                old_pcc_node = self._make_unknown_root(
+                    old_pcc_node, entry, inst.op0.value, entry.cycles)
             self.regset[cd_idx] = old_pcc_node
 
             # discard current pcc and replace it
             if self.regset[inst.op1.cap_index] is not None:
                 # we already have a node for the new PCC
                 self.regset.pcc = self.regset[inst.op1.cap_index]
-                pcc_data = self.dataset.vp.data[self.regset.pcc]
-                if not pcc_data.cap.has_perm(CheriCapPerm.EXEC):
-                    logger.error("Loading PCC without exec permissions? %s %s",
-                                 inst, pcc_data)
-                    raise RuntimeError("Loading PCC without exec permissions")
+                self._require(self.regset.pcc)
+                self._check_exec(self.regset.pcc, inst)
             else:
                 # we should create a node here but this should really
                 # not be happening, the node is None only when the
@@ -609,19 +1281,31 @@ class PointerProvenanceParser(CallbackTraceParser):
             logger.error("{%d} Dereference unknown capability %s",
                          entry.cycles, inst)
             raise RuntimeError("Dereference unknown capability")
-        node_data = self.dataset.vp.data[node]
+        self._require(node)
         # instead of the capability register offset we use the
         # entry memory_address so we capture any extra offset in
         # the instruction as well
         is_cap = inst.opcode.startswith("clc") or inst.opcode.startswith("csc")
         if entry.is_load:
-            node_data.add_load(entry.cycles, entry.memory_address, is_cap)
+            deref_type = NodeData.DerefType.DEREF_LOAD
         elif entry.is_store:
-            node_data.add_store(entry.cycles, entry.memory_address, is_cap)
+            deref_type = NodeData.DerefType.DEREF_STORE
         else:
             if not self._has_exception(entry):
                 logger.error("Dereference is neither a load or a store %s", inst)
                 raise RuntimeError("Dereference is neither a load nor a store")
+            return
+        if (self.chunk_context is not None and
+            (self.chunk_context.is_placeholder(node) or
+             int(node) in self.chunk_context.conditional)):
+            # the node is known only when the chunk is merged, keep
+            # the event as the dereference statistics depend on it
+            self.node_data.events.append(int(node), entry.cycles,
+                                         entry.memory_address, is_cap,
+                                         deref_type)
+        else:
+            self.node_data[node].add_deref(entry.cycles, entry.memory_address,
+                                           is_cap, deref_type)
 
     def scan_cap_load(self, inst, entry, regs, last_regs, idx):
         """
@@ -679,12 +1363,7 @@ class PointerProvenanceParser(CallbackTraceParser):
             return False
 
         cd = inst.op0.cap_index
-        try:
-            node = self.regset.memory_map[entry.memory_address]
-        except KeyError:
-            logger.debug("Load c%d from new location 0x%x",
-                         cd, entry.memory_address)
-            node = None
+        node = self._memory_get(entry.memory_address)
 
         # if the capability loaded from memory is valid, it
         # can be safely assumed that it corresponds to the node
@@ -695,23 +1374,21 @@ class PointerProvenanceParser(CallbackTraceParser):
         # clear the memory_map and the regset entry.
         if not inst.op0.value.valid:
             self.regset[cd] = None
-            if node is not None:
-                del self.regset.memory_map[entry.memory_address]
+            self.regset.memory_map.clear(entry.memory_address)
         else:
             # check if the load instruction has committed
-            old_cd = CheriCap(last_regs.cap_reg[cd])
-            curr_cd = CheriCap(regs.cap_reg[cd])
-            if old_cd != curr_cd:
+            if self._capreg_written(entry, regs, last_regs, cd):
                 # the destination register was updated so the
                 # instruction did commit
 
-                if node is None:
+                if self._is_unknown(node):
                     # add a node as a root node because we have never
                     # seen the content of this register yet.
-                    node = self.make_root_node(entry, inst.op0.value,
-                                               time=entry.cycles)
+                    node = self._make_unknown_root(node, entry,
+                                                   inst.op0.value,
+                                                   entry.cycles)
                     logger.debug("Found %s value %s from memory load",
-                                 inst.op0.name, self.dataset.vp.data[node])
+                                 inst.op0.name, self.node_data[node])
                     self.regset.memory_map[entry.memory_address] = node
                 self.regset[cd] = node
         return False
@@ -742,10 +1419,10 @@ class PointerProvenanceParser(CallbackTraceParser):
         if inst.op0.value.valid:
             # if this is not a data access
 
-            if node is None:
+            if self._is_unknown(node):
                 # need to create one
-                node = self.make_root_node(entry, inst.op0.value,
-                                           time=entry.cycles)
+                node = self._make_unknown_root(node, entry, inst.op0.value,
+                                               entry.cycles)
                 self.regset[cd] = node
                 logger.debug("Found %s value %s from memory store",
                              inst.op0.name, node)
@@ -755,8 +1432,11 @@ class PointerProvenanceParser(CallbackTraceParser):
             # written by csc
             self.regset.memory_map[entry.memory_address] = node
             # set the address attribute of the node vertex data property
-            node_data = self.dataset.vp.data[node]
+            node_data = self.node_data[node]
             node_data.address[entry.cycles] = entry.memory_address
+        else:
+            # the stored value is not a capability
+            self.regset.memory_map.clear(entry.memory_address)
 
         return False
 
@@ -788,9 +1468,7 @@ class PointerProvenanceParser(CallbackTraceParser):
         data.is_kernel = entry.is_kernel()
 
         # create graph vertex and assign the data to it
-        vertex = self.dataset.add_vertex()
-        self.dataset.vp.data[vertex] = data
-        return vertex
+        return self.node_data.add_vertex(data)
 
     def make_node(self, entry, inst, origin=None, src_op_index=1, dst_op_index=0):
         """
@@ -833,12 +1511,10 @@ class PointerProvenanceParser(CallbackTraceParser):
                          src_op_index, inst.operands[src_op_index],
                          dst_op_index, inst.operands[dst_op_index])
             raise RuntimeError("Missing parent for %s" % node)
+        self._require(parent)
 
         # create the vertex in the graph and assign the data to it
-        vertex = self.dataset.add_vertex()
-        self.dataset.add_edge(parent, vertex)
-        self.dataset.vp.data[vertex] = data
-        return vertex
+        return self.node_data.add_vertex(data, parent)
 
     def update_regs(self, inst, entry, regs, last_regs):
         """
@@ -64,8 +64,9 @@ class PointerSizeCdfPlot(PointerProvenancePlot):
     def build_dataset(self):
         super().build_dataset()
         logger.info("Fetching cap lengths...")
+        vertex_data = self.node_data
         for v in self.dataset.vertices():
-            vdata = self.dataset.vp.data[v]
+            vdata = vertex_data[v]
             self.ptr_sizes.append(vdata.cap.length)
         logger.info("Done")
 
@@ -26,13 +26,16 @@
 #
 
 import logging
-import pickle
-import os
+import numpy as np
 
-from graph_tool.all import Graph, load_graph
+from graph_tool.all import Graph
 
-from cheriplot.utils import ProgressPrinter
-from cheriplot.core.provenance import CheriNodeOrigin
+from cheriplot.core.parser import ParallelTraceParser
+from cheriplot.core.provenance import CheriNodeOrigin, NodeDataMap
+from cheriplot.core.provenance_mmap import (
+    MappedProvenanceGraph, save_mapped_graph)
+from cheriplot.core.provenance_store import (
+    get_provenance_store_path, load_provenance_graph)
 from cheriplot.plot.plot_base import Plot
 
 from cheriplot.plot.provenance.parser import PointerProvenanceParser
@@ -44,119 +47,292 @@ class PointerProvenancePlot(Plot):
     Base class for plots using the pointer provenance graph.
     """
 
+    filter_version = 1
+    """
+    Version of the post-processing in :meth:`build_dataset`, bump it
+    when the filtering changes to invalidate the cached filtered graphs.
+    """
+
+    mapped_dataset = True
+    """
+    The cached graph is opened as a
+    :class:`cheriplot.core.provenance_mmap.MappedProvenanceGraph`,
+    plots that run graph-tool algorithms on the dataset set this to False
+    to get a :class:`graph_tool.Graph`.
+    """
+
     def __init__(self, *args, **kwargs):
         super(PointerProvenancePlot, self).__init__(*args, **kwargs)
 
         self._cached_dataset_valid = False
         """Tells whether we need to rebuild the dataset when caching."""
 
+        self.stream = False
+        """
+        Build the provenance graph in streaming mode, flushing the
+        finalized nodes to the store next to the trace while parsing.
+        """
+
+        self.workers = None
+        """Number of processes used to build the provenance graph."""
+
+        self.intern_roots = False
+        """
+        Reuse the root node of identical capabilities, see
+        :attr:`PointerProvenanceParser.intern_roots`.
+        """
+
+        self.deref_stats = False
+        """
+        Keep per-node dereference statistics instead of recording
+        each dereference in the provenance graph.
+        """
+
+        self.resume_from = None
+        """
+        Path of a previous trace segment, the cached provenance graph
+        of that trace is extended with the entries of this trace.
+        """
+
     def init_parser(self, dataset, tracefile):
-        if self.caching and os.path.exists(self._get_cache_file()):
-            # if caching we will nevere use this
+        if self.caching:
+            # the parser is created only if the cached graph is not valid
             return None
         return PointerProvenanceParser(dataset, tracefile)
 
     def init_dataset(self):
         logger.debug("Init provenance graph for %s", self.tracefile)
         self.dataset = Graph(directed=True)
-        vdata = self.dataset.new_vertex_property("object")
-        self.dataset.vp["data"] = vdata
+        NodeDataMap(self.dataset)
         return self.dataset
 
-    def _get_cache_file(self):
-        return self.tracefile + "_provenance_plot.gt"
+    @property
+    def node_data(self):
+        """:class:`cheriplot.core.provenance.NodeDataMap` of the dataset."""
+        return NodeDataMap(self.dataset)
+
+    def _get_cache_options(self):
+        """Options that change the provenance graph."""
+        return {"intern_roots": self.intern_roots,
+                "deref_stats": self.deref_stats}
+
+    def _get_graph_cache_entry(self, tracefile=None):
+        """
+        Cache entry of the provenance graph, the graph is shared
+        by all the provenance plots.
+        """
+        return self._get_cache_entry(
+            "graph", self._get_cache_options(), ".graph", tracefile,
+            producer=PointerProvenanceParser)
+
+    def _get_resume_cache_entry(self, tracefile=None):
+        """Cache entry of the parser state saved with the graph."""
+        return self._get_cache_entry(
+            "resume", self._get_cache_options(), ".pickle", tracefile,
+            producer=PointerProvenanceParser)
+
+    def _get_filtered_cache_entry(self):
+        """
+        Cache entry of the post-processed provenance graph, the
+        post-processing version is part of the key.
+        """
+        options = self._get_cache_options()
+        options["filter_version"] = self.filter_version
+        return self._get_cache_entry("filtered", options, ".graph",
+                                     producer=PointerProvenanceParser)
+
+    def _open_cached_graph(self, entry):
+        """
+        Open a provenance graph from the cache.
+
+        :param entry: the cache entry of the graph
+        :type entry: :class:`cheriplot.core.cache.CacheEntry`
+        :return: the provenance graph, see :attr:`mapped_dataset`
+        """
+        graph = MappedProvenanceGraph(entry.path)
+        if self.mapped_dataset:
+            return graph
+        return graph.to_graph()
+
+    def _save_filtered_cache(self):
+        """
+        Save the post-processed graph to the cache, along with
+        its vertex filter.
+        """
+        with self._get_filtered_cache_entry().write() as path:
+            save_mapped_graph(self.dataset, path)
+
+    def _save_cache(self):
+        """
+        Save the provenance graph to the cache along with the parser
+        state needed to resume the parsing.
+        """
+        with self._get_graph_cache_entry().write() as path:
+            save_mapped_graph(self.dataset, path)
+        if self.parser.resume_state is not None:
+            state = self.parser.resume_state
+        else:
+            state = self.parser.get_resume_state()
+        self._get_resume_cache_entry().save_pickle(state)
+
+    def _resume(self, tracefile):
+        """
+        Resume the parsing from the cached graph and parser state of
+        a trace. If the trace is this trace only the entries appended
+        since the state was saved are parsed, otherwise the trace
+        is a previous segment and this trace is parsed entirely.
+
+        :param tracefile: trace that saved the parser state
+        :type tracefile: str
+        :return: True if the graph has been restored from the cache
+        :rtype: bool
+        """
+        graph_entry = self._get_graph_cache_entry(tracefile)
+        resume_entry = self._get_resume_cache_entry(tracefile)
+        if tracefile == self.tracefile:
+            found = graph_entry.is_appended() and resume_entry.is_appended()
+        else:
+            found = graph_entry.is_valid() and resume_entry.is_valid()
+        if not found:
+            logger.debug("No resume state for %s", tracefile)
+            return False
+        state = resume_entry.load_pickle()
+        self.dataset = MappedProvenanceGraph(graph_entry.path).to_graph()
+        start = state["next_entry"] if tracefile == self.tracefile else 0
+        self.parser = PointerProvenanceParser(
+            self.dataset, self.tracefile, intern_roots=self.intern_roots)
+        self.parser.restore_resume_state(state)
+        if start >= len(self.parser):
+            return True
+        if self.stream or (self.workers is not None and self.workers > 1):
+            logger.info("Resumed parsing is sequential")
+        logger.info("Resume provenance parsing of %s from entry %d",
+                    self.tracefile, start)
+        self.parser.parse(start)
+        return True
+
+    def _parse(self):
+        """
+        Run the parser, in streaming mode the graph is then
+        loaded from the store. With multiple workers the trace is
+        split in chunks that are parsed in parallel and stitched.
+        """
+        parallel = self.workers is not None and self.workers > 1
+        if self.parser is None:
+            self.parser = PointerProvenanceParser(self.dataset, self.tracefile)
+        self.parser.intern_roots = self.intern_roots
+        if self.deref_stats:
+            self.parser.node_data.enable_deref_stats()
+        if self.stream:
+            if parallel:
+                logger.error("Streaming mode can not be used with "
+                             "multiple workers")
+                raise ValueError("Streaming mode with multiple workers")
+            store_path = get_provenance_store_path(self.tracefile)
+            self.parser.stream_to(store_path)
+            self.parser.parse()
+            self.dataset = load_provenance_graph(store_path)
+        elif parallel:
+            ParallelTraceParser(self.parser, workers=self.workers).parse()
+        else:
+            self.parser.parse()
 
     def build_dataset(self):
         """
         Build the provenance tree
         """
         if self.caching:
-            try:
+            filtered_entry = self._get_filtered_cache_entry()
+            if filtered_entry.is_valid():
+                logger.debug("Load cached filtered provenance graph")
+                self.dataset = self._open_cached_graph(filtered_entry)
+                return
+            graph_entry = self._get_graph_cache_entry()
+            if graph_entry.is_valid():
                 logger.debug("Load cached provenance graph")
-                self.dataset = load_graph(self._get_cache_file())
-            except IOError:
-                self.parser.parse()
-                self.dataset.save(self._get_cache_file())
-        else:
-            self.parser.parse()
+                self.dataset = self._open_cached_graph(graph_entry)
+            else:
+                # parse the entries appended to the trace or
+                # continue from the previous trace segment
+                if (not self._resume(self.tracefile) and
+                    (self.resume_from is None or
+                     not self._resume(self.resume_from))):
+                    self._parse()
+                self._save_cache()
+        elif self.resume_from is None or not self._resume(self.resume_from):
+            self._parse()
+
+        self._filter_dataset()
+        if self.caching:
+            self._save_filtered_cache()
 
-        num_nodes = self.dataset.num_vertices()
+    def _filter_dataset(self):
+        """
+        Hide the nodes that are not interesting for the plots.
+
+        The nodes created in kernel mode and the null capabilities are
+        removed, cfromptr -> csetbounds sequences are merged in a
+        single node attached to the parent of the cfromptr and the
+        remaining cfromptr nodes are removed. The passes work on the
+        vertex property arrays, the removed nodes are hidden by
+        the vertex filter of the dataset.
+        """
+        node_data = self.node_data
+        num_nodes = self.dataset.num_vertices(ignore_filter=True)
         logger.debug("Total nodes %d", num_nodes)
-        vertex_mask = self.dataset.new_vertex_property("bool")
-
-        progress = ProgressPrinter(num_nodes, desc="Search kernel nodes")
-        for node in self.dataset.vertices():
-            # remove null capabilities
-            # remove operations in kernel mode
-            vertex_data = self.dataset.vp.data
-            node_data = vertex_data[node]
-
-            if ((node_data.pc != 0 and node_data.is_kernel) or
-                (node_data.cap.length == 0 and node_data.cap.base == 0)):
-                vertex_mask[node] = True
-            progress.advance()
-        progress.finish()
-
-        self.dataset.set_vertex_filter(vertex_mask, inverted=True)
-        vertex_mask = self.dataset.copy_property(vertex_mask)
-
-        num_nodes = self.dataset.num_vertices()
-        logger.debug("Filtered kernel nodes, remaining %d", num_nodes)
-        progress = ProgressPrinter(
-            num_nodes, desc="Merge (cfromptr + csetbounds) sequences")
-
-        for node in self.dataset.vertices():
-            progress.advance()
-            # merge cfromptr -> csetbounds subtrees
-            num_parents = node.in_degree()
-            if num_parents == 0:
-                # root node
-                continue
-            elif num_parents > 1:
-                logger.error("Found node with more than a single parent %s", node)
-                raise RuntimeError("Too many parents for a node")
-
-            parent = next(node.in_neighbours())
-            parent_data = self.dataset.vp.data[parent]
-            node_data = self.dataset.vp.data[node]
-            if (parent_data.origin == CheriNodeOrigin.FROMPTR and
-                node_data.origin == CheriNodeOrigin.SETBOUNDS):
-                # the child must be unique to avoid complex logic
-                # when merging, it may be desirable to do so with
-                # more complex traces
-                node_data.origin = CheriNodeOrigin.PTR_SETBOUNDS
-                if parent.in_degree() == 1:
-                    next_parent = next(parent.in_neighbours())
-                    vertex_mask[parent] = True
-                    self.dataset.add_edge(next_parent, node)
-                elif parent.in_degree() == 0:
-                    vertex_mask[parent] = True
-                else:
-                    logger.error("Found node with more than a single parent %s",
-                                 parent)
-                    raise RuntimeError("Too many parents for a node")
-        progress.finish()
-
-        self.dataset.set_vertex_filter(vertex_mask, inverted=True)
-        vertex_mask = self.dataset.copy_property(vertex_mask)
-
-        num_nodes = self.dataset.num_vertices()
-        logger.debug("Merged (cfromptr + csetbounds), remaining %d", num_nodes)
-        progress = ProgressPrinter(num_nodes, desc="Find short-lived cfromptr")
-
-        for node in self.dataset.vertices():
-            progress.advance()
-            node_data = self.dataset.vp.data[node]
-
-            if node_data.origin == CheriNodeOrigin.FROMPTR:
-                vertex_mask[node] = True
-            # if (node_data.origin == CheriNodeOrigin.FROMPTR and
-            #     len(node_data.address) == 0 and
-            #     len(node_data.deref["load"]) == 0 and
-            #     len(node_data.deref["load"]) == 0):
-            #     # remove cfromptr that are never stored or used in
-            #     # a dereference
-            #     remove_list.append(node)
-        progress.finish()
-
-        self.dataset.set_vertex_filter(vertex_mask, inverted=True)
+        origin = node_data.array("origin")
+
+        # remove null capabilities
+        # remove operations in kernel mode
+        vertex_mask = (((node_data.array("pc") != 0) &
+                        node_data.array("is_kernel").astype(bool)) |
+                       ((node_data.array("length") == 0) &
+                        (node_data.array("base") == 0)))
+        logger.debug("Filtered kernel nodes, remaining %d",
+                     num_nodes - np.count_nonzero(vertex_mask))
+
+        # parent of each node in the filtered graph
+        edges = self.dataset.get_edges()
+        sources = edges[:, 0].astype(np.int64)
+        targets = edges[:, 1].astype(np.int64)
+        visible = ~vertex_mask[sources] & ~vertex_mask[targets]
+        sources = sources[visible]
+        targets = targets[visible]
+        in_degree = np.bincount(targets, minlength=num_nodes)
+        if np.any(in_degree > 1):
+            node = int(np.flatnonzero(in_degree > 1)[0])
+            logger.error("Found node with more than a single parent %d", node)
+            raise RuntimeError("Too many parents for a node")
+        parent = np.full(num_nodes, -1, dtype=np.int64)
+        parent[targets] = sources
+
+        # merge cfromptr -> csetbounds subtrees
+        # the child must be unique to avoid complex logic
+        # when merging, it may be desirable to do so with
+        # more complex traces
+        has_parent = parent >= 0
+        merge = np.flatnonzero(
+            has_parent & (origin == CheriNodeOrigin.SETBOUNDS) &
+            (origin[np.where(has_parent, parent, 0)] ==
+             CheriNodeOrigin.FROMPTR))
+        origin[merge] = CheriNodeOrigin.PTR_SETBOUNDS
+        fromptr = parent[merge]
+        vertex_mask[fromptr] = True
+        reparent = parent[fromptr] >= 0
+        self.dataset.add_edge_list(np.column_stack(
+            (parent[fromptr[reparent]], merge[reparent])))
+        logger.debug("Merged (cfromptr + csetbounds), remaining %d",
+                     num_nodes - np.count_nonzero(vertex_mask))
+
+        # remove short-lived cfromptr
+        # if (node_data.origin == CheriNodeOrigin.FROMPTR and
+        #     len(node_data.address) == 0 and
+        #     len(node_data.deref["load"]) == 0 and
+        #     len(node_data.deref["load"]) == 0):
+        #     # remove cfromptr that are never stored or used in
+        #     # a dereference
+        vertex_mask |= origin == CheriNodeOrigin.FROMPTR
+
+        vertex_filter = self.dataset.new_vertex_property("bool")
+        vertex_filter.a = vertex_mask
+        self.dataset.set_vertex_filter(vertex_filter, inverted=True)
@@ -41,6 +41,9 @@ class PointerTreePlot(PointerProvenancePlot):
     Plot the pointer tree
     """
 
+    mapped_dataset = False
+    """The layout is computed by graph-tool."""
+
     def plot(self):
 
         layout = sfdp_layout(self.dataset)
@@ -48,8 +51,9 @@ class PointerTreePlot(PointerProvenancePlot):
         # if we want to see features there
 
         node_sizes = np.empty(self.dataset.num_vertices())
+        vertex_data = self.node_data
         for idx, v in enumerate(self.dataset.vertices()):
-            data = self.dataset.vp.data[v]
+            data = vertex_data[v]
             node_sizes[idx] = data.length
         # normalize in the range min_size, max_size
         min_size = 5
@@ -84,6 +88,9 @@ class ProvenanceTreePlot(PointerProvenancePlot):
     the parents up to the root and all children.
     """
 
+    mapped_dataset = False
+    """The related nodes are found with a graph-tool BFS."""
+
     def __init__(self, target_cap, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
@@ -106,8 +113,9 @@ class ProvenanceTreePlot(PointerProvenancePlot):
 
         # find the target vertex with the given target capability t_alloc
         target = None
+        vertex_data = self.node_data
         for v in self.dataset.vertices():
-            data = self.dataset.vp.data[v]
+            data = vertex_data[v]
             if data.cap.t_alloc == self.target_cap:
                 target = v
                 break
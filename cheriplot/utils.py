@@ -76,6 +76,6 @@ class ProgressPrinter:
         """
         Add newline to separate upcoming output
         """
-        if logger.getEffectiveLevel() < self.level:
+        if logger.getEffectiveLevel() > self.level:
             return
         print("\n")
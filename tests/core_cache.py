@@ -0,0 +1,175 @@
+"""
+Test the cache manager of the datasets derived from traces
+"""
+
+import os
+import pytest
+import subprocess
+import sys
+
+from cheriplot.core.cache import CacheManager, TraceFingerprint
+
+
+class _Producer:
+    cache_version = 1
+
+
+class _NewProducer(_Producer):
+    cache_version = 2
+
+
+@pytest.fixture
+def tracefile(tmpdir):
+    trace = tmpdir.join("trace.cvtrace")
+    trace.write_binary(b"header" * 20000)
+    return str(trace)
+
+
+@pytest.fixture
+def manager(tmpdir):
+    return CacheManager(str(tmpdir.join("cache")))
+
+
+def bump_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_entry_key(manager, tracefile):
+    entry = manager.entry(tracefile, _Producer, "data", {"a": 1, "b": 2})
+    same = manager.entry(tracefile, _Producer(), "data", {"b": 2, "a": 1})
+    assert entry.path == same.path
+    options = {"a": 1, "b": 2}
+    for other in (manager.entry(tracefile, _Producer, "other", options),
+                  manager.entry(tracefile, _Producer, "data", {"a": 2}),
+                  manager.entry(tracefile, _NewProducer, "data", options)):
+        assert other.path != entry.path
+    assert os.path.dirname(entry.path) == manager.cache_dir
+
+
+def test_entry_valid(manager, tracefile):
+    entry = manager.entry(tracefile, _Producer, "data", suffix=".pickle")
+    assert not entry.is_valid()
+    entry.save_pickle({"value": 1})
+    assert entry.path.endswith(".pickle")
+    assert entry.is_valid()
+    assert not entry.is_appended()
+    assert entry.load_pickle() == {"value": 1}
+
+    # a disabled cache never uses the entries
+    disabled = CacheManager(manager.cache_dir, enabled=False)
+    assert not disabled.entry(tracefile, _Producer, "data",
+                              suffix=".pickle").is_valid()
+
+    # the trace is rewritten
+    bump_mtime(tracefile)
+    entry = manager.entry(tracefile, _Producer, "data", suffix=".pickle")
+    assert not entry.is_valid()
+    assert not os.path.exists(entry.path)
+
+
+def test_entry_appended(manager, tracefile):
+    entry = manager.entry(tracefile, _Producer, "data")
+    entry.save_pickle(1)
+    with open(tracefile, "ab") as fd:
+        fd.write(b"entries")
+    entry = manager.entry(tracefile, _Producer, "data")
+    assert not entry.is_valid()
+    assert entry.is_appended()
+    assert entry.load_pickle() == 1
+
+
+def test_fingerprint(tracefile, tmpdir):
+    fingerprint = TraceFingerprint(tracefile)
+    assert fingerprint == TraceFingerprint(tracefile)
+    other = tmpdir.join("other.cvtrace")
+    other.write_binary(b"other!" * 20000)
+    assert fingerprint != TraceFingerprint(str(other))
+    assert not fingerprint.is_prefix_of(TraceFingerprint(str(other)))
+
+
+def test_fingerprint_rewritten(tracefile):
+    # a larger trace with the same header is not an extension if
+    # the end of the old trace changed
+    fingerprint = TraceFingerprint(tracefile)
+    with open(tracefile, "r+b") as fd:
+        fd.seek(fingerprint.size - 4)
+        fd.write(b"XXXXentries")
+    assert not fingerprint.is_prefix_of(TraceFingerprint(tracefile))
+
+
+def test_atomic_write(manager, tracefile):
+    entry = manager.entry(tracefile, _Producer, "data")
+    entry.save_pickle(1)
+    with pytest.raises(RuntimeError):
+        with entry.write() as path:
+            with open(path, "wb") as fd:
+                fd.write(b"partial")
+            raise RuntimeError("write failed")
+    # the old data is kept and no temporary file is left
+    assert entry.is_valid()
+    assert entry.load_pickle() == 1
+    assert sorted(os.listdir(manager.cache_dir)) == sorted(
+        os.path.basename(p) for p in (entry.path, entry.meta_path))
+
+
+def test_evict_lru(manager, tracefile):
+    entries = [manager.entry(tracefile, _Producer, "data%d" % idx)
+               for idx in range(4)]
+    for entry in entries:
+        entry.save_pickle(b"x" * 1000)
+    for idx, entry in enumerate(entries):
+        os.utime(entry.meta_path, (idx, idx))
+        os.utime(entry.path, (idx, idx))
+    # use the oldest entry
+    assert entries[0].is_valid()
+    size = entries[0].size()
+    manager.max_size = 3 * size
+    manager.evict()
+    assert [e.is_valid() for e in entries] == [True, False, True, True]
+    # the entry just written is never evicted
+    manager.max_size = 0
+    entries[1].save_pickle(b"x" * 1000)
+    assert [e.is_valid() for e in entries] == [False, True, False, False]
+    manager.clear()
+    assert os.listdir(manager.cache_dir) == []
+
+
+def test_directory_entry(manager, tracefile):
+    entry = manager.entry(tracefile, _Producer, "data", suffix=".graph")
+    for content in (b"old", b"new"):
+        with entry.write() as path:
+            os.makedirs(path)
+            with open(os.path.join(path, "column.npy"), "wb") as fd:
+                fd.write(content)
+    assert entry.is_valid()
+    with open(os.path.join(entry.path, "column.npy"), "rb") as fd:
+        assert fd.read() == b"new"
+    assert entry.size() > 3
+    entry.invalidate()
+    assert os.listdir(manager.cache_dir) == []
+
+
+def test_orphan_tmp(manager, tracefile):
+    # temporary files of a dead writer are removed, the files of
+    # a write in progress are kept
+    entry = manager.entry(tracefile, _Producer, "data", suffix=".pickle")
+    entry.save_pickle(b"x" * 1000)
+    writer = subprocess.Popen([sys.executable, "-c", "pass"])
+    writer.wait()
+    base = os.path.join(manager.cache_dir, entry.digest)
+    orphan = "%s.%d.tmp.pickle" % (base, writer.pid)
+    writing = "%s.%d.tmp.pickle" % (base, os.getpid())
+    with open(orphan, "wb") as fd:
+        fd.write(b"partial")
+    manager.evict()
+    assert not os.path.exists(orphan)
+    assert [paths for _, _, paths in manager.entries()]
+    with open(writing, "wb") as fd:
+        fd.write(b"partial")
+    manager.evict()
+    assert os.path.exists(writing)
+    assert manager.entries() == []
+    os.remove(writing)
+    manager.clear()
+    assert os.listdir(manager.cache_dir) == []
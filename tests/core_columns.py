@@ -0,0 +1,65 @@
+"""
+Test the trace columns extraction
+"""
+
+import pytest
+import numpy as np
+from unittest import mock
+
+from cheriplot.core.columns import (
+    TraceColumnExtractor, TraceColumns, match_windows)
+
+
+@pytest.mark.parametrize("indices,before,after,expect", [
+    ([], 1, 1, []),
+    ([5], 0, 0, [(5, 5)]),
+    ([5], 2, 3, [(3, 8)]),
+    ([0, 99], 2, 3, [(0, 3), (97, 99)]),
+    ([10, 14, 30], 1, 2, [(9, 16), (29, 32)]),
+    ([10, 13], 0, 2, [(10, 15)]),
+])
+def test_match_windows(indices, before, after, expect):
+    ranges = match_windows(np.array(indices, dtype=np.int64), before, after,
+                           0, 99)
+    assert ranges == expect
+
+
+@mock.patch("pycheritrace.trace")
+def test_extract(mock_trace, tmpdir):
+    # the columns contain the fields of each trace entry
+    n_entries = 100
+
+    def make_entry(idx):
+        entry = mock.Mock(pc=0x1000 + idx * 4, cycles=idx * 2,
+                          inst=0xdead0000 + idx, asid=idx % 3,
+                          exception=8 if idx % 10 == 0 else 31,
+                          memory_address=0x8000 + idx, is_load=idx % 2 == 0,
+                          is_store=idx % 5 == 0)
+        entry.is_kernel.return_value = idx > 90
+        entry.gpr_number.return_value = idx % 32
+        entry.capreg_number.return_value = -1
+        return entry
+
+    def scan(callback, start, end, direction):
+        for idx in range(start, min(end, n_entries - 1) + 1):
+            if callback(make_entry(idx), None, idx):
+                break
+    mock_trace.open.return_value.size.return_value = n_entries
+    mock_trace.open.return_value.scan.side_effect = scan
+
+    path = str(tmpdir.join("columns"))
+    with mock.patch("os.path.exists", return_value=True):
+        extractor = TraceColumnExtractor("no_file", path=path, block_size=16)
+    extractor.extract()
+    columns = TraceColumns(path)
+    idx = np.arange(n_entries)
+    assert len(columns) == n_entries
+    assert (columns.pc == 0x1000 + idx * 4).all()
+    assert (columns["cycles"] == idx * 2).all()
+    assert (columns.inst == 0xdead0000 + idx).all()
+    assert (columns.exception == np.where(idx % 10 == 0, 8, 31)).all()
+    assert (columns.is_load == (idx % 2 == 0)).all()
+    assert (columns.is_kernel == (idx > 90)).all()
+    assert (columns.capreg_number == -1).all()
+    mask = columns.in_range("pc", 0x1010, 0x1020, 2, 50)
+    assert list(np.flatnonzero(mask) + 2) == [4, 5, 6, 7, 8]
@@ -0,0 +1,64 @@
+"""
+Test the opcode inverted index
+"""
+
+import pytest
+import numpy as np
+from unittest import mock
+
+from cheriplot.core.parser import Instruction
+from cheriplot.core.opcode_index import OpcodeIndex
+
+# instruction word to opcode, None is an invalid instruction
+word_opcodes = {1: "daddiu", 2: "csetbounds", 3: "clc", 4: "csc", 5: None}
+
+
+class _FakeColumns:
+    def __init__(self, inst):
+        self.inst = np.array(inst, dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.inst)
+
+
+class _FakeDisasm:
+    def __init__(self, word):
+        opcode = word_opcodes[word]
+        self.name = "\t%s\t" % opcode if opcode else "invalid"
+
+
+@pytest.fixture
+def index(tmpdir):
+    inst = [1, 2, 1, 3, 4, 1, 5, 3, 2, 1]
+    with mock.patch("pycheritrace.disassembler") as mock_dis:
+        mock_dis.return_value.disassemble.side_effect = _FakeDisasm
+        return OpcodeIndex.build(_FakeColumns(inst), str(tmpdir.join("idx")))
+
+
+def test_find(index):
+    assert len(index) == 10
+    assert sorted(index.opcodes, key=str) == sorted(
+        word_opcodes.values(), key=str)
+    assert list(index.find("daddiu")) == [0, 2, 5, 9]
+    assert list(index.find("daddiu", 1, 5)) == [2, 5]
+    assert list(index.find("clc")) == [3, 7]
+    assert list(index.find(None)) == [6]
+    assert list(index.find("cjr")) == []
+    assert index.count("csetbounds") == 2
+
+
+def test_find_iclass(index):
+    iclass = Instruction.IClass.I_CAP_LOAD
+    assert list(index.find_iclass(iclass)) == [3, 7]
+    assert list(index.find_any(["clc", "csc", "csetbounds"])) == [
+        1, 3, 4, 7, 8]
+
+
+def test_find_ranges(index):
+    assert index.find_ranges(["clc", "csc"], 0, 9) == [(2, 4), (6, 7)]
+    assert index.find_ranges(["csetbounds"], 1, 9) == [(1, 1), (7, 8)]
+
+
+def test_reopen(index):
+    reopened = OpcodeIndex(index.path)
+    assert list(reopened.find("csc")) == [4]
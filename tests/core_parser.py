@@ -4,9 +4,14 @@ Test the core parser callback handling
 
 import pytest
 import logging
+import numpy as np
+from itertools import islice
 from unittest import mock
 
-from cheriplot.core import CallbackTraceParser
+import cheriplot.core.parser as core_parser
+from cheriplot.core import (
+    TraceParser, CallbackTraceParser, CompositeTraceParser, DecodeCache,
+    ParallelTraceParser)
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -203,3 +208,490 @@ def test_callbacks(parser_setup, opcode):
     for cbk in callbacks:
         assert cbk in expect[opcode], "Callback method not expected %s" % cbk
 
+
+@pytest.mark.parametrize("opcode", opcode_list)
+def test_dispatch_table(parser_setup, opcode):
+    # the dispatch table must resolve each opcode once and
+    # always return the same immutable callback tuple
+    expect, parser, setup_key = parser_setup
+
+    callbacks = parser._get_opcode_callbacks(opcode)
+    assert isinstance(callbacks, tuple)
+    assert parser._get_opcode_callbacks(opcode) is callbacks
+    assert opcode in parser._dispatch
+    # the <all> callback is always the last one
+    if mock_scan_all in expect[opcode]:
+        assert callbacks[-1] is mock_scan_all
+
+
+@mock.patch("pycheritrace.disassembler")
+def test_decode_cache(mock_dis):
+    # the decode cache must disassemble each word only once and
+    # evict the least recently used word when full
+    def disassemble(word):
+        disasm = mock.Mock()
+        disasm.name = "\tdaddiu\t$1, $1, %d" % word
+        disasm.operands = []
+        return disasm
+    mock_dis.return_value.disassemble.side_effect = disassemble
+
+    cache = DecodeCache(size=2)
+    first = cache.decode(1)
+    assert first.opcode == "daddiu"
+    assert cache.decode(1) is first
+    cache.decode(2)
+    assert (cache.hits, cache.misses) == (1, 2)
+    # 1 is the most recently used, 2 is evicted
+    cache.decode(1)
+    cache.decode(3)
+    assert len(cache) == 2
+    cache.decode(2)
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert mock_dis.return_value.disassemble.call_count == 4
+
+
+@mock.patch("pycheritrace.disassembler")
+def test_decode_cache_invalid(mock_dis):
+    # instruction words that can not be parsed have no opcode
+    mock_dis.return_value.disassemble.return_value.name = "unknown"
+    decoded = DecodeCache().decode(0)
+    assert decoded.opcode is None
+    assert decoded.iclass == frozenset()
+
+
+@pytest.mark.parametrize("prefilter", [True, False])
+@mock.patch("cheriplot.core.parser.Instruction")
+@mock.patch("pycheritrace.disassembler")
+@mock.patch("os.path.exists")
+@mock.patch("pycheritrace.trace")
+def test_parse_prefilter(mock_trace, mock_exists, mock_dis, mock_inst,
+                         prefilter):
+    # in pre-filter mode only the entries with a callback build an
+    # Instruction, the other entries only update the previous register set
+    words = {1: "\tdaddiu\t$1, $1, 1", 2: "\tcsetbounds\t$c1, $c2, $1",
+             3: "unknown"}
+    def disassemble(word):
+        disasm = mock.Mock()
+        disasm.name = words[word]
+        return disasm
+    mock_dis.return_value.disassemble.side_effect = disassemble
+    trace_words = [1, 1, 2, 3, 1, 2]
+
+    def scan(callback, start, end, direction):
+        for idx in range(start, end):
+            entry = mock.Mock(inst=trace_words[idx])
+            callback(entry, "regs_%d" % idx, idx)
+    mock_trace.open.return_value.size.return_value = len(trace_words)
+    mock_trace.open.return_value.scan.side_effect = scan
+
+    class _Parser(CallbackTraceParser):
+        scan_csetbounds = mock.Mock(return_value=False)
+
+    parser = _Parser(None, "no_file")
+    parser.parse(prefilter=prefilter)
+
+    # the unknown instruction never builds an Instruction
+    assert mock_inst.call_count == (2 if prefilter else 5)
+    assert _Parser.scan_csetbounds.call_count == 2
+    # the previous register set is updated by skipped entries
+    args = _Parser.scan_csetbounds.call_args_list[1][0]
+    assert args[3] == "regs_4"
+    assert mock_dis.return_value.disassemble.call_count == 3
+    if prefilter:
+        assert len(parser._word_dispatch) == 3
+    else:
+        assert len(parser._word_dispatch) == 0
+
+
+@pytest.mark.parametrize("start,end,chunks", [
+    (0, 100, 4), (10, 13, 8), (0, 1, 2), (5, 1000, 7)])
+def test_parallel_split(start, end, chunks):
+    # chunks must cover the range in order without overlapping
+    parser = mock.Mock(path="no_file")
+    parallel = ParallelTraceParser(parser, workers=2, chunks=chunks)
+    ranges = parallel.split(start, end)
+    assert len(ranges) <= chunks
+    assert ranges[0][0] == start
+    assert ranges[-1][1] == end
+    for (_, prev_end), (next_start, _) in zip(ranges[:-1], ranges[1:]):
+        assert next_start == prev_end + 1
+
+
+@mock.patch("pycheritrace.disassembler")
+@mock.patch("os.path.exists")
+@mock.patch("pycheritrace.trace")
+def test_parallel_parse(mock_trace, mock_exists, mock_dis):
+    # partial results are merged in trace order
+    mock_dis.return_value.disassemble.return_value.name = "\tdaddiu\t"
+    n_entries = 50
+
+    def scan(callback, start, end, direction):
+        for idx in range(start, min(end, n_entries - 1) + 1):
+            if callback(mock.Mock(inst=0), idx, idx):
+                break
+    mock_trace.open.return_value.size.return_value = n_entries
+    mock_trace.open.return_value.scan.side_effect = scan
+
+    class _Parser(CallbackTraceParser):
+
+        def scan_all(self, inst, entry, regs, last_regs, idx):
+            self.dataset.append((idx, last_regs))
+            return False
+
+        def new_partial(self):
+            return []
+
+        def merge_partial(self, partial):
+            self.dataset.extend(partial)
+
+    parser = _Parser([], "no_file")
+    parallel = ParallelTraceParser(parser, workers=2, chunks=5)
+    parallel.parse(0, n_entries - 1)
+    expect = [(idx, max(idx - 1, 0)) for idx in range(n_entries)]
+    assert parser.dataset == expect
+
+    # chunks do not restart from the loaded checkpoints
+    parser = _Parser([], "no_file")
+    parser.checkpoints = mock.Mock()
+    parser.checkpoints.nearest.return_value = mock.Mock(idx=5, regs=4)
+    core_parser._worker_parser = parser
+    try:
+        partial = core_parser._parse_chunk((20, 29, {}))
+    finally:
+        core_parser._worker_parser = None
+    assert partial == [(idx, idx - 1) for idx in range(20, 30)]
+    assert parser.checkpoints is None
+
+
+class _FakeCap:
+    def __init__(self, value):
+        self.base = value
+        self.length = 0x100
+        self.offset = 0
+        self.permissions = 0xff
+        self.type = 0
+        self.valid = True
+        self.unsealed = False
+
+
+class _FakeRegs:
+    def __init__(self, value):
+        self.gpr = [value] * 31
+        self.valid_gprs = [True] * 31
+        self.cap_reg = [_FakeCap(value)] * 32
+        self.valid_caps = [True] * 32
+
+
+@mock.patch("pycheritrace.disassembler")
+@mock.patch("os.path.exists")
+@mock.patch("pycheritrace.trace")
+def test_checkpoints(mock_trace, mock_exists, mock_dis, tmpdir):
+    # parsing from a checkpoint must give the same state as a full parse
+    mock_dis.return_value.disassemble.return_value.name = "\tdaddiu\t"
+    n_entries = 100
+
+    def scan(callback, start, end, direction):
+        for idx in range(start, min(end, n_entries - 1) + 1):
+            entry = mock.Mock(inst=0, cycles=idx * 2)
+            if callback(entry, _FakeRegs(idx), idx):
+                break
+    mock_trace.open.return_value.size.return_value = n_entries
+    mock_trace.open.return_value.scan.side_effect = scan
+
+    class _Parser(CallbackTraceParser):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.total = 0
+            self.first_last_regs = None
+
+        def scan_all(self, inst, entry, regs, last_regs, idx):
+            if self.first_last_regs is None:
+                self.first_last_regs = last_regs.gpr[0]
+            self.total += idx
+            return False
+
+        def get_checkpoint_state(self):
+            return self.total
+
+        def restore_checkpoint_state(self, state):
+            self.total = state
+
+    path = str(tmpdir.join("checkpoints"))
+    parser = _Parser(None, "no_file")
+    index = parser.build_checkpoints(10, path)
+    assert [c.idx for c in index.checkpoints] == list(range(10, 100, 10))
+    assert index.checkpoints[2].cycles == 60
+
+    parser = _Parser(None, "no_file")
+    parser.load_checkpoints(path)
+    parser.parse(start=25)
+    assert parser.total == sum(range(n_entries))
+    # the replay starts from the checkpoint register set
+    assert parser.first_last_regs == 19
+
+
+@mock.patch("pycheritrace.disassembler")
+@mock.patch("os.path.exists")
+@mock.patch("pycheritrace.trace")
+def test_parse_ranges(mock_trace, mock_exists, mock_dis):
+    # only the given ranges are scanned and each range sees the
+    # register set of the entry before it
+    mock_dis.return_value.disassemble.return_value.name = "\tdaddiu\t"
+    n_entries = 50
+
+    def scan(callback, start, end, direction):
+        for idx in range(start, min(end, n_entries - 1) + 1):
+            if callback(mock.Mock(inst=0), idx, idx):
+                break
+    mock_trace.open.return_value.size.return_value = n_entries
+    mock_trace.open.return_value.scan.side_effect = scan
+
+    class _Parser(CallbackTraceParser):
+
+        def scan_all(self, inst, entry, regs, last_regs, idx):
+            self.dataset.append((idx, last_regs))
+            return idx == 42
+
+    parser = _Parser([], "no_file")
+    parser.parse_ranges([(0, 2), (3, 4), (10, 11), (40, 45)])
+    expect = [(0, 0), (1, 0), (2, 1), (3, 2), (4, 3), (10, 9), (11, 10),
+              (40, 39), (41, 40), (42, 41)]
+    assert parser.dataset == expect
+
+
+@mock.patch("pycheritrace.disassembler")
+@mock.patch("os.path.exists")
+@mock.patch("pycheritrace.trace")
+def test_parse_opcode_index(mock_trace, mock_exists, mock_dis):
+    # with an opcode index only the entries with callbacks are scanned
+    # and each of them sees the register set of the previous entry
+    n_entries = 50
+
+    def disassemble(word):
+        disasm = mock.Mock()
+        disasm.name = "\tclc\t" if word else "\tdaddiu\t"
+        disasm.operands = []
+        return disasm
+    mock_dis.return_value.disassemble.side_effect = disassemble
+    clc_entries = [0, 7, 8, 30, 49]
+    scanned = []
+
+    def scan(callback, start, end, direction):
+        for idx in range(start, min(end, n_entries - 1) + 1):
+            scanned.append(idx)
+            entry = mock.Mock(inst=int(idx in clc_entries))
+            if callback(entry, idx, idx):
+                break
+    mock_trace.open.return_value.size.return_value = n_entries
+    mock_trace.open.return_value.scan.side_effect = scan
+
+    class _Parser(CallbackTraceParser):
+
+        def scan_clc(self, inst, entry, regs, last_regs, idx):
+            self.dataset.append((idx, last_regs))
+            return False
+
+    index = mock.MagicMock(opcodes=["daddiu", "clc"])
+    index.__len__.return_value = n_entries
+    index.find_ranges.return_value = [(0, 0), (6, 8), (29, 30), (48, 49)]
+    parser = _Parser([], "no_file")
+    parser.opcode_index = index
+    parser.parse()
+    index.find_ranges.assert_called_once_with(["clc"], 0, n_entries)
+    assert scanned == [0, 6, 7, 8, 29, 30, 48, 49]
+    assert parser.dataset == [(0, 0), (7, 6), (8, 7), (30, 29), (49, 48)]
+
+
+@mock.patch("pycheritrace.disassembler")
+@mock.patch("os.path.exists")
+@mock.patch("pycheritrace.trace")
+def test_parse_batch(mock_trace, mock_exists, mock_dis):
+    # batch callbacks receive the entries of their opcodes or
+    # instruction class in arrays of at most batch_size entries
+    n_entries = 20
+
+    def disassemble(word):
+        disasm = mock.Mock()
+        disasm.name = "\tclc\t" if word else "\tdaddiu\t"
+        disasm.operands = []
+        return disasm
+    mock_dis.return_value.disassemble.side_effect = disassemble
+
+    def scan(callback, start, end, direction):
+        for idx in range(start, min(end, n_entries - 1) + 1):
+            entry = mock.Mock(inst=idx % 2, pc=0x1000 + 4 * idx, cycles=idx,
+                              exception=31, is_load=bool(idx % 2),
+                              is_store=False, memory_address=0x100 * idx)
+            entry.is_kernel.return_value = False
+            entry.gpr_number.return_value = -1 if idx % 2 else 2
+            entry.capreg_number.return_value = 3 if idx % 2 else -1
+            regs = _FakeRegs(idx)
+            # the unsealed field of pycheritrace holds the sealed bit
+            regs.cap_reg[3].unsealed = (idx % 4 == 1)
+            if callback(entry, regs, idx):
+                break
+    mock_trace.open.return_value.size.return_value = n_entries
+    mock_trace.open.return_value.scan.side_effect = scan
+
+    class _Parser(CallbackTraceParser):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.cap_load = []
+            self.every = []
+
+        def scan_batch_cap_load(self, batch):
+            self.cap_load.append(batch)
+            return False
+
+        def scan_batch_all(self, batch):
+            self.every.append(batch)
+            return False
+
+        def scan_all(self, inst, entry, regs, last_regs, idx):
+            raise AssertionError("per-entry callback in batched mode")
+
+    parser = _Parser(None, "no_file")
+    parser.parse_batch(batch_size=4)
+    assert [len(b) for b in parser.cap_load] == [4, 4, 2]
+    assert [len(b) for b in parser.every] == [4] * 5
+    loads = np.concatenate(parser.cap_load)
+    assert list(loads["idx"]) == list(range(1, n_entries, 2))
+    assert (loads["opcode"] == parser.get_opcode_id("clc")).all()
+    assert parser.opcode_table[loads["opcode"][0]] == "clc"
+    assert (loads["cap_base"] == loads["idx"]).all()
+    assert (loads["cap_length"] == 0x100).all()
+    assert (loads["cap_sealed"] == (loads["idx"] % 4 == 1)).all()
+    assert (loads["memory_address"] == loads["idx"] * 0x100).all()
+    every = np.concatenate(parser.every)
+    assert list(every["idx"]) == list(range(n_entries))
+    gpr = every[every["gpr_number"] == 2]
+    assert (gpr["gpr_value"] == gpr["idx"]).all()
+    assert gpr["reg_valid"].all()
+
+
+@mock.patch("pycheritrace.disassembler")
+@mock.patch("os.path.exists")
+@mock.patch("pycheritrace.trace")
+def test_iter_instructions(mock_trace, mock_exists, mock_dis):
+    # the iterator filters the instructions and stops the scan
+    # when the consumer stops
+    n_entries = 1000
+    scanned = []
+
+    def disassemble(word):
+        disasm = mock.Mock()
+        disasm.name = "\tclc\t" if word else "\tdaddiu\t"
+        disasm.operands = []
+        return disasm
+    mock_dis.return_value.disassemble.side_effect = disassemble
+
+    def scan(callback, start, end, direction):
+        for idx in range(start, min(end, n_entries - 1) + 1):
+            scanned.append(idx)
+            entry = mock.Mock(inst=int(idx % 3 == 0), pc=idx)
+            if callback(entry, idx, idx):
+                break
+    mock_trace.open.return_value.size.return_value = n_entries
+    mock_trace.open.return_value.scan.side_effect = scan
+
+    parser = TraceParser("no_file")
+    insts = list(parser.iter_instructions(10, 30, opcodes=["clc"],
+                                          batch_size=4))
+    assert [i.idx for i in insts] == [12, 15, 18, 21, 24, 27, 30]
+    assert all(i.opcode == "clc" for i in insts)
+    assert [i._prev_regset for i in insts] == [11, 14, 17, 20, 23, 26, 29]
+
+    predicate = lambda inst: inst.entry.pc % 2 == 0
+    insts = parser.iter_instructions(predicate=predicate, batch_size=8,
+                                     read_ahead=2)
+    first = list(islice(insts, 5))
+    assert [i.idx for i in first] == [0, 2, 4, 6, 8]
+    del scanned[:]
+    insts.close()
+    # the producer stops within the read-ahead window
+    assert len(scanned) < n_entries
+
+    mock_trace.open.return_value.scan.side_effect = ValueError("broken")
+    with pytest.raises(ValueError):
+        list(parser.iter_instructions())
+
+
+@mock.patch("pycheritrace.disassembler")
+@mock.patch("os.path.exists")
+@mock.patch("pycheritrace.trace")
+def test_composite_parse(mock_trace, mock_exists, mock_dis):
+    # each entry is decoded once and dispatched to every member,
+    # members stop independently
+    n_entries = 30
+    decoded = []
+    scanned = []
+
+    def disassemble(word):
+        decoded.append(word)
+        disasm = mock.Mock()
+        disasm.name = ["\tdaddiu\t", "\tclc\t", "\tcsc\t"][word]
+        disasm.operands = []
+        return disasm
+    mock_dis.return_value.disassemble.side_effect = disassemble
+
+    def scan(callback, start, end, direction):
+        for idx in range(start, min(end, n_entries - 1) + 1):
+            scanned.append(idx)
+            if callback(mock.Mock(inst=idx % 3), idx, idx):
+                break
+    mock_trace.open.return_value.size.return_value = n_entries
+    mock_trace.open.return_value.scan.side_effect = scan
+
+    class _LoadParser(CallbackTraceParser):
+
+        def scan_cap_load(self, inst, entry, regs, last_regs, idx):
+            self.dataset.append(idx)
+            return False
+
+    class _StoreParser(CallbackTraceParser):
+
+        def scan_csc(self, inst, entry, regs, last_regs, idx):
+            self.dataset.append((idx, last_regs))
+            return idx >= 10
+
+    class _AllParser(CallbackTraceParser):
+
+        def scan_all(self, inst, entry, regs, last_regs, idx):
+            self.dataset.append(inst.opcode)
+            return False
+
+    loads = _LoadParser([], "no_file")
+    stores = _StoreParser([], "no_file")
+    every = _AllParser([], "no_file")
+    decoded.clear()
+    composite = CompositeTraceParser([loads, stores, every])
+    composite.parse()
+    assert sorted(decoded) == [0, 1, 2]
+    assert loads.dataset == list(range(1, n_entries, 3))
+    assert stores.dataset == [(2, 1), (5, 4), (8, 7), (11, 10)]
+    assert len(every.dataset) == n_entries
+
+    # the scan stops when all the members are done
+    stores.dataset = []
+    scanned.clear()
+    composite = CompositeTraceParser([stores])
+    composite.parse()
+    assert stores.dataset == [(2, 1), (5, 4), (8, 7), (11, 10)]
+    assert scanned[-1] == 11
+
+
+@mock.patch("os.path.exists")
+@mock.patch("pycheritrace.trace")
+def test_capreg_written(mock_trace, mock_exists):
+    # the register number of the entry is used when it is recorded,
+    # otherwise the register content is compared
+    parser = CallbackTraceParser(None, "no_file")
+    entry = mock.Mock()
+    entry.capreg_number.return_value = 3
+    assert parser._capreg_written(entry, _FakeRegs(1), _FakeRegs(1), 3)
+    assert not parser._capreg_written(entry, _FakeRegs(1), _FakeRegs(2), 4)
+    entry.capreg_number.return_value = -1
+    assert parser._capreg_written(entry, _FakeRegs(1), _FakeRegs(2), 3)
+    assert not parser._capreg_written(entry, _FakeRegs(1), _FakeRegs(1), 3)
@@ -0,0 +1,140 @@
+"""
+Test the columnar provenance graph node data
+"""
+
+import pytest
+import pickle
+from copy import copy
+
+from graph_tool.all import Graph
+
+from cheriplot.core.provenance import (
+    CheriCap, CheriNodeOrigin, NodeData, NodeDataMap, ProvenanceEventLog)
+
+from provenance_helpers import make_data
+
+
+@pytest.fixture
+def graph():
+    graph = Graph(directed=True)
+    NodeDataMap(graph)
+    return graph
+
+
+def test_roundtrip(graph):
+    # the view returns the same values stored from a NodeData
+    node_data = NodeDataMap(graph)
+    data = make_data(0xffffffffffff0000, 0x1000, 0x10)
+    data.address[20] = 0xfffffffffffff000
+    data.add_load(30, 0x1234, True)
+    vertex = graph.add_vertex()
+    node_data[vertex] = data
+
+    view = node_data[vertex]
+    assert view.cap == data.cap
+    assert view.cap.bound == data.cap.bound
+    assert view.pc == data.pc
+    assert view.origin == CheriNodeOrigin.SETBOUNDS
+    assert view.is_kernel
+    assert dict(view.address.items()) == data.address
+    assert view.deref == data.deref
+    assert str(view) == str(data)
+
+
+def test_view_update(graph):
+    # changes to the view are stored in the graph
+    node_data = NodeDataMap(graph)
+    vertex = graph.add_vertex()
+    node_data[vertex] = make_data(0x1000, 0x100, 0)
+
+    view = node_data[vertex]
+    view.origin = CheriNodeOrigin.PTR_SETBOUNDS
+    view.cap.t_free = 50
+    view.address[20] = 0x2000
+    view.address[25] = 0x3000
+    view.address[20] = 0x4000
+    view.add_store(30, 0x1010, False)
+
+    other = NodeDataMap(graph)[vertex]
+    assert other.origin == CheriNodeOrigin.PTR_SETBOUNDS
+    assert other.cap.t_free == 50
+    assert other.address.items() == [(20, 0x4000), (25, 0x3000)]
+    assert other.deref["type"] == [NodeData.DerefType.DEREF_STORE]
+
+    cap = copy(other.cap)
+    other.cap.base = 0
+    assert type(cap) is CheriCap
+    assert cap.base == 0x1000
+
+
+def test_empty_node(graph):
+    # nodes without capability have the default NodeData values
+    node_data = NodeDataMap(graph)
+    vertex = graph.add_vertex()
+    node_data[vertex] = NodeData()
+    view = node_data[vertex]
+    assert view.cap.t_alloc == -1
+    assert view.cap.t_free == -1
+    assert view.origin == CheriNodeOrigin.UNKNOWN
+    assert len(view.address) == 0
+
+
+@pytest.mark.parametrize("spill", [False, True])
+def test_event_log(tmpdir, spill):
+    # events are grouped by node in append order across chunks
+    log = ProvenanceEventLog(chunk_size=3)
+    if spill:
+        log.spill(str(tmpdir.join("events")))
+    store = ProvenanceEventLog.ADDRESS
+    load = NodeData.DerefType.DEREF_LOAD
+    log.append(1, 10, 0x1000, True, store)
+    log.append(0, 11, 0x2000, False, load)
+    log.append(1, 12, 0xffffffffffff0000, False, load)
+    log.append(0, 13, 0x3000, True, store)
+    assert len(log) == 4
+    assert log.node_events(1)["time"].tolist() == [10, 12]
+    assert log.node_events(1, address=False)["addr"].tolist() == [
+        0xffffffffffff0000]
+    assert log.node_events(0, address=True)["addr"].tolist() == [0x3000]
+    log.append(1, 14, 0x4000, True, store)
+    assert log.node_events(1, address=True)["time"].tolist() == [10, 14]
+    assert log.events()["node"].tolist() == [1, 0, 1, 0, 1]
+    assert len(log.node_events(2)) == 0
+
+    restored = pickle.loads(pickle.dumps(log))
+    assert restored.spill_path is None
+    assert (restored.events() == log.events()).all()
+
+
+def test_deref_stats():
+    # dereferences update the statistics instead of the event log
+    graph = Graph(directed=True)
+    node_map = NodeDataMap(graph, deref_stats=True)
+    hot = node_map.add_vertex(make_data(0xffffffff80000000, 0x80, 0))
+    cold = node_map.add_vertex(make_data(0x1000, 0x100, 0))
+    hot_data = node_map[hot]
+    hot_data.add_load(20, 0xffffffff80000070, False)
+    hot_data.add_store(15, 0xffffffff80000008, False)
+    hot_data.add_load(30, 0xffffffff80000010, True)
+    assert len(node_map.events) == 0
+    assert NodeDataMap(graph).deref_stats
+    assert node_map.deref_count().tolist() == [3, 0]
+    assert node_map.array("n_load").tolist() == [2, 0]
+    assert node_map.array("n_store").tolist() == [1, 0]
+    assert node_map.array("t_first_deref")[0] == 15
+    assert node_map.array("t_last_deref")[0] == 30
+    assert (node_map.array("deref_min").view("u8")[0] ==
+            0xffffffff80000008)
+    assert (node_map.array("deref_max").view("u8")[0] ==
+            0xffffffff80000070)
+    hist = [node_map.array("deref_hist_%d" % idx)[0]
+            for idx in range(NodeDataMap.DEREF_BUCKETS)]
+    assert hist == [1, 1, 0, 0, 0, 0, 0, 1]
+    # the node never dereferenced keeps empty statistics
+    assert node_map.array("t_first_deref")[int(cold)] == 0
+    assert node_map.array("t_last_deref")[int(cold)] == 0
+    assert node_map.array("deref_min")[int(cold)] == 0
+    assert node_map.array("deref_max")[int(cold)] == 0
+    hist = [node_map.array("deref_hist_%d" % idx)[int(cold)]
+            for idx in range(NodeDataMap.DEREF_BUCKETS)]
+    assert hist == [0] * NodeDataMap.DEREF_BUCKETS
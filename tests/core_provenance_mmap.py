@@ -0,0 +1,115 @@
+"""
+Test the memory-mapped format of the provenance graph
+"""
+
+import pytest
+import numpy as np
+
+from graph_tool.all import Graph
+
+from cheriplot.core.provenance import CheriNodeOrigin, NodeDataMap
+from cheriplot.core.provenance_mmap import (
+    MappedProvenanceGraph, save_mapped_graph)
+
+from provenance_helpers import edges, make_data
+
+
+@pytest.fixture
+def graph():
+    graph = Graph(directed=True)
+    node_data = NodeDataMap(graph)
+    root = node_data.add_vertex(make_data(0x1000, 0x1000))
+    child = node_data.add_vertex(make_data(0x1100, 0x10), root)
+    other = node_data.add_vertex(make_data(0xffffffffffff0000, 0x100))
+    node_data.add_vertex(make_data(0x1100, 0x8), child)
+    node_data[child].address[20] = 0x3000
+    node_data[root].add_load(25, 0x1010, False)
+    node_data[child].add_store(30, 0x1100, True)
+    node_data[root].address[35] = 0x4000
+    node_data[root].add_call(40, 0x1000, False)
+    return graph
+
+
+def test_mapped_roundtrip(graph, tmpdir):
+    path = str(tmpdir.join("graph"))
+    save_mapped_graph(graph, path)
+    mapped = MappedProvenanceGraph(path)
+    node_data = NodeDataMap(graph)
+    mapped_data = NodeDataMap(mapped)
+
+    assert mapped.num_vertices() == 4
+    assert list(mapped.vertices()) == [0, 1, 2, 3]
+    assert edges(mapped) == [(0, 1), (1, 3)]
+    for vertex in range(4):
+        assert mapped_data[vertex].cap == node_data[vertex].cap
+        assert mapped_data[vertex].origin == CheriNodeOrigin.SETBOUNDS
+    assert mapped_data[2].cap.base == 0xffffffffffff0000
+    assert mapped_data[1].address.items() == [(20, 0x3000)]
+    assert mapped_data[0].address.items() == [(35, 0x4000)]
+    assert mapped_data[0].deref["time"] == [25, 40]
+    assert mapped_data[1].deref["is_cap"] == [True]
+    assert len(mapped_data.events) == len(node_data.events)
+    assert mapped.gp["next_gid"] == 4
+
+    # the graph is rebuilt with the same content
+    rebuilt = mapped.to_graph()
+    rebuilt_data = NodeDataMap(rebuilt)
+    assert edges(rebuilt) == [(0, 1), (1, 3)]
+    for name, value_type in node_data.columns:
+        assert (rebuilt_data.array(name).tolist() ==
+                node_data.array(name).tolist())
+    assert rebuilt_data[0].deref["time"] == [25, 40]
+
+
+def test_mapped_lazy(graph, tmpdir):
+    # only the properties that are accessed are mapped and
+    # changes are not written back to the files
+    path = str(tmpdir.join("graph"))
+    save_mapped_graph(graph, path)
+    mapped = MappedProvenanceGraph(path)
+    assert mapped.vp["base"].a[0] == 0x1000
+    assert set(mapped._arrays) == {"base"}
+
+    mapped_data = NodeDataMap(mapped)
+    mapped_data[0].origin = CheriNodeOrigin.PTR_SETBOUNDS
+    assert mapped_data[0].origin == CheriNodeOrigin.PTR_SETBOUNDS
+    assert NodeDataMap(MappedProvenanceGraph(path))[0].origin == (
+        CheriNodeOrigin.SETBOUNDS)
+    with pytest.raises(TypeError):
+        mapped_data[0].address[50] = 0x1000
+
+
+def test_mapped_filter(graph, tmpdir):
+    # the vertex filter is saved and new edges are kept in memory
+    vertex_filter = graph.new_vertex_property("bool")
+    vertex_filter.a = [False, True, False, False]
+    graph.set_vertex_filter(vertex_filter, inverted=True)
+    path = str(tmpdir.join("graph"))
+    save_mapped_graph(graph, path)
+
+    mapped = MappedProvenanceGraph(path)
+    assert mapped.num_vertices() == 3
+    assert mapped.num_vertices(ignore_filter=True) == 4
+    assert list(mapped.vertices()) == [0, 2, 3]
+    assert edges(mapped) == []
+    mapped.add_edge_list(np.array([[0, 3]]))
+    assert edges(mapped) == [(0, 3)]
+    mapped.set_vertex_filter(None)
+    assert edges(mapped) == [(0, 1), (0, 3), (1, 3)]
+
+    rebuilt = MappedProvenanceGraph(path).to_graph()
+    assert NodeDataMap(rebuilt).vertex_mask().tolist() == [
+        True, False, True, True]
+
+
+def test_mapped_deref_stats(tmpdir):
+    graph = Graph(directed=True)
+    node_data = NodeDataMap(graph, deref_stats=True)
+    root = node_data.add_vertex(make_data(0x1000, 0x1000))
+    node_data[root].add_load(25, 0x1010, False)
+    path = str(tmpdir.join("graph"))
+    save_mapped_graph(graph, path)
+
+    mapped_data = NodeDataMap(MappedProvenanceGraph(path))
+    assert mapped_data.deref_stats
+    assert mapped_data.array("n_load").tolist() == [1]
@@ -0,0 +1,101 @@
+"""
+Test the on-disk provenance graph store and the streaming mode
+of the provenance parser
+"""
+
+import numpy as np
+from unittest import mock
+
+from graph_tool.all import Graph
+
+from cheriplot.core.provenance import NodeDataMap
+from cheriplot.core.provenance_store import (
+    ProvenanceGraphWriter, load_provenance_graph)
+from cheriplot.plot.provenance.parser import PointerProvenanceParser
+
+from provenance_helpers import edges, make_data
+
+
+def test_store_roundtrip(tmpdir):
+    # the nodes are loaded in global id order whatever the write order
+    graph = Graph(directed=True)
+    node_data = NodeDataMap(graph)
+    root = node_data.add_vertex(make_data(0x1000, 0x1000))
+    child = node_data.add_vertex(make_data(0x1100, 0x10), root)
+    other = node_data.add_vertex(make_data(0xffffffffffff0000, 0x100))
+    node_data[child].address[20] = 0x3000
+    node_data[root].add_load(25, 0x1010, False)
+
+    path = str(tmpdir.join("store"))
+    writer = ProvenanceGraphWriter(path)
+    gids = node_data.array("gid")
+    writer.write_nodes(node_data, np.array([1]))
+    writer.write_nodes(node_data, np.array([0, 2]))
+    writer.write_events(node_data.events.events(), gids)
+    writer.close()
+
+    loaded = load_provenance_graph(path)
+    loaded_data = NodeDataMap(loaded)
+    assert loaded.num_vertices() == 3
+    assert edges(loaded) == [(0, 1)]
+    for vertex in range(3):
+        assert loaded_data[vertex].cap == node_data[vertex].cap
+    # the root written after its sibling keeps its global id
+    assert loaded_data[int(other)].cap.base == 0xffffffffffff0000
+    assert loaded.vertex(int(other)).in_degree() == 0
+    assert loaded_data[1].address.items() == [(20, 0x3000)]
+    assert loaded_data[0].deref["time"] == [25]
+    assert loaded.gp["next_gid"] == 3
+
+
+def test_store_deref_stats(tmpdir):
+    # the dereference statistics columns are stored when enabled
+    graph = Graph(directed=True)
+    node_data = NodeDataMap(graph, deref_stats=True)
+    root = node_data.add_vertex(make_data(0x1000, 0x1000))
+    node_data[root].add_load(25, 0x1010, False)
+
+    path = str(tmpdir.join("store"))
+    writer = ProvenanceGraphWriter(path)
+    writer.write_nodes(node_data, np.array([0]))
+    writer.write_events(node_data.events.events(), node_data.array("gid"))
+    writer.close()
+
+    loaded_data = NodeDataMap(load_provenance_graph(path))
+    assert loaded_data.deref_stats
+    assert loaded_data.array("n_load").tolist() == [1]
+    assert loaded_data.array("deref_min").tolist() == [0x1010]
+
+
+def test_stream_flush(tmpdir):
+    # nodes not referenced by the register set or memory are flushed
+    graph = Graph(directed=True)
+    with mock.patch("os.path.exists"), mock.patch("pycheritrace.trace"):
+        parser = PointerProvenanceParser(graph, "no_file")
+    path = str(tmpdir.join("store"))
+    parser.stream_to(path)
+    node_data = parser.node_data
+    root = node_data.add_vertex(make_data(0x1000, 0x1000))
+    dead = node_data.add_vertex(make_data(0x1100, 0x100), root)
+    live = node_data.add_vertex(make_data(0x1110, 0x10), dead)
+    node_data[dead].address[10] = 0x8000
+    node_data[live].add_load(12, 0x1118, False)
+    parser.regset[3] = live
+    parser.regset.memory_map[0x8000] = root
+
+    parser.flush_nodes()
+    assert graph.num_vertices() == 2
+    assert node_data[parser.regset[3]].cap.base == 0x1110
+    assert node_data[parser.regset[3]].deref["time"] == [12]
+    assert node_data[parser.regset.memory_map[0x8000]].cap.base == 0x1000
+
+    parser.flush_nodes(keep_live=False)
+    parser.writer.close()
+    assert graph.num_vertices() == 0
+    loaded = load_provenance_graph(path)
+    loaded_data = NodeDataMap(loaded)
+    assert [loaded_data[v].cap.base for v in range(3)] == [
+        0x1000, 0x1100, 0x1110]
+    assert edges(loaded) == [(0, 1), (1, 2)]
+    assert loaded_data[1].address.items() == [(10, 0x8000)]
+    assert loaded_data[2].deref["time"] == [12]
@@ -0,0 +1,76 @@
+"""
+Test the interval tree backed RangeSet
+"""
+
+import pickle
+import random
+
+import numpy as np
+
+from cheriplot.core.addrspace_axes import RangeSet, Range
+
+
+def _overlaps(ranges, target):
+    return sorted([r for r in ranges if (r.start < target.end and
+                                         r.end > target.start)],
+                  key=lambda r: r.start)
+
+
+def test_overlap():
+    r_a = Range(0x1000, 0x2000)
+    r_b = Range(0x1800, 0x4000)
+    r_c = Range(0x4000, 0x5000)
+    ranges = RangeSet([r_c, r_a, r_b])
+    # iteration is sorted by start
+    assert list(ranges) == [r_a, r_b, r_c]
+    assert ranges.match_overlap_range(Range(0x1900, 0x4001)) == [r_a, r_b, r_c]
+    # contiguous ranges do not overlap
+    assert ranges.match_overlap_range(Range(0x5000, 0x6000)) == []
+    assert ranges.match_overlap(0x1800) == [r_a, r_b]
+    assert ranges.first_overlap_range(Range(0x3000, 0x4800)) == r_b
+    assert ranges.pop_overlap_range(Range(0x3000, 0x4800)) == r_b
+    assert ranges.first_overlap_range(Range(0x3000, 0x4800)) == r_c
+    assert ranges.pop_overlap_range(Range(0x2000, 0x4000)) is None
+    assert len(ranges) == 2
+    assert r_b not in ranges
+
+
+def test_unbounded():
+    ranges = RangeSet()
+    r_all = Range(0, np.inf, Range.T_OMIT)
+    ranges.append(r_all)
+    ranges.append(Range(0x1000, 0x2000))
+    assert ranges.match_overlap_range(Range(0x10000, 0x20000)) == [r_all]
+    ranges.remove(r_all)
+    assert ranges.match_overlap_range(Range(0x10000, 0x20000)) == []
+
+
+def test_random():
+    rnd = random.Random(1)
+    expect = []
+    ranges = RangeSet()
+    for _ in range(2000):
+        start = rnd.randrange(0x10000)
+        target = Range(start, start + rnd.randrange(0x1000))
+        if rnd.random() < 0.5:
+            expect.append(target)
+            ranges.append(target)
+        elif rnd.random() < 0.5:
+            r = ranges.pop_overlap_range(target)
+            if r is None:
+                assert _overlaps(expect, target) == []
+            else:
+                assert r.start == _overlaps(expect, target)[0].start
+                expect.remove(r)
+        else:
+            got = ranges.match_overlap_range(target)
+            assert set(map(id, got)) == set(map(id, _overlaps(expect, target)))
+            assert [r.start for r in got] == sorted(r.start for r in got)
+        assert len(ranges) == len(expect)
+
+
+def test_pickle():
+    ranges = RangeSet([Range(0x3000, 0x4000), Range(0x1000, 0x2000)])
+    loaded = pickle.loads(pickle.dumps(ranges))
+    assert [tuple(r) for r in loaded] == [(0x1000, 0x2000), (0x3000, 0x4000)]
+    assert len(loaded.match_overlap(0x1000)) == 1
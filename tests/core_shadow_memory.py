@@ -0,0 +1,60 @@
+"""
+Test the capability shadow memory
+"""
+
+import numpy as np
+
+from cheriplot.core.shadow_memory import ShadowMemory
+
+
+def test_slots():
+    shadow = ShadowMemory()
+    assert shadow[0x1000] == ShadowMemory.EMPTY
+    shadow[0x1020] = 3
+    shadow[0x5000] = 4
+    # any address in the slot maps to the same node
+    assert shadow[0x1028] == 3
+    assert shadow[0x1000] == ShadowMemory.EMPTY
+    assert shadow[0x1040] == ShadowMemory.EMPTY
+    assert len(shadow) == 2
+    assert len(shadow.pages) == 2
+    assert shadow.items() == [(0x1020, 3), (0x5000, 4)]
+
+    # a data store in the slot invalidates it
+    shadow.clear(0x1030)
+    assert shadow[0x1020] == ShadowMemory.EMPTY
+    assert shadow.items() == [(0x5000, 4)]
+
+    # data stores to pages without capabilities allocate nothing
+    shadow.clear(0x9000)
+    assert shadow[0x9000] == ShadowMemory.EMPTY
+    assert len(shadow.pages) == 2
+
+
+def test_nodes_remap():
+    shadow = ShadowMemory()
+    shadow[0x1000] = 1
+    shadow[0x1020] = 1
+    shadow[0x2000] = 3
+    assert shadow.nodes().tolist() == [1, 3]
+    remap = np.array([-1, 0, -1, 1])
+    shadow.remap(remap)
+    assert shadow.items() == [(0x1000, 0), (0x1020, 0), (0x2000, 1)]
+    shadow.remap(np.array([-1, 0]))
+    assert shadow.items() == [(0x2000, 0)]
+
+
+def test_update():
+    shadow = ShadowMemory()
+    shadow[0x1000] = 5
+    shadow[0x1020] = 6
+    shadow[0x1040] = 7
+    chunk = ShadowMemory(default=ShadowMemory.UNKNOWN)
+    assert chunk[0x1000] == ShadowMemory.UNKNOWN
+    chunk[0x1020] = 0
+    chunk.clear(0x1040)
+    assert chunk[0x1040] == ShadowMemory.EMPTY
+    chunk[0x8000] = 1
+    shadow.update(chunk, np.array([10, 11]))
+    # unknown slots of the chunk keep the previous content
+    assert shadow.items() == [(0x1000, 5), (0x1020, 10), (0x8000, 11)]
@@ -0,0 +1,140 @@
+"""
+Micro-benchmarks for the core parser hot paths.
+
+These do not need a trace file, the parser is built with mocked
+pycheritrace objects as in the core parser tests.
+Run with: python tests/parser_benchmark.py
+"""
+
+import timeit
+from unittest import mock
+
+from cheriplot.core import CallbackTraceParser
+
+# opcode distribution roughly similar to a pure-capability trace
+opcode_mix = (["daddiu"] * 8 + ["ld"] * 4 + ["sd"] * 4 + ["clc"] * 2 +
+              ["csc"] * 2 + ["cincoffset"] * 3 + ["csetbounds"] + ["beq"] * 4)
+
+
+class _BenchParser(CallbackTraceParser):
+
+    def scan_csetbounds(self, inst, entry, regs, last_regs, idx):
+        return False
+
+    def scan_cap_load(self, inst, entry, regs, last_regs, idx):
+        return False
+
+    def scan_clc(self, inst, entry, regs, last_regs, idx):
+        return False
+
+
+class _Inst:
+    """Minimal stand-in for :class:`cheriplot.core.parser.Instruction`."""
+
+    def __init__(self, opcode):
+        self.opcode = opcode
+
+
+def _legacy_get_callbacks(parser, inst):
+    """Callback lookup as it was done before the dispatch table."""
+    callbacks = list(parser._callbacks.get("all", []))
+    callbacks = parser._callbacks.get(inst.opcode, []) + callbacks
+    return callbacks
+
+
+@mock.patch("os.path.exists")
+@mock.patch("pycheritrace.trace")
+def make_parser(mock_trace, mock_exists):
+    return _BenchParser(mock.Mock(), "no_file")
+
+
+def bench_dispatch(n_entries=10**6):
+    """
+    Compare the per-entry cost of the callback lookup
+    before and after the dispatch table.
+    """
+    parser = make_parser()
+    insts = [_Inst(op) for op in opcode_mix]
+    stream = insts * (n_entries // len(insts))
+
+    def legacy():
+        for inst in stream:
+            for cbk in _legacy_get_callbacks(parser, inst):
+                pass
+
+    def dispatch():
+        for inst in stream:
+            callbacks = parser._get_callbacks(inst)
+            if not callbacks:
+                continue
+            for cbk in callbacks:
+                pass
+
+    t_legacy = min(timeit.repeat(legacy, number=1, repeat=3))
+    t_dispatch = min(timeit.repeat(dispatch, number=1, repeat=3))
+    print("dispatch: legacy %.1f ns/entry, table %.1f ns/entry" % (
+        t_legacy * 1e9 / len(stream), t_dispatch * 1e9 / len(stream)))
+
+
+class _Cap:
+    def __init__(self, base):
+        self.base = base
+        self.length = 0x100
+        self.offset = 0
+        self.permissions = 0xffff
+        self.type = 0
+        self.valid = True
+        self.unsealed = True
+
+
+class _Regs:
+    def __init__(self, value):
+        self.cap_reg = [_Cap(value + reg) for reg in range(32)]
+
+
+class _Entry:
+    def __init__(self, capreg):
+        self.capreg = capreg
+
+    def capreg_number(self):
+        return self.capreg
+
+
+def bench_clc(n_entries=10**6):
+    """
+    Compare the per-entry cost of the clc commit check done by
+    building and comparing capability objects with the written
+    register check of the core parser, for entries with and without
+    the written register number.
+    """
+    from cheriplot.core.provenance import CheriCap
+
+    parser = make_parser()
+    regs = [_Regs(value) for value in range(64)]
+    stream = [(_Entry(idx % 32), idx % 32, regs[idx % 64],
+               regs[(idx + 1) % 64]) for idx in range(n_entries)]
+    unrecorded = [(_Entry(-1), cd, last, curr)
+                  for _, cd, last, curr in stream]
+
+    def legacy():
+        for entry, cd, last_regs, regs in stream:
+            CheriCap(last_regs.cap_reg[cd]) != CheriCap(regs.cap_reg[cd])
+
+    def written(entries):
+        def _run():
+            for entry, cd, last_regs, regs in entries:
+                parser._capreg_written(entry, regs, last_regs, cd)
+        return _run
+
+    t_legacy = min(timeit.repeat(legacy, number=1, repeat=3))
+    t_recorded = min(timeit.repeat(written(stream), number=1, repeat=3))
+    t_fields = min(timeit.repeat(written(unrecorded), number=1, repeat=3))
+    print("clc commit: CheriCap %.1f ns/entry, register number %.1f ns/entry,"
+          " raw fields %.1f ns/entry" % (
+              t_legacy * 1e9 / n_entries, t_recorded * 1e9 / n_entries,
+              t_fields * 1e9 / n_entries))
+
+
+if __name__ == "__main__":
+    bench_dispatch()
+    bench_clc()
@@ -0,0 +1,111 @@
+"""
+Benchmark for the post-processing of the provenance graph.
+
+The graph is generated randomly, no trace file is needed.
+The vectorized passes of :meth:`PointerProvenancePlot.build_dataset`
+are checked against the per-vertex loops they replace.
+Run with: python tests/provenance_benchmark.py
+"""
+
+import random
+import timeit
+
+from cheriplot.core.provenance import CheriNodeOrigin
+from cheriplot.plot.provenance.provenance_plot import PointerProvenancePlot
+
+from provenance_helpers import make_graph, filtered_state
+
+origin_mix = ([CheriNodeOrigin.ROOT] + [CheriNodeOrigin.SETBOUNDS] * 4 +
+              [CheriNodeOrigin.FROMPTR] * 3 + [CheriNodeOrigin.ANDPERM])
+
+
+def make_random_graph(n_nodes, seed=1):
+    """
+    Generate a random provenance tree with kernel nodes, null
+    capabilities and cfromptr -> csetbounds sequences.
+    """
+    rnd = random.Random(seed)
+    columns = {
+        "origin": [rnd.choice(origin_mix) for _ in range(n_nodes)],
+        "pc": [rnd.choice([0, 0x400000]) for _ in range(n_nodes)],
+        "is_kernel": [rnd.random() < 0.1 for _ in range(n_nodes)],
+        "base": [rnd.choice([0, 0x1000]) for _ in range(n_nodes)],
+        "length": [rnd.choice([0, 0x100, 0x100, 0x100])
+                   for _ in range(n_nodes)],
+    }
+    edges = [(rnd.randrange(max(0, node - 50), node), node)
+             for node in range(1, n_nodes) if rnd.random() < 0.9]
+    return make_graph(columns, edges)
+
+
+def _legacy_filter(plot):
+    """Post-processing of build_dataset as it was done before."""
+    vertex_mask = plot.dataset.new_vertex_property("bool")
+
+    vertex_data = plot.node_data
+    for node in plot.dataset.vertices():
+        node_data = vertex_data[node]
+        if ((node_data.pc != 0 and node_data.is_kernel) or
+            (node_data.cap.length == 0 and node_data.cap.base == 0)):
+            vertex_mask[node] = True
+
+    plot.dataset.set_vertex_filter(vertex_mask, inverted=True)
+    vertex_mask = plot.dataset.copy_property(vertex_mask)
+
+    for node in plot.dataset.vertices():
+        num_parents = node.in_degree()
+        if num_parents == 0:
+            continue
+        elif num_parents > 1:
+            raise RuntimeError("Too many parents for a node")
+
+        parent = next(node.in_neighbours())
+        parent_data = vertex_data[parent]
+        node_data = vertex_data[node]
+        if (parent_data.origin == CheriNodeOrigin.FROMPTR and
+            node_data.origin == CheriNodeOrigin.SETBOUNDS):
+            node_data.origin = CheriNodeOrigin.PTR_SETBOUNDS
+            if parent.in_degree() == 1:
+                next_parent = next(parent.in_neighbours())
+                vertex_mask[parent] = True
+                plot.dataset.add_edge(next_parent, node)
+            elif parent.in_degree() == 0:
+                vertex_mask[parent] = True
+            else:
+                raise RuntimeError("Too many parents for a node")
+    plot.dataset.set_vertex_filter(vertex_mask, inverted=True)
+    vertex_mask = plot.dataset.copy_property(vertex_mask)
+
+    for node in plot.dataset.vertices():
+        node_data = vertex_data[node]
+        if node_data.origin == CheriNodeOrigin.FROMPTR:
+            vertex_mask[node] = True
+
+    plot.dataset.set_vertex_filter(vertex_mask, inverted=True)
+
+
+def make_plot(graph):
+    plot = PointerProvenancePlot.__new__(PointerProvenancePlot)
+    plot.dataset = graph
+    return plot
+
+
+def bench_filter(n_nodes=10**5):
+    """
+    Compare the per-vertex loops of the post-processing with the
+    vectorized passes and check that the filtered graphs match.
+    """
+    legacy_plot = make_plot(make_random_graph(n_nodes))
+    vector_plot = make_plot(make_random_graph(n_nodes))
+
+    t_legacy = timeit.timeit(lambda: _legacy_filter(legacy_plot), number=1)
+    t_vector = timeit.timeit(vector_plot._filter_dataset, number=1)
+    expect = filtered_state(legacy_plot.dataset)
+    assert filtered_state(vector_plot.dataset) == expect
+    print("build_dataset filter: %d of %d nodes visible, legacy %.1f ms, "
+          "vectorized %.1f ms" % (len(expect["vertices"]), n_nodes,
+                                  t_legacy * 1e3, t_vector * 1e3))
+
+
+if __name__ == "__main__":
+    bench_filter()
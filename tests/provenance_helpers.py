@@ -0,0 +1,70 @@
+"""
+Helpers shared by the provenance graph tests and benchmarks
+"""
+
+import numpy as np
+
+from graph_tool.all import Graph
+
+from cheriplot.core.provenance import (
+    CheriCap, CheriNodeOrigin, NodeData, NodeDataMap)
+
+
+def make_data(base, length, offset=0):
+    """Data of a kernel node created by csetbounds."""
+    data = NodeData()
+    data.cap = CheriCap()
+    data.cap.base = base
+    data.cap.length = length
+    data.cap.offset = offset
+    data.cap.permissions = 0xffff
+    data.cap.objtype = 0
+    data.cap.valid = True
+    data.cap.t_alloc = 10
+    data.pc = 0xffffffff80001000
+    data.origin = CheriNodeOrigin.SETBOUNDS
+    data.is_kernel = True
+    return data
+
+
+def edges(graph):
+    """Sorted (parent, child) vertex pairs of the graph."""
+    return sorted(map(tuple, np.asarray(graph.get_edges()).tolist()))
+
+
+def make_graph(columns, edges):
+    """
+    Build a provenance graph from its property columns.
+
+    :param columns: map property names to the value of each vertex,
+    the other properties are zero and the global ids follow the
+    vertex order
+    :type columns: dict
+    :param edges: list of (parent, child) vertex pairs
+    :type edges: list
+    :return: the provenance graph
+    :rtype: :class:`graph_tool.Graph`
+    """
+    n_nodes = len(next(iter(columns.values())))
+    graph = Graph(directed=True)
+    node_data = NodeDataMap(graph)
+    graph.add_vertex(n_nodes)
+    node_data.array("gid")[:] = np.arange(n_nodes)
+    graph.gp["next_gid"] = n_nodes
+    for name, values in columns.items():
+        node_data.array(name)[:] = values
+    graph.add_edge_list(edges)
+    return graph
+
+
+def filtered_state(graph):
+    """Comparable content of the filtered graph."""
+    node_data = NodeDataMap(graph)
+    visible = node_data.vertex_mask()
+    edges = graph.get_edges()
+    edges = edges[visible[edges[:, 0]] & visible[edges[:, 1]]]
+    return {
+        "vertices": np.flatnonzero(visible).tolist(),
+        "origin": node_data.array("origin")[visible].tolist(),
+        "edges": sorted(map(tuple, edges.tolist())),
+    }
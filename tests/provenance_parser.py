@@ -0,0 +1,452 @@
+"""
+Test the parallel construction of the provenance graph against
+the sequential parser
+"""
+
+import pytest
+import pickle
+import random
+from contextlib import contextmanager
+from unittest import mock
+
+from graph_tool.all import Graph
+
+import cheriplot.core.parser as core_parser
+from cheriplot.core.parser import (
+    CallbackTraceParser, CompositeTraceParser, ParallelTraceParser)
+from cheriplot.core.provenance import CheriNodeOrigin, NodeDataMap
+from cheriplot.core.provenance_store import load_provenance_graph
+from cheriplot.plot.provenance.parser import PointerProvenanceParser
+
+# registers that always hold a node and registers that can be cleared
+# by loading an invalid capability
+PTR_REGS = [1, 2, 3, 4, 5]
+NULL_REGS = [6, 7, 8]
+ADDRESSES = [0x1000 + 0x20 * i for i in range(12)]
+
+
+class _OpInfo:
+    def __init__(self, register_number=None, immediate=None):
+        self.is_register = register_number is not None
+        self.is_immediate = immediate is not None
+        self.register_number = register_number
+        self.immediate = immediate
+
+
+class _Disasm:
+    def __init__(self, opcode, operands):
+        self.name = "\t%s\t" % opcode
+        self.operands = operands
+
+
+def cap(n):
+    return _OpInfo(register_number=64 + n)
+
+
+def gpr(n):
+    return _OpInfo(register_number=n)
+
+
+def imm(value):
+    return _OpInfo(immediate=value)
+
+
+class _FakeCap:
+    def __init__(self, idx, reg, valid=True):
+        self.base = 0x10000 * idx + 0x100 * reg
+        self.length = 0x100
+        self.offset = 0
+        self.permissions = 0xffff
+        self.type = 0
+        self.valid = valid
+        self.unsealed = False
+
+
+class _FakeRegs:
+    def __init__(self, idx, invalid=None):
+        self.gpr = [0] * 31
+        self.valid_gprs = [True] * 31
+        self.cap_reg = [_FakeCap(idx, reg, reg != invalid)
+                        for reg in range(32)]
+        self.valid_caps = [True] * 32
+
+
+class _FakeEntry:
+    def __init__(self, idx, inst, exception=31, memory_address=0,
+                 is_load=False, is_store=False, capreg=-1):
+        self.inst = inst
+        self.cycles = idx * 2
+        self.pc = 0x400000 + idx * 4
+        self.exception = exception
+        self.memory_address = memory_address
+        self.is_load = is_load
+        self.is_store = is_store
+        self.capreg = capreg
+
+    def capreg_number(self):
+        return self.capreg
+
+    def is_kernel(self):
+        return False
+
+
+def make_trace(n_entries, seed):
+    """
+    Generate a random trace, return the instruction table and a list of
+    (entry, regs) tuples.
+    """
+    rnd = random.Random(seed)
+    instructions = [("eret", [])]
+    trace = [(_FakeEntry(0, 0), _FakeRegs(0))]
+
+    def emit(idx, opcode, operands, **kwargs):
+        invalid = kwargs.pop("invalid", None)
+        instructions.append((opcode, operands))
+        entry = _FakeEntry(idx, len(instructions) - 1, **kwargs)
+        trace.append((entry, _FakeRegs(idx, invalid)))
+
+    for idx in range(1, n_entries):
+        kind = rnd.choice(["csetbounds", "cfromptr", "cmove", "csc", "clc",
+                           "clc_invalid", "cld", "csd", "cgetdefault",
+                           "csetdefault", "cjalr", "eret", "exception"])
+        ptr = rnd.choice(PTR_REGS)
+        addr = rnd.choice(ADDRESSES)
+        if kind == "csetbounds":
+            emit(idx, kind, [cap(rnd.choice(PTR_REGS)), cap(ptr), gpr(2)])
+        elif kind == "cfromptr":
+            emit(idx, kind, [cap(rnd.choice(PTR_REGS)), cap(ptr), gpr(2)])
+        elif kind == "cmove":
+            dst, src = rnd.choice([(PTR_REGS, PTR_REGS),
+                                   (NULL_REGS, NULL_REGS + PTR_REGS)])
+            emit(idx, kind, [cap(rnd.choice(dst)), cap(rnd.choice(src))])
+        elif kind == "csc":
+            src = rnd.choice(PTR_REGS + NULL_REGS)
+            emit(idx, kind, [cap(src), gpr(0), imm(0), cap(ptr)],
+                 memory_address=addr, is_store=True)
+        elif kind == "clc":
+            dst = rnd.choice(PTR_REGS)
+            # the written register is not recorded in some entries
+            emit(idx, kind, [cap(dst), gpr(0), imm(0), cap(ptr)],
+                 memory_address=addr, is_load=True,
+                 capreg=rnd.choice([dst, -1]))
+        elif kind == "clc_invalid":
+            dst = rnd.choice(NULL_REGS)
+            emit(idx, "clc", [cap(dst), gpr(0), imm(0), cap(ptr)],
+                 memory_address=addr, is_load=True, invalid=dst)
+        elif kind == "cld":
+            emit(idx, kind, [gpr(2), gpr(0), imm(0), cap(ptr)],
+                 memory_address=addr, is_load=True)
+        elif kind == "csd":
+            emit(idx, kind, [gpr(2), gpr(0), imm(0), cap(ptr)],
+                 memory_address=addr + rnd.choice([0, 8, 16, 24]),
+                 is_store=True)
+        elif kind == "cgetdefault":
+            emit(idx, kind, [cap(rnd.choice(PTR_REGS))])
+        elif kind == "csetdefault":
+            emit(idx, kind, [cap(rnd.choice(NULL_REGS))])
+        elif kind == "cjalr":
+            emit(idx, kind, [cap(rnd.choice(NULL_REGS)), cap(ptr)])
+        elif kind == "eret":
+            emit(idx, kind, [])
+        else:
+            emit(idx, "daddiu", [gpr(2), gpr(2), imm(1)], exception=8)
+    return instructions, trace
+
+
+@contextmanager
+def mock_trace(instructions, entries):
+    """Serve the given trace entries from the mocked pycheritrace."""
+
+    def disassemble(word):
+        opcode, operands = instructions[word]
+        return _Disasm(opcode, operands)
+
+    def scan(callback, start, end, direction):
+        for idx in range(start, min(end, len(entries) - 1) + 1):
+            entry, regs = entries[idx]
+            if callback(entry, regs, idx):
+                break
+
+    with mock.patch("pycheritrace.disassembler") as mock_dis, \
+         mock.patch("os.path.exists"), \
+         mock.patch("pycheritrace.trace") as mock_trace:
+        mock_dis.return_value.disassemble.side_effect = disassemble
+        mock_trace.open.return_value.size.return_value = len(entries)
+        mock_trace.open.return_value.scan.side_effect = scan
+        yield
+
+
+@pytest.fixture(params=[1, 2, 3])
+def trace(request):
+    instructions, entries = make_trace(300, request.param)
+    with mock_trace(instructions, entries):
+        yield len(entries)
+
+
+def graph_state(parser):
+    """Comparable content of the graph and state of a parser."""
+    graph = parser.dataset
+    node_data = NodeDataMap(graph)
+    props = {name: node_data.array(name).tolist()
+             for name, value_type in node_data.columns}
+    edges = sorted((int(e.source()), int(e.target()))
+                   for e in graph.edges())
+
+    def node_id(node):
+        return None if node is None else int(node)
+
+    return {
+        "props": props,
+        "edges": edges,
+        "events": node_data.events.events().tolist(),
+        "reg_nodes": [node_id(n) for n in parser.regset.reg_nodes],
+        "pcc": node_id(parser.regset.pcc),
+        "memory_map": {addr: node_id(n) for addr, n in
+                       parser.regset.memory_map.items()},
+    }
+
+
+def parse_parallel(n_entries, n_chunks, store=None, **kwargs):
+    """
+    Parse the mocked trace in chunks, each chunk is parsed by a
+    fresh worker parser and merged as ParallelTraceParser does.
+    If a store path is given the merged graph is streamed to it.
+    """
+    parallel = PointerProvenanceParser(Graph(directed=True), "no_file",
+                                       **kwargs)
+    if store is not None:
+        parallel.stream_to(store, flush_interval=8)
+    ranges = ParallelTraceParser(parallel, workers=1,
+                                 chunks=n_chunks).split(0, n_entries - 1)
+    parallel.before_parse(0, n_entries - 1)
+    for start, end in ranges:
+        core_parser._worker_parser = PointerProvenanceParser(
+            Graph(directed=True), "no_file", **kwargs)
+        partial = core_parser._parse_chunk((start, end, {}))
+        core_parser._worker_parser = None
+        parallel.merge_partial(pickle.loads(pickle.dumps(partial)))
+    parallel.after_parse(0, n_entries - 1)
+    return parallel
+
+
+@pytest.mark.parametrize("deref_stats", [False, True])
+@pytest.mark.parametrize("n_chunks", [2, 5, 16])
+def test_parallel_graph(trace, n_chunks, deref_stats):
+    # stitching the chunks gives the same graph as a sequential parse
+    sequential = PointerProvenanceParser(Graph(directed=True), "no_file",
+                                         deref_stats=deref_stats)
+    sequential.parse(0, trace - 1)
+    parallel = parse_parallel(trace, n_chunks, deref_stats=deref_stats)
+
+    expect = graph_state(sequential)
+    assert len(expect["props"]["gid"]) > 50
+    if deref_stats:
+        assert sum(expect["props"]["n_load"]) > 0
+    assert graph_state(parallel) == expect
+
+
+def make_intern_trace():
+    """Trace that loads the same capability from different locations."""
+    instructions = [("eret", []),
+                    ("clc", [cap(1), gpr(0), imm(0), cap(2)]),
+                    ("csc", [cap(1), gpr(0), imm(0), cap(2)])]
+    entries = [(_FakeEntry(0, 0), _FakeRegs(0)),
+               (_FakeEntry(1, 1, memory_address=0x1000, is_load=True,
+                           capreg=1), _FakeRegs(1)),
+               (_FakeEntry(2, 1, memory_address=0x2000, is_load=True,
+                           capreg=1), _FakeRegs(1)),
+               (_FakeEntry(3, 2, memory_address=0x3000, is_store=True),
+                _FakeRegs(1)),
+               (_FakeEntry(4, 1, memory_address=0x4000, is_load=True,
+                           capreg=1), _FakeRegs(1))]
+    return instructions, entries
+
+
+def test_intern_roots():
+    # the same capability loaded from different locations is a single root
+    instructions, entries = make_intern_trace()
+    graphs = {}
+    with mock_trace(instructions, entries):
+        for intern_roots in (False, True):
+            parser = PointerProvenanceParser(Graph(directed=True), "no_file",
+                                             intern_roots=intern_roots)
+            parser.parse(0, len(entries) - 1)
+            graphs[intern_roots] = parser
+    assert (graphs[False].dataset.num_vertices() ==
+            graphs[True].dataset.num_vertices() + 2)
+    parser = graphs[True]
+    memory = parser.regset.memory_map
+    assert memory[0x1000] == memory[0x2000] == memory[0x3000]
+    node_data = parser.node_data[memory[0x1000]]
+    assert list(node_data.address.values()) == [0x3000]
+
+
+@pytest.mark.parametrize("n_chunks", [2, 5])
+def test_parallel_intern_roots(n_chunks):
+    # the roots created by the workers are interned when merging
+    instructions, entries = make_intern_trace()
+    with mock_trace(instructions, entries):
+        sequential = PointerProvenanceParser(Graph(directed=True), "no_file",
+                                             intern_roots=True)
+        sequential.parse(0, len(entries) - 1)
+        parallel = parse_parallel(len(entries), n_chunks, intern_roots=True)
+    assert graph_state(parallel) == graph_state(sequential)
+    assert parallel.root_index == sequential.root_index
+
+
+def test_syscall_stack():
+    # a system call made before the return of another one is tracked
+    # separately and restarted system calls are tracked once
+    instructions = [("eret", []), ("syscall", []),
+                    ("daddiu", [gpr(2), gpr(2), imm(1)])]
+    trace = [(0, 0x400000, None), (1, 0x400100, 477),
+             (2, 0x500000, None), (1, 0x400200, 73),
+             (1, 0x400200, 73), (2, 0x400204, None),
+             (2, 0x400104, None), (2, 0x400108, None)]
+    entries = []
+    for idx, (inst, pc, code) in enumerate(trace):
+        entry = _FakeEntry(idx, inst)
+        entry.pc = pc
+        regs = _FakeRegs(idx)
+        regs.gpr[1] = code or 0
+        entries.append((entry, regs))
+    with mock_trace(instructions, entries):
+        parser = PointerProvenanceParser(Graph(directed=True), "no_file")
+        parser.parse(0, 3)
+        assert [frame[0] for frame in parser.syscall_context.stack] == [
+            477, 73]
+        parser.parse(4, len(entries) - 1)
+    assert not parser.syscall_context.in_syscall
+    node_data = parser.node_data
+    origins = {int(v): node_data[v].origin
+               for v in parser.dataset.vertices()}
+    munmap = [v for v, o in origins.items() if o == CheriNodeOrigin.SYS_MUNMAP]
+    mmap = [v for v, o in origins.items() if o == CheriNodeOrigin.SYS_MMAP]
+    assert len(munmap) == 2
+    assert len(mmap) == 1
+    # mmap returns after munmap with the capability in $c3
+    assert node_data[mmap[0]].cap.t_alloc == entries[6][0].cycles
+    assert node_data[mmap[0]].cap.base == 0x10000 * 6 + 0x300
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_resume(seed):
+    # parsing a trace in two segments, resuming from the state saved
+    # at the end of the first, gives the same graph as a single parse
+    instructions, entries = make_trace(300, seed)
+    with mock_trace(instructions, entries):
+        sequential = PointerProvenanceParser(Graph(directed=True), "no_file")
+        sequential.parse(0, len(entries) - 1)
+
+    split = len(entries) // 3
+    with mock_trace(instructions, entries[:split]):
+        first = PointerProvenanceParser(Graph(directed=True), "no_file")
+        first.parse()
+        state = pickle.loads(pickle.dumps(first.get_resume_state()))
+    assert state["next_entry"] == split
+    with mock_trace(instructions, entries[split:]):
+        second = PointerProvenanceParser(first.dataset, "no_file")
+        second.restore_resume_state(state)
+        second.parse(0)
+    assert graph_state(second) == graph_state(sequential)
+
+
+def stored_state(path):
+    """Comparable content of a graph in a provenance store."""
+    graph = load_provenance_graph(path)
+    node_data = NodeDataMap(graph)
+    return {
+        "props": {name: node_data.array(name).tolist()
+                  for name, value_type in node_data.columns},
+        "edges": sorted((int(e.source()), int(e.target()))
+                        for e in graph.edges()),
+        "events": sorted(node_data.events.events().tolist()),
+    }
+
+
+def expect_stored_state(parser):
+    """The stored_state of the graph of a sequential parse."""
+    expect = graph_state(parser)
+    return {"props": expect["props"], "edges": expect["edges"],
+            "events": sorted(expect["events"])}
+
+
+@pytest.mark.parametrize("flush_interval", [8, 2**16])
+def test_stream(tmpdir, flush_interval):
+    # the streamed graph loaded from the store is the same as the
+    # graph of a sequential parse
+    instructions, entries = make_trace(300, 1)
+    with mock_trace(instructions, entries):
+        sequential = PointerProvenanceParser(Graph(directed=True), "no_file")
+        sequential.parse(0, len(entries) - 1)
+
+        path = str(tmpdir.join("store"))
+        streamed = PointerProvenanceParser(Graph(directed=True), "no_file")
+        streamed.stream_to(path, flush_interval=flush_interval)
+        streamed.parse(0, len(entries) - 1)
+    assert streamed.dataset.num_vertices() == 0
+    assert streamed.regset.pcc is None
+
+    expect = expect_stored_state(sequential)
+    assert len(expect["props"]["gid"]) > 50
+    assert stored_state(path) == expect
+
+
+class _EntryCounter(CallbackTraceParser):
+
+    def scan_all(self, inst, entry, regs, last_regs, idx):
+        self.dataset.append(idx)
+        return False
+
+
+def test_composite_stream(tmpdir):
+    # a streaming parser in a composite parser finalizes the store
+    instructions, entries = make_trace(300, 2)
+    path = str(tmpdir.join("store"))
+    with mock_trace(instructions, entries):
+        sequential = PointerProvenanceParser(Graph(directed=True), "no_file")
+        sequential.parse(0, len(entries) - 1)
+
+        streamed = PointerProvenanceParser(Graph(directed=True), "no_file")
+        streamed.stream_to(path, flush_interval=8)
+        counter = _EntryCounter([], "no_file")
+        composite = CompositeTraceParser([streamed, counter])
+        composite.parse(0, len(entries) - 1)
+    assert counter.dataset == list(range(len(entries)))
+    assert streamed.writer is None
+    assert streamed.next_entry == len(entries)
+    assert streamed.resume_state["next_entry"] == len(entries)
+    # the members see the previous register set of the composite
+    assert streamed._last_regs is entries[-1][1]
+    assert counter._last_regs is entries[-1][1]
+    assert stored_state(path) == expect_stored_state(sequential)
+
+
+def test_parallel_stream_error(tmpdir):
+    # a chunk that fails in the worker is parsed again when merging,
+    # the streamed graph is the same as the graph of a sequential parse
+    instructions, entries = make_trace(300, 3)
+    fail_idx = len(entries) // 2
+    reparsed = []
+    scan_all = PointerProvenanceParser.scan_all
+
+    def failing_scan_all(self, inst, entry, regs, last_regs, idx):
+        if idx == fail_idx:
+            if self.chunk_context is not None:
+                raise RuntimeError("Chunk error")
+            reparsed.append(idx)
+        return scan_all(self, inst, entry, regs, last_regs, idx)
+
+    path = str(tmpdir.join("store"))
+    with mock_trace(instructions, entries):
+        sequential = PointerProvenanceParser(Graph(directed=True), "no_file")
+        sequential.parse(0, len(entries) - 1)
+        with mock.patch.object(PointerProvenanceParser, "scan_all",
+                               failing_scan_all):
+            streamed = parse_parallel(len(entries), 5, store=path)
+    assert reparsed == [fail_idx]
+    assert streamed.writer is None
+    assert streamed.dataset.num_vertices() == 0
+    assert streamed.next_entry == len(entries)
+    assert streamed.resume_state["next_entry"] == len(entries)
+    assert stored_state(path) == expect_stored_state(sequential)
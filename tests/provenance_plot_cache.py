@@ -0,0 +1,97 @@
+"""
+Test the caching of the raw and post-processed provenance graph
+in the provenance plots
+"""
+
+import pytest
+from unittest import mock
+
+from cheriplot.core.cache import CacheManager, set_cache_manager
+from cheriplot.core.provenance import CheriNodeOrigin
+from cheriplot.plot.provenance.parser import PointerProvenanceParser
+from cheriplot.plot.provenance.provenance_plot import PointerProvenancePlot
+
+from provenance_helpers import make_graph, filtered_state
+
+
+def fake_parse(plot):
+    # root -> cfromptr -> csetbounds and a null capability
+    plot.dataset = make_graph({
+        "origin": [CheriNodeOrigin.ROOT, CheriNodeOrigin.FROMPTR,
+                   CheriNodeOrigin.SETBOUNDS, CheriNodeOrigin.ROOT],
+        "base": [0x1000, 0x1000, 0x1000, 0],
+        "length": [0x100, 0x100, 0x10, 0],
+    }, [(0, 1), (1, 2)])
+    plot.parser = PointerProvenanceParser(plot.dataset, plot.tracefile)
+
+
+@pytest.fixture
+def tracefile(tmpdir):
+    trace = tmpdir.join("trace.cvtrace")
+    trace.write("trace" * 2**14)
+    set_cache_manager(CacheManager(str(tmpdir.join("cache"))))
+    with mock.patch("pycheritrace.trace") as mock_trace:
+        mock_trace.open.return_value.size.return_value = 4
+        yield str(trace)
+    set_cache_manager(None)
+
+
+@pytest.fixture
+def build():
+    """Build the dataset of a plot, return the parse and filter calls."""
+
+    def _build(tracefile, **kwargs):
+        plot = PointerProvenancePlot(tracefile, cache=True)
+        for name, value in kwargs.items():
+            setattr(plot, name, value)
+        with mock.patch.object(PointerProvenancePlot, "_parse",
+                               autospec=True,
+                               side_effect=fake_parse) as parse, \
+             mock.patch.object(PointerProvenancePlot, "_filter_dataset",
+                               autospec=True,
+                               side_effect=PointerProvenancePlot._filter_dataset
+                               ) as filter_dataset:
+            plot.build_dataset()
+        return plot, parse.call_count, filter_dataset.call_count
+
+    return _build
+
+
+def test_filtered_cache(tracefile, build):
+    plot, n_parse, n_filter = build(tracefile)
+    assert (n_parse, n_filter) == (1, 1)
+    expect = filtered_state(plot.dataset)
+    assert expect == {
+        "vertices": [0, 2],
+        "origin": [CheriNodeOrigin.ROOT, CheriNodeOrigin.PTR_SETBOUNDS],
+        "edges": [(0, 2)],
+    }
+
+    # the filtered graph is loaded from the cache
+    plot, n_parse, n_filter = build(tracefile)
+    assert (n_parse, n_filter) == (0, 0)
+    assert filtered_state(plot.dataset) == expect
+    assert "filtered" not in plot.dataset.vp
+
+
+@pytest.mark.parametrize("change,calls", [
+    # the options change the provenance graph, the trace is parsed again
+    ("options", (1, 1)),
+    # the parsing is resumed on the appended entries
+    ("trace", (0, 1)),
+    # the cached provenance graph is filtered again
+    ("version", (0, 1)),
+])
+def test_filtered_cache_stale(tracefile, build, change, calls):
+    build(tracefile)
+    kwargs = {}
+    if change == "options":
+        kwargs["deref_stats"] = True
+    elif change == "trace":
+        with open(tracefile, "a") as fd:
+            fd.write("more entries")
+    else:
+        kwargs["filter_version"] = PointerProvenancePlot.filter_version + 1
+    plot, n_parse, n_filter = build(tracefile, **kwargs)
+    assert (n_parse, n_filter) == calls
+    assert filtered_state(plot.dataset)["vertices"] == [0, 2]
@@ -0,0 +1,99 @@
+"""
+Benchmark for the overlap queries of the :class:`RangeSet` interval tree.
+
+The ranges are generated randomly with the layout produced by
+:meth:`OmitRangeSetBuilder._update_regions`: disjoint ranges that are
+split and merged as new ranges are inserted.
+The tree is checked against the linear scans of the list-based RangeSet
+it replaces, the comparison is only done on the smallest size since the
+list scans are quadratic.
+Run with: python tests/rangeset_benchmark.py [n_ranges ...]
+The default sizes are 10^5 and 10^6, 10^7 ranges need several GB of memory.
+"""
+
+import random
+import sys
+import timeit
+
+from cheriplot.core.addrspace_axes import RangeSet, Range
+
+
+def make_ranges(n_ranges, seed=1):
+    """Generate n_ranges disjoint ranges in random order."""
+    rnd = random.Random(seed)
+    ranges = []
+    addr = 0
+    for _ in range(n_ranges):
+        addr += rnd.randrange(0x10, 0x1000)
+        size = rnd.randrange(0x10, 0x1000)
+        ranges.append(Range(addr, addr + size, Range.T_OMIT))
+        addr += size
+    rnd.shuffle(ranges)
+    return ranges, addr
+
+
+def make_queries(n_queries, max_addr, seed=2):
+    rnd = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        start = rnd.randrange(max_addr)
+        queries.append(Range(start, start + rnd.randrange(0x10, 0x4000)))
+    return queries
+
+
+def _legacy_match(ranges, target):
+    """Overlap query of the list-based RangeSet."""
+    return [r for r in ranges if (r.start < target.end and
+                                  r.end > target.start)]
+
+
+def _churn(range_set, queries):
+    """
+    Replace every range overlapping a query with its left part,
+    as the omit range builders do.
+    """
+    for target in queries:
+        for r in range_set.match_overlap_range(target):
+            range_set.remove(r)
+            if r.start < target.start:
+                range_set.append(Range(r.start, target.start, r.rtype))
+
+
+def check_legacy(n_ranges=10**4, n_queries=10**3):
+    """Check the overlap queries against the linear scans."""
+    ranges, max_addr = make_ranges(n_ranges)
+    range_set = RangeSet(ranges)
+    queries = make_queries(n_queries, max_addr)
+
+    t_legacy = timeit.timeit(
+        lambda: [_legacy_match(ranges, q) for q in queries], number=1)
+    t_tree = timeit.timeit(
+        lambda: [range_set.match_overlap_range(q) for q in queries], number=1)
+    for q in queries:
+        expect = sorted(_legacy_match(ranges, q), key=lambda r: r.start)
+        assert range_set.match_overlap_range(q) == expect
+    print("%d queries on %d ranges: list %.1f ms, tree %.1f ms" % (
+        n_queries, n_ranges, t_legacy * 1e3, t_tree * 1e3))
+
+
+def bench_rangeset(n_ranges, n_queries=10**5):
+    ranges, max_addr = make_ranges(n_ranges)
+    queries = make_queries(n_queries, max_addr)
+
+    t_build = timeit.timeit(lambda: RangeSet(ranges), number=1)
+    range_set = RangeSet()
+    t_insert = timeit.timeit(lambda: range_set.extend(ranges), number=1)
+    t_match = timeit.timeit(
+        lambda: [range_set.match_overlap_range(q) for q in queries], number=1)
+    t_churn = timeit.timeit(lambda: _churn(range_set, queries), number=1)
+    print("%d ranges: build %.2f s, insert %.2f s, "
+          "%d queries %.1f us/query, update %.1f us/query" % (
+              n_ranges, t_build, t_insert, n_queries,
+              t_match / n_queries * 1e6, t_churn / n_queries * 1e6))
+
+
+if __name__ == "__main__":
+    sizes = [int(float(arg)) for arg in sys.argv[1:]] or [10**5, 10**6]
+    check_legacy()
+    for n_ranges in sizes:
+        bench_rangeset(n_ranges)
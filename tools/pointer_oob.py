@@ -46,8 +46,14 @@ class OutOfBoundPlotTool(PlotTool):
 
     description = "Out of bound pointer manipulation from cheri trace"
 
+    def init_arguments(self):
+        super().init_arguments()
+        self.parser.add_argument("-j", "--workers", type=int, default=None,
+                                 help="Number of processes used to parse "
+                                 "the trace")
+
     def _run(self, args):
-        plot = CapOutOfBoundPlot(args.trace, args.cache)
+        plot = CapOutOfBoundPlot(args.trace, args.cache, workers=args.workers)
 
         if args.outfile:
             plot.save(args.outfile)
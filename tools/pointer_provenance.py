@@ -52,6 +52,22 @@ class ProvenancePlotTool(PlotTool):
         self.parser.add_argument("-m", "--vmmap-file",
                                  help="CSV file containing the VM map dump"
                                  " generated by procstat")
+        self.parser.add_argument("--stream", action="store_true",
+                                 help="Flush the provenance graph nodes to"
+                                 " disk while parsing to bound the memory"
+                                 " usage")
+        self.parser.add_argument("-j", "--workers", type=int, default=None,
+                                 help="Number of processes used to parse "
+                                 "the trace")
+        self.parser.add_argument("--intern-roots", action="store_true",
+                                 help="Reuse the root node of identical "
+                                 "capabilities found in memory")
+        self.parser.add_argument("--deref-stats", action="store_true",
+                                 help="Keep per-capability dereference "
+                                 "statistics instead of every dereference")
+        self.parser.add_argument("--resume-from", default=None,
+                                 help="Previous trace segment, extend its"
+                                 " cached provenance graph with this trace")
 
         sub = self.parser.add_subparsers(title="plot", help="plot-type --help")
         tree = sub.add_parser("tree",
@@ -76,30 +92,43 @@ class ProvenancePlotTool(PlotTool):
         pfreq = sub.add_parser("pfreq", help="Draw frequency of reference plot")
         pfreq.set_defaults(handler=self._pfreq)
 
+    def _configure(self, plot, args):
+        """Set the provenance graph options common to all the plots."""
+        plot.stream = args.stream
+        plot.workers = args.workers
+        plot.intern_roots = args.intern_roots
+        plot.deref_stats = args.deref_stats
+        plot.resume_from = args.resume_from
+
     def _tree(self, args):
         plot = ProvenanceTreePlot(args.tree, args.trace, args.cache)
+        self._configure(plot, args)
         plot.show()
 
     def _asmap_bounds(self, args):
         plot = AddressMapCapCreatePlot(args.trace, args.cache)
+        self._configure(plot, args)
         if args.vmmap_file:
             plot.set_vmmap(args.vmmap_file)
         plot.show()
 
     def _asmap_deref(self, args):
         plot = AddressMapCapDerefPlot(args.trace, args.cache)
+        self._configure(plot, args)
         if args.vmmap_file:
             plot.set_vmmap(args.vmmap_file)
         plot.show()
 
     def _asmap_syscall(self, args):
         plot = SyscallAddressMapPlot(args.trace, args.cache)
+        self._configure(plot, args)
         if args.vmmap_file:
             plot.set_vmmap(args.vmmap_file)
         plot.show()
 
     def _pfreq(self, args):
         plot = PointedAddressFrequencyPlot(args.trace, args.cache)
+        self._configure(plot, args)
         if args.vmmap_file:
             plot.set_vmmap(args.vmmap_file)
         plot.show()
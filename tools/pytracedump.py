@@ -40,6 +40,8 @@ from cheriplot.dbg.call_graph import CallGraphTraceParser, call_graph_backtrace
 from cheriplot.plot.call_graph import CallGraphPlot
 from cheriplot.graph.call_graph import CallGraphAddSymbols
 from cheriplot.core.tool import Tool
+from cheriplot.core.columns import TraceColumns, TraceColumnExtractor
+from cheriplot.core.opcode_index import OpcodeIndex, get_opcode_index_path
 
 logger = logging.getLogger(__name__)
 
@@ -132,6 +134,16 @@ class PyTraceDump(Tool):
         sub_scan.add_argument("-B", type=int, default=0,
                               help="Dump n instructions before a"
                               " matching one, default=0")
+        sub_scan.add_argument("--extract-columns", action="store_true",
+                              help="Extract the trace entry fields in a"
+                              " sidecar directory of the trace before"
+                              " scanning, the sidecar is used to skip"
+                              " entries that can not match when it exists")
+        sub_scan.add_argument("--build-index", action="store_true",
+                              help="Build the opcode index of the trace in a"
+                              " sidecar directory before scanning, the"
+                              " index is used to jump to the matches of"
+                              " --instr and --syscall when it exists")
 
         # trace backtrace arguments
         sub_back.set_defaults(operation=self._backtrace)
@@ -178,6 +190,18 @@ class PyTraceDump(Tool):
             mem_start = args.mem_after
             mem_end = args.mem_before
 
+        if args.extract_columns:
+            columns = TraceColumnExtractor(args.trace).extract()
+        else:
+            columns = TraceColumns.open(args.trace)
+        if args.build_index:
+            if columns is None:
+                columns = TraceColumnExtractor(args.trace).extract()
+            opcode_index = OpcodeIndex.build(
+                columns, get_opcode_index_path(args.trace))
+        else:
+            opcode_index = OpcodeIndex.open(args.trace)
+
         dump_parser = TraceDumpParser(None, args.trace,
                                       dump_registers=args.show_regs,
                                       match_opcode=args.instr,
@@ -192,7 +216,9 @@ class PyTraceDump(Tool):
                                       match_perm=args.perms,
                                       match_mode=match_mode,
                                       before=args.B,
-                                      after=args.A)
+                                      after=args.A,
+                                      columns=columns,
+                                      opcode_index=opcode_index)
         if args.info:
             print("Trace size: %d" % len(dump_parser))
             exit()